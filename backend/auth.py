@@ -1,34 +1,98 @@
 from datetime import datetime, timedelta
-from typing import Optional, Union
+from typing import Dict, Optional, Union
 from fastapi import HTTPException, Security, status, Depends, Request
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer, APIKeyHeader
-from passlib.context import CryptContext
 from jose import JWTError, jwt
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import bcrypt
+import hashlib
+import hmac
+import logging
 import os
 import secrets
+import threading
+import time
 from models import User, TokenData
 from config import get_config, get_user_data
 
 # Security
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
+# verify_auth accepts an API key instead, so a missing bearer token is not an error there
+optional_security = HTTPBearer(auto_error=False)
 api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
 
 # Get configuration
 config = get_config()
 
+logger = logging.getLogger(__name__)
+
 # JWT Settings
 SECRET_KEY = config.jwt_secret_key
 ALGORITHM = config.jwt_algorithm
 ACCESS_TOKEN_EXPIRE_MINUTES = config.jwt_expire_minutes
 
+# bcrypt is slow by design and releases the GIL while it works, so hashes
+# are computed on a few threads of their own rather than on the event loop
+# or the thread pool serving sync endpoints.
+password_pool = ThreadPoolExecutor(max_workers=config.password_hash_workers, thread_name_prefix="password-hash")
+
+def _password_bytes(password: str) -> bytes:
+    # bcrypt only reads the first 72 bytes; newer releases refuse longer input
+    return password.encode("utf-8")[:72]
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify a password against its hash."""
-    return pwd_context.verify(plain_password, hashed_password)
+    """Verify a password against its hash. Blocks for as long as hashing takes."""
+    try:
+        return bcrypt.checkpw(_password_bytes(plain_password), hashed_password.encode("ascii"))
+    except ValueError:
+        return False
 
 def get_password_hash(password: str) -> str:
-    """Hash a password."""
-    return pwd_context.hash(password)
+    """Hash a password with the configured cost. Blocks for as long as hashing takes."""
+    return bcrypt.hashpw(_password_bytes(password), bcrypt.gensalt(config.password_hash_rounds)).decode("ascii")
+
+def _hash_rounds(hashed_password: str) -> Optional[int]:
+    """Return the cost a bcrypt hash was made with."""
+    try:
+        return int(hashed_password.split("$")[2])
+    except (IndexError, ValueError):
+        return None
+
+async def hash_password(password: str) -> str:
+    """Hash a password on the password pool."""
+    return await asyncio.get_running_loop().run_in_executor(password_pool, get_password_hash, password)
+
+async def check_password(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password against its hash on the password pool."""
+    return await asyncio.get_running_loop().run_in_executor(
+        password_pool, verify_password, plain_password, hashed_password
+    )
+
+async def authenticate_user(email: str, password: str) -> bool:
+    """Check login credentials against the configured user.
+
+    The password is verified against the stored hash on the password
+    pool, and the hash is redone if ``PASSWORD_HASH_ROUNDS`` has changed
+    since. A plaintext password, from ``BLOTATO_USER_PASSWORD`` or a config
+    file written by an earlier version, is compared in constant time; the
+    config file then gets a hash in its place.
+    """
+    user = config.user_config
+    if user is None or user.email != email:
+        return False
+    if user.password_hash:
+        if not await check_password(password, user.password_hash):
+            return False
+        if _hash_rounds(user.password_hash) == config.password_hash_rounds:
+            return True
+    elif user.password is None or not hmac.compare_digest(password.encode("utf-8"), user.password.encode("utf-8")):
+        return False
+    if not config.user_from_env:
+        upgraded = user.copy(update={"password": None, "password_hash": await hash_password(password)})
+        config.save_user_config(upgraded)
+    return True
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create a JWT token."""
@@ -38,7 +102,8 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     
-    to_encode.update({"exp": expire})
+    # The token ID lets a single token be revoked
+    to_encode.update({"exp": expire, "jti": secrets.token_urlsafe(16)})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
@@ -46,22 +111,346 @@ def generate_api_key() -> str:
     """Generate a new API key."""
     return secrets.token_urlsafe(config.api_key_length)
 
-async def validate_api_key(api_key: str) -> bool:
-    """Validate an API key."""
-    from storage import api_keys_collection
+def hash_api_key(api_key: str) -> str:
+    """Return the keyed digest an API key is stored and looked up by.
+
+    Keys are random, so a single HMAC-SHA256 pass keyed with
+    ``API_KEY_SECRET`` is enough: a leaked ``api_keys`` collection reveals
+    neither the keys nor a way to check guesses without the secret.
+    """
+    return hmac.new(config.api_key_secret, api_key.encode("utf-8"), hashlib.sha256).hexdigest()
+
+def api_key_preview(api_key: str) -> str:
+    """Return the part of an API key kept to tell keys apart in listings."""
+    return api_key[:8] + "..."
+
+class APIKeyIndex:
+    """Active API keys by digest, held in memory so requests never touch storage.
+
+    The index is built from the ``api_keys`` collection at startup and
+    updated by the routes that create and revoke keys. Worker processes
+    sharing the data directory each hold their own copy, so with
+    ``STORAGE_SHARED`` every copy is also rebuilt in the background every
+    ``API_KEY_SYNC_S`` seconds to pick up keys created or revoked by the
+    others.
+    """
+
+    def __init__(self):
+        self._keys: Dict[str, Dict] = {}
+        # Key ID -> digest, so a revoked key is found without a scan
+        self._digests: Dict[str, str] = {}
+        self._syncer: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def get(self, api_key: str) -> Optional[Dict]:
+        """Return the record of an active API key, or ``None``."""
+        return self._keys.get(hash_api_key(api_key))
+
+    def add(self, record: Dict):
+        """Index a newly created key."""
+        if record.get("is_active", True):
+            self._keys[record["key_digest"]] = record
+            self._digests[record["_id"]] = record["key_digest"]
+
+    def remove(self, key_id: str):
+        """Drop a revoked key."""
+        digest = self._digests.pop(key_id, None)
+        if digest is not None:
+            self._keys.pop(digest, None)
+
+    async def load(self):
+        """Rebuild the index from storage.
+
+        Keys stored in plaintext by earlier versions are replaced by their
+        digest first.
+        """
+        from storage import api_keys_collection
+
+        records = await api_keys_collection.find({})
+        plaintext = [record for record in records if "key" in record]
+        if plaintext:
+            operations = []
+            for record in plaintext:
+                key = record.pop("key")
+                record["key_digest"] = hash_api_key(key)
+                record["key_preview"] = api_key_preview(key)
+                operations.append({"delete_one": {"filter": {"_id": record["_id"]}}})
+                operations.append({"insert_one": {"document": dict(record)}})
+            await api_keys_collection.bulk_write(operations)
+            logger.info(f"Replaced {len(plaintext)} plaintext API key(s) with their digest")
+        active = [record for record in records if record.get("is_active")]
+        self._keys = {record["key_digest"]: record for record in active}
+        self._digests = {record["_id"]: record["key_digest"] for record in active}
+
+    def start_sync(self, interval: float):
+        """Rebuild the index every ``interval`` seconds until :meth:`stop_sync`."""
+        async def sync():
+            while True:
+                await asyncio.sleep(interval)
+                try:
+                    await self.load()
+                except Exception:
+                    logger.exception("Failed to reload API keys")
+
+        if self._syncer is None and interval > 0:
+            self._syncer = asyncio.get_running_loop().create_task(sync())
+
+    async def stop_sync(self):
+        if self._syncer is not None:
+            self._syncer.cancel()
+            await asyncio.gather(self._syncer, return_exceptions=True)
+            self._syncer = None
+
+api_key_index = APIKeyIndex()
+
+class APIKeyUsage:
+    """Write-behind record of when and how often each API key is used.
+
+    Requests only note the time and bump a counter in memory. The totals
+    are written to the ``api_keys`` collection in one bulk write every
+    ``API_KEY_USAGE_FLUSH_S`` seconds and at shutdown, setting
+    ``last_used`` and adding to ``request_count``, so worker processes
+    can flush the same key without losing each other's counts. Usage
+    since the last flush is lost if the process dies.
+    """
+
+    def __init__(self):
+        # Key id -> [last used, requests since the last flush]
+        self._pending: Dict[str, list] = {}
+        self._flusher: Optional[asyncio.Task] = None
+
+    def record(self, key_id: str):
+        """Note one request made with a key."""
+        entry = self._pending.get(key_id)
+        if entry is None:
+            self._pending[key_id] = [datetime.utcnow(), 1]
+        else:
+            entry[0] = datetime.utcnow()
+            entry[1] += 1
+
+    def usage(self, record: Dict) -> tuple:
+        """Return ``(last_used, request_count)`` of a stored key, including unflushed use."""
+        last_used, count = record.get("last_used"), record.get("request_count", 0)
+        entry = self._pending.get(record["_id"])
+        if entry is not None:
+            last_used, count = entry[0], count + entry[1]
+        return last_used, count
+
+    async def flush(self):
+        """Write the usage recorded since the last flush."""
+        from storage import BulkWriteError, api_keys_collection
+
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            await api_keys_collection.bulk_write([
+                {"update_one": {
+                    "filter": {"_id": key_id},
+                    "update": {"$set": {"last_used": last_used}, "$inc": {"request_count": count}},
+                }}
+                for key_id, (last_used, count) in pending.items()
+            ], ordered=False)
+        except BulkWriteError as exc:
+            # The other updates were applied; keep only the failed ones
+            items = list(pending.items())
+            self._requeue(items[error["index"]] for error in exc.errors)
+            raise
+        except Exception:
+            self._requeue(pending.items())
+            raise
+
+    def _requeue(self, usage):
+        """Keep unsaved usage for the next flush, along with anything recorded since."""
+        for key_id, (last_used, count) in usage:
+            entry = self._pending.setdefault(key_id, [last_used, 0])
+            entry[1] += count
+
+    def start(self, interval: float):
+        """Flush every ``interval`` seconds until :meth:`stop`."""
+        async def flush_periodically():
+            while True:
+                await asyncio.sleep(interval)
+                try:
+                    await self.flush()
+                except Exception:
+                    logger.exception("Failed to save API key usage")
+
+        if self._flusher is None and interval > 0:
+            self._flusher = asyncio.get_running_loop().create_task(flush_periodically())
 
-    key_data = await api_keys_collection.find_one({"key": api_key, "is_active": True})
+    async def stop(self):
+        """Stop flushing periodically and write what is left."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        await self.flush()
+
+api_key_usage = APIKeyUsage()
+
+async def validate_api_key(api_key: str) -> bool:
+    """Validate an API key against the in-memory index."""
+    key_data = api_key_index.get(api_key)
     if key_data:
-        # Update last used timestamp
-        await api_keys_collection.update_one(
-            {"key": api_key},
-            {"$set": {"last_used": datetime.utcnow()}}
-        )
+        api_key_usage.record(key_data["_id"])
         return True
     return False
 
+class TokenCache:
+    """Bounded LRU cache of verified JWTs, so a reused token is checked once.
+
+    Entries are keyed by a digest of ``SECRET_KEY`` and the token, and hold
+    its subject, ID and expiry; an expired entry is dropped when it is next
+    looked up. A token verified under one secret is not found once the
+    secret changes. The dependencies using it run on FastAPI's thread
+    pool, hence the lock.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._entries: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(SECRET_KEY.encode("utf-8") + b"\0" + token.encode("utf-8")).digest()
+
+    def get(self, token: str) -> Optional[tuple]:
+        """Return ``(subject, token ID)`` of a token verified earlier, or ``None``."""
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            user_id, token_id, expires = entry
+            if expires <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return user_id, token_id
+
+    def put(self, token: str, user_id: str, token_id: str, expires: float):
+        """Remember a verified token until it ``expires`` (a Unix time)."""
+        if self.size <= 0:
+            return
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (user_id, token_id, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def discard(self, token: str):
+        """Forget a token."""
+        with self._lock:
+            self._entries.pop(self._key(token), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+token_cache = TokenCache(config.jwt_cache_size)
+
+def token_id(token: str, claims: Dict) -> str:
+    """Return the ID a token is revoked by: its ``jti``, or a digest for older tokens without one."""
+    return claims.get("jti") or hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+class TokenRevocations:
+    """IDs of revoked tokens that have not expired yet, held in memory.
+
+    Revocations are stored in the ``revoked_tokens`` collection, one small
+    document per token holding its ID and expiry, and loaded at startup,
+    so checking a token is one set lookup with no storage access. A
+    background task drops revocations of expired tokens, which their
+    ``exp`` already rejects, from memory and storage every
+    ``TOKEN_REVOCATION_SYNC_S`` seconds; with ``STORAGE_SHARED`` it also
+    reloads the revocations made by other worker processes.
+    """
+
+    def __init__(self):
+        # Token ID -> expiry
+        self._revoked: Dict[str, datetime] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._revoked)
+
+    def is_revoked(self, token_id: str) -> bool:
+        return token_id in self._revoked
+
+    async def revoke(self, token_id: str, expires_at: datetime):
+        """Revoke a token until it expires."""
+        from storage import DuplicateKeyError, revoked_tokens_collection
+
+        self._revoked[token_id] = expires_at
+        try:
+            await revoked_tokens_collection.insert_one({"_id": token_id, "expires_at": expires_at})
+        except DuplicateKeyError:
+            pass
+
+    async def load(self):
+        """Reload the revocations of tokens that have not expired."""
+        from storage import revoked_tokens_collection
+
+        records = await revoked_tokens_collection.find(
+            {"expires_at": {"$gt": datetime.utcnow()}}, projection=["expires_at"]
+        )
+        self._revoked = {record["_id"]: record["expires_at"] for record in records}
+
+    async def prune(self):
+        """Forget the revocations of tokens that have expired."""
+        from storage import revoked_tokens_collection
+
+        now = datetime.utcnow()
+        expired = [token_id for token_id, expires_at in self._revoked.items() if expires_at <= now]
+        if expired:
+            for token_id in expired:
+                self._revoked.pop(token_id, None)
+            await revoked_tokens_collection.delete_many({"expires_at": {"$lte": now}})
+
+    def start(self, interval: float, shared: bool):
+        """Prune, and reload if ``shared``, every ``interval`` seconds until :meth:`stop`."""
+        async def maintain():
+            while True:
+                await asyncio.sleep(interval)
+                try:
+                    if shared:
+                        await self.load()
+                    await self.prune()
+                except Exception:
+                    logger.exception("Failed to refresh revoked tokens")
+
+        if self._task is None and interval > 0:
+            self._task = asyncio.get_running_loop().create_task(maintain())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+token_revocations = TokenRevocations()
+
+async def revoke_token(token: str):
+    """Revoke a token that :func:`verify_token` accepted, such as on logout."""
+    claims = jwt.get_unverified_claims(token)
+    expires = claims.get("exp")
+    if isinstance(expires, (int, float)):
+        expires_at = datetime.utcfromtimestamp(expires)
+    else:
+        expires_at = datetime.max
+    token_cache.discard(token)
+    await token_revocations.revoke(token_id(token, claims), expires_at)
+
 def verify_token(credentials: HTTPAuthorizationCredentials = Security(security)):
-    """Verify JWT token and return user_id."""
+    """Verify JWT token and return user_id.
+
+    Tokens verified before are answered from :data:`token_cache`; either
+    way the token must not have been revoked.
+    """
     token = credentials.credentials
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -69,6 +458,13 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Security(security))
         headers={"WWW-Authenticate": "Bearer"},
     )
 
+    cached = token_cache.get(token)
+    if cached is not None:
+        user_id, revocation_id = cached
+        if token_revocations.is_revoked(revocation_id):
+            raise credentials_exception
+        return user_id
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
@@ -78,6 +474,13 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Security(security))
     except JWTError:
         raise credentials_exception
 
+    revocation_id = token_id(token, payload)
+    if token_revocations.is_revoked(revocation_id):
+        raise credentials_exception
+
+    # Only tokens that expire are cached
+    if isinstance(payload.get("exp"), (int, float)):
+        token_cache.put(token, token_data.user_id, revocation_id, payload["exp"])
     return token_data.user_id
 
 async def verify_api_key(api_key: str = Security(api_key_header)):
@@ -100,7 +503,7 @@ async def verify_api_key(api_key: str = Security(api_key_header)):
 
 async def verify_auth(
     request: Request,
-    jwt_credentials: HTTPAuthorizationCredentials = Security(security),
+    jwt_credentials: Optional[HTTPAuthorizationCredentials] = Security(optional_security),
     api_key: str = Security(api_key_header)
 ) -> str:
     """Verify either JWT token or API key authentication."""
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Blotato Single User - Backups
+
+Online backups of every collection, taken from a storage snapshot so
+writes carry on while they run, and restores from them. Backups can be
+taken through the API (``routes/backup.py``) or from the backend
+directory while the server runs; the command line then reads the file
+engine read-only, so it never touches the server's files:
+
+    python backup.py create
+    python backup.py create --incremental
+    python backup.py list
+    python backup.py restore                           # latest backup
+    python backup.py restore --at 2026-10-17T12:00:00  # latest backup by then
+    python backup.py restore backups/blotato-20261017T120000000000Z-full.tar.gz
+
+Backups are gzip-compressed tar archives in BACKUP_DIR holding:
+
+- ``manifest.json``: the backup's id, kind and creation time, and for an
+  incremental backup the id of the backup it builds on;
+- ``<collection>/<n>.jsonl``: documents, one JSON object per line, in
+  chunks of up to ``CHUNK_DOCS``;
+- ``<collection>/deleted.json``: in an incremental backup, the ids of the
+  documents deleted since its base.
+
+An incremental backup holds only the documents added or changed since
+the previous backup, found by comparing a digest of every document with
+the digests recorded for that backup in ``<id>.digests.json.gz`` next to
+its archive. Restoring a backup applies its chain, from the last full
+backup onwards, to the storage engine configured by the environment,
+which should not be serving requests meanwhile.
+"""
+
+import argparse
+import asyncio
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import tarfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from storage import COLLECTIONS, FileStorage, StorageEngine, _file_storage_from_env, storage as app_storage
+
+# Documents per archive member
+CHUNK_DOCS = 1000
+
+# gzip level of the archives; higher levels save little on JSON for much more CPU
+COMPRESS_LEVEL = 6
+
+_BACKUP_NAME = re.compile(r"blotato-(\d{8}T\d{12})Z-(full|incremental)\.tar\.gz")
+
+def backup_dir() -> Path:
+    """Return the directory backups are kept in."""
+    return Path(os.environ.get("BACKUP_DIR", "backups"))
+
+def list_backups(directory: Optional[Path] = None) -> List[Dict]:
+    """Return the backups in ``directory``, oldest first."""
+    directory = Path(directory or backup_dir())
+    backups = []
+    for path in directory.glob("blotato-*.tar.gz"):
+        match = _BACKUP_NAME.fullmatch(path.name)
+        if match:
+            backups.append({
+                "id": path.name[:-len(".tar.gz")],
+                "kind": match.group(2),
+                "created_at": datetime.strptime(match.group(1), "%Y%m%dT%H%M%S%f"),
+                "size": path.stat().st_size,
+            })
+    return sorted(backups, key=lambda backup: backup["created_at"])
+
+def _digests_path(directory: Path, backup_id: str) -> Path:
+    return directory / f"{backup_id}.digests.json.gz"
+
+def _encode_chunk(docs: List[Dict], previous: Dict[str, str], digests: Dict[str, str]) -> tuple:
+    """Serialize the documents that differ from ``previous``; record every digest.
+
+    Returns the chunk as JSON lines and how many documents it holds.
+    """
+    lines = []
+    for doc in docs:
+        line = json.dumps(dict(doc), sort_keys=True, default=str, ensure_ascii=False)
+        key = str(doc["_id"])
+        digest = hashlib.blake2b(line.encode("utf-8"), digest_size=8).hexdigest()
+        digests[key] = digest
+        if previous.get(key) != digest:
+            lines.append(line)
+    return "".join(line + "\n" for line in lines).encode("utf-8"), len(lines)
+
+def _add_member(archive: tarfile.TarFile, name: str, data: bytes):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    archive.addfile(info, io.BytesIO(data))
+
+def _write_digests(path: Path, digests: Dict[str, Dict[str, str]]):
+    tmp_path = path.with_name(path.name + ".tmp")
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        json.dump(digests, f)
+    os.replace(tmp_path, path)
+
+def _read_digests(path: Path) -> Dict[str, Dict[str, str]]:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+async def create_backup(engine: StorageEngine, incremental: bool = False,
+                        directory: Optional[Path] = None) -> Dict:
+    """Back up every collection of ``engine`` to a new archive and return its manifest.
+
+    The documents come from :meth:`StorageEngine.snapshot`, so the backup
+    is consistent across collections and writes are not held up. They are
+    serialized and compressed on a worker thread, one chunk at a time. An
+    ``incremental`` backup falls back to a full one if no earlier backup
+    has its digests recorded.
+    """
+    directory = Path(directory or backup_dir())
+    directory.mkdir(parents=True, exist_ok=True)
+    base = None
+    previous: Dict[str, Dict[str, str]] = {}
+    if incremental:
+        for candidate in reversed(list_backups(directory)):
+            digests_path = _digests_path(directory, candidate["id"])
+            if digests_path.exists():
+                base = candidate["id"]
+                previous = await asyncio.to_thread(_read_digests, digests_path)
+                break
+    created_at = datetime.utcnow()
+    kind = "full" if base is None else "incremental"
+    backup_id = f"blotato-{created_at:%Y%m%dT%H%M%S%f}Z-{kind}"
+    manifest = {
+        "format": 1,
+        "id": backup_id,
+        "kind": kind,
+        "base": base,
+        "created_at": created_at.isoformat(),
+        "engine": type(engine).__name__,
+        "collections": list(COLLECTIONS),
+    }
+    counts = {}
+    digests: Dict[str, Dict[str, str]] = {}
+
+    archive_path = directory / f"{backup_id}.tar.gz"
+    tmp_path = archive_path.with_name(archive_path.name + ".tmp")
+    archive = tarfile.open(tmp_path, "w:gz", compresslevel=COMPRESS_LEVEL)
+    try:
+        _add_member(archive, "manifest.json", json.dumps(manifest, indent=2).encode("utf-8"))
+        async with engine.snapshot() as read:
+            for collection in COLLECTIONS:
+                seen = digests[collection] = {}
+                before = previous.get(collection, {})
+                written = chunks = 0
+                async for docs in read(collection, CHUNK_DOCS):
+                    data, count = await asyncio.to_thread(_encode_chunk, docs, before, seen)
+                    if count:
+                        await asyncio.to_thread(_add_member, archive, f"{collection}/{chunks:06d}.jsonl", data)
+                        chunks += 1
+                        written += count
+                deleted = [key for key in before if key not in seen]
+                if deleted:
+                    await asyncio.to_thread(_add_member, archive, f"{collection}/deleted.json",
+                                            json.dumps(deleted).encode("utf-8"))
+                counts[collection] = {"documents": len(seen), "written": written, "deleted": len(deleted)}
+        await asyncio.to_thread(archive.close)
+    except BaseException:
+        archive.close()
+        tmp_path.unlink()
+        raise
+    await asyncio.to_thread(_write_digests, _digests_path(directory, backup_id), digests)
+    os.replace(tmp_path, archive_path)
+    return {**manifest, "size": archive_path.stat().st_size, "counts": counts}
+
+def read_manifest(path: Path) -> Dict:
+    """Return the manifest of a backup archive."""
+    with tarfile.open(path, "r|gz") as archive:
+        member = archive.next()
+        if member is None or member.name != "manifest.json":
+            raise ValueError(f"{path} is not a backup archive")
+        return json.load(archive.extractfile(member))
+
+def backup_chain(path: Path) -> List[Path]:
+    """Return the archives to apply, oldest first, to restore the backup at ``path``."""
+    chain = [Path(path)]
+    manifest = read_manifest(chain[0])
+    while manifest["base"] is not None:
+        base = chain[0].with_name(f"{manifest['base']}.tar.gz")
+        if not base.exists():
+            raise FileNotFoundError(f"{chain[0].name} builds on {base.name}, which is missing")
+        chain.insert(0, base)
+        manifest = read_manifest(base)
+    return chain
+
+async def _apply(engine: StorageEngine, path: Path, incremental: bool) -> Dict[str, int]:
+    """Apply one backup archive on top of what has been restored so far."""
+    counts = dict.fromkeys(COLLECTIONS, 0)
+    with tarfile.open(path, "r|gz") as archive:
+        for member in archive:
+            collection, _, name = member.name.partition("/")
+            if collection not in counts:
+                continue
+            data = archive.extractfile(member).read()
+            if name == "deleted.json":
+                await engine.delete_many(collection, {"_id": {"$in": json.loads(data)}})
+                continue
+            docs = [json.loads(line) for line in data.splitlines()]
+            if incremental:
+                # Documents changed since the base replace the restored versions.
+                await engine.delete_many(collection, {"_id": {"$in": [doc["_id"] for doc in docs]}})
+            await engine.insert_many(collection, docs)
+            counts[collection] += len(docs)
+    return counts
+
+async def restore_backup(engine: StorageEngine, path: Path, force: bool = False) -> List[Dict]:
+    """Restore the backup at ``path`` into ``engine``.
+
+    The collections must be empty unless ``force`` is given, in which case
+    their documents are deleted first. Returns, for every archive applied,
+    its manifest and the documents restored from it.
+    """
+    chain = backup_chain(path)
+    for collection in COLLECTIONS:
+        if await engine.find_one(collection, {}, projection=["_id"]) is not None:
+            if not force:
+                raise ValueError(f"Collection '{collection}' is not empty; restore with force to replace it")
+            await engine.delete_many(collection, {})
+    applied = []
+    for archive in chain:
+        manifest = read_manifest(archive)
+        counts = await _apply(engine, archive, manifest["kind"] == "incremental")
+        applied.append({**manifest, "counts": counts})
+    await engine.checkpoint()
+    return applied
+
+def _pick_backup(directory: Path, at: Optional[datetime]) -> Path:
+    """Return the latest backup taken no later than ``at``."""
+    if at is not None and at.tzinfo is not None:
+        at = at.astimezone(timezone.utc).replace(tzinfo=None)
+    backups = [backup for backup in list_backups(directory) if at is None or backup["created_at"] <= at]
+    if not backups:
+        raise SystemExit(f"No backup in {directory}{f' taken by {at}' if at else ''}")
+    return directory / f"{backups[-1]['id']}.tar.gz"
+
+def _backup_source() -> StorageEngine:
+    """Return the engine the command line takes backups from.
+
+    The file engine is opened again read-only: the server may be writing
+    to the same files, and a second writer would cut off or replace its
+    journals.
+    """
+    if not isinstance(app_storage, FileStorage):
+        return app_storage
+    engine = _file_storage_from_env(read_only=True)
+    engine.codecs.update(app_storage.codecs)
+    return engine
+
+def main():
+    """Create, list or restore backups."""
+    parser = argparse.ArgumentParser(description="Blotato backups")
+    parser.add_argument("--dir", type=Path, default=None, help="backup directory (default: BACKUP_DIR)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    create = commands.add_parser("create", help="back up every collection while the server runs")
+    create.add_argument("--incremental", action="store_true", help="only what changed since the last backup")
+
+    commands.add_parser("list", help="list backups, oldest first")
+
+    restore = commands.add_parser("restore", help="restore a backup into the configured storage")
+    restore.add_argument("archive", type=Path, nargs="?", help="backup to restore (default: the latest)")
+    restore.add_argument("--at", type=datetime.fromisoformat, help="restore the latest backup taken by this UTC time")
+    restore.add_argument("--force", action="store_true", help="replace collections that are not empty")
+
+    args = parser.parse_args()
+    directory = args.dir or backup_dir()
+
+    if args.command == "list":
+        for backup in list_backups(directory):
+            print(f"{backup['id']}  {backup['size'] / 2 ** 20:10.2f} MB")
+        return
+
+    engine = _backup_source() if args.command == "create" else app_storage
+
+    async def run():
+        try:
+            if args.command == "create":
+                manifest = await create_backup(engine, args.incremental, directory)
+                written = sum(count["written"] for count in manifest["counts"].values())
+                print(f"{manifest['id']}: {written:,} documents, {manifest['size'] / 2 ** 20:.2f} MB")
+            else:
+                archive = args.archive or _pick_backup(directory, args.at)
+                for applied in await restore_backup(engine, archive, args.force):
+                    print(f"{applied['id']}: {sum(applied['counts'].values()):,} documents restored")
+        finally:
+            await engine.close()
+
+    asyncio.run(run())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+"""
+Blotato Single User - Storage Benchmarks
+
+Run from the backend directory:
+
+    python bench.py topk --docs 1000000 --limit 5
+    python bench.py workers --max-workers 8
+    python bench.py mixed --rates 0,100,1000
+    python bench.py listing --body-kb 4
+    python bench.py compaction --updates 20
+    python bench.py tiering --docs 100000
+    python bench.py auth --calls 100000
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from itertools import islice
+from pathlib import Path
+
+from storage import FileStorage, _CollectionState, _compile_query, storage as app_storage
+
+def _timed(func, repeat: int) -> tuple:
+    """Run ``func`` ``repeat`` times; return its last result and the best time."""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+def bench_topk(args):
+    """Compare a full sort with heap selection for sort+limit queries."""
+    print(f"Building {args.docs:,} documents...")
+    rng = random.Random(42)
+    start = datetime(2024, 1, 1)
+    docs = {}
+    for i in range(args.docs):
+        created_at = start + timedelta(seconds=rng.randrange(365 * 86400))
+        # Mix datetimes with the strings they are stored as in JSON files
+        docs[f"doc-{i}"] = {
+            "_id": f"doc-{i}",
+            "user_id": f"user-{i % 100}",
+            "created_at": created_at if i % 2 else str(created_at),
+        }
+    state = _CollectionState(docs, 0)
+    sort = [("created_at", -1)]
+    matches = _compile_query({})
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        storage = FileStorage(data_dir)
+        try:
+            full, full_time = _timed(
+                lambda: list(islice(storage._scan(state, {}, sort, matches), args.limit)), args.repeat
+            )
+            top, top_time = _timed(
+                lambda: list(islice(storage._scan(state, {}, sort, matches, top=args.limit), args.limit)),
+                args.repeat
+            )
+        finally:
+            storage._executor.shutdown()
+
+    assert [doc["_id"] for doc in full] == [doc["_id"] for doc in top], "results differ"
+    print(f"Latest {args.limit} of {args.docs:,} (best of {args.repeat}):")
+    print(f"  full sort      {full_time * 1000:10.1f} ms")
+    print(f"  heap selection {top_time * 1000:10.1f} ms  ({full_time / top_time:.1f}x faster)")
+
+def _read_worker(data_dir: str, users: int, seconds: float, start: float, results):
+    """Run indexed dashboard queries against shared storage until time is up."""
+    async def run() -> int:
+        storage = FileStorage(data_dir, shared=True)
+        await storage.create_index("content", [("user_id", 1), ("created_at", -1)])
+        await storage.find("content", {}, limit=1)  # load before the clock starts
+        await asyncio.sleep(max(start - time.time(), 0))
+        rng = random.Random(os.getpid())
+        ops = 0
+        deadline = start + seconds
+        while time.time() < deadline:
+            await storage.find("content", {"user_id": f"user-{rng.randrange(users)}"},
+                               sort=[("created_at", -1)], limit=10)
+            ops += 1
+        await storage.close()
+        return ops
+    results.put(asyncio.run(run()))
+
+def bench_workers(args):
+    """Measure read throughput as processes sharing one data directory are added."""
+    with tempfile.TemporaryDirectory() as data_dir:
+        async def seed():
+            storage = FileStorage(data_dir, shared=True)
+            start = datetime(2024, 1, 1)
+            await storage.insert_many("content", [
+                {"_id": f"doc-{i}", "user_id": f"user-{i % args.users}", "created_at": start + timedelta(minutes=i)}
+                for i in range(args.docs)
+            ])
+            await storage.close()
+        asyncio.run(seed())
+
+        print(f"Indexed top-10 queries over {args.docs:,} documents, {args.seconds:g}s per run "
+              f"({os.cpu_count()} CPUs):")
+        baseline = None
+        workers = 1
+        while workers <= args.max_workers:
+            results = multiprocessing.Queue()
+            start = time.time() + 1 + workers * 0.2
+            processes = [
+                multiprocessing.Process(target=_read_worker,
+                                        args=(data_dir, args.users, args.seconds, start, results))
+                for _ in range(workers)
+            ]
+            for process in processes:
+                process.start()
+            ops = sum(results.get() for _ in processes)
+            for process in processes:
+                process.join()
+            rate = ops / args.seconds
+            baseline = baseline or rate
+            print(f"  {workers:2d} worker(s) {rate:12,.0f} queries/s  ({rate / baseline:.1f}x)")
+            workers *= 2
+
+def _percentile(samples: list, fraction: float) -> float:
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+def bench_mixed(args):
+    """Measure read latency while a writer updates the same collection."""
+    async def run(data_dir: str, rate: int) -> list:
+        storage = FileStorage(data_dir, durability="none")
+        await storage.create_index("content", [("user_id", 1), ("created_at", -1)])
+        start = datetime(2024, 1, 1)
+        await storage.insert_many("content", [
+            {"_id": f"doc-{i}", "user_id": f"user-{i % 100}", "created_at": start + timedelta(minutes=i)}
+            for i in range(args.docs)
+        ])
+        deadline = time.perf_counter() + args.seconds
+        rng = random.Random(42)
+
+        async def write():
+            while rate and time.perf_counter() < deadline:
+                await storage.update_one("content", {"_id": f"doc-{rng.randrange(args.docs)}"},
+                                         {"$set": {"views": rng.randrange(1000)}})
+                await asyncio.sleep(1 / rate)
+
+        async def read(latencies: list):
+            while time.perf_counter() < deadline:
+                began = time.perf_counter()
+                await storage.find("content", {"user_id": f"user-{rng.randrange(100)}"},
+                                   sort=[("created_at", -1)], limit=10)
+                latencies.append(time.perf_counter() - began)
+                await asyncio.sleep(0)
+
+        latencies = []
+        await asyncio.gather(write(), *(read(latencies) for _ in range(args.readers)))
+        await storage.close()
+        return sorted(latencies)
+
+    print(f"Indexed top-10 reads over {args.docs:,} documents with {args.readers} reader(s):")
+    for rate in args.rates:
+        with tempfile.TemporaryDirectory() as data_dir:
+            latencies = asyncio.run(run(data_dir, rate))
+        print(f"  {rate:6d} writes/s  p50 {_percentile(latencies, 0.5) * 1e6:8.0f} us"
+              f"  p99 {_percentile(latencies, 0.99) * 1e6:8.0f} us  ({len(latencies):,} reads)")
+
+def bench_listing(args):
+    """Compare eager and lazy decoding for a dashboard listing of large documents."""
+    fields = ["type", "title", "platform", "status", "engagement"]
+
+    async def seed(data_dir: str):
+        storage = FileStorage(data_dir, format="binary")
+        start = datetime(2024, 1, 1)
+        await storage.insert_many("content", [
+            {"_id": f"doc-{i}", "user_id": f"user-{i % args.users}", "type": "post", "title": f"Post {i}",
+             "platform": "twitter", "status": "published", "content": "x" * (args.body_kb * 1024),
+             "engagement": {"views": i, "likes": 0, "shares": 0}, "created_at": start + timedelta(minutes=i)}
+            for i in range(args.docs)
+        ])
+        await storage.close()
+
+    async def listing(data_dir: str, lazy: bool) -> float:
+        storage = FileStorage(data_dir, format="binary", lazy=lazy)
+        storage.register_codec("content", app_storage.codecs["content"])
+        began = time.perf_counter()
+        await storage.create_index("content", [("user_id", 1), ("created_at", -1)])
+        for user in range(args.users):
+            await storage.find("content", {"user_id": f"user-{user}"}, sort=[("created_at", -1)],
+                               limit=5, projection=fields)
+        elapsed = time.perf_counter() - began
+        await storage.close()
+        return elapsed
+
+    def traced(data_dir: str, lazy: bool) -> tuple:
+        """Time a run, then repeat it to measure peak heap use."""
+        elapsed = asyncio.run(listing(data_dir, lazy))
+        tracemalloc.start()
+        asyncio.run(listing(data_dir, lazy))
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return elapsed, peak
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        asyncio.run(seed(data_dir))
+        print(f"Load and list the latest 5 of {args.docs:,} documents with {args.body_kb} KB bodies "
+              f"for {args.users} users:")
+        for lazy in (False, True):
+            elapsed, peak = traced(data_dir, lazy)
+            print(f"  {'lazy' if lazy else 'eager'}  {elapsed * 1000:10.1f} ms  peak {peak / 2 ** 20:8.1f} MB")
+
+def bench_compaction(args):
+    """Compare file size and load time after update churn, with and without compaction."""
+    async def churn(data_dir: str, compaction: bool):
+        storage = FileStorage(data_dir, format=args.format, journal=True, snapshot_every=10 ** 9,
+                              compaction=compaction, compact_interval=0)
+        await storage.insert_many("content", [
+            {"_id": f"doc-{i}", "user_id": f"user-{i % 100}", "views": 0} for i in range(args.docs)
+        ])
+        rng = random.Random(42)
+        for views in range(1, args.updates * 100 + 1):
+            await storage.update_many("content", {"user_id": f"user-{rng.randrange(100)}"},
+                                      {"$set": {"views": views}})
+        await asyncio.gather(*storage._compacting.values())
+        stats = storage.compaction_stats()["collections"]["content"]
+        # Stop without the checkpoint close() writes, as after a crash
+        storage._executor.shutdown()
+        storage._compact_executor.shutdown()
+        return stats
+
+    async def load(data_dir: str) -> float:
+        storage = FileStorage(data_dir, format=args.format, journal=True)
+        began = time.perf_counter()
+        await storage.find("content", {}, limit=1)
+        elapsed = time.perf_counter() - began
+        await storage.close()
+        return elapsed
+
+    print(f"{args.docs:,} documents, each updated ~{args.updates} times ({args.format} files):")
+    for compaction in (False, True):
+        with tempfile.TemporaryDirectory() as data_dir:
+            stats = asyncio.run(churn(data_dir, compaction))
+            size = sum(path.stat().st_size for path in Path(data_dir).rglob("*") if path.is_file())
+            elapsed = asyncio.run(load(data_dir))
+        print(f"  compaction {'on ' if compaction else 'off'}  {size / 2 ** 20:8.1f} MB on disk"
+              f"  load {elapsed * 1000:8.1f} ms  ({stats['compactions']} compactions)")
+
+def bench_tiering(args):
+    """Compare load time, resident size and hot/cold query latency with and without tiering."""
+    policy = {"content": {"field": "created_at", "days": 90, "final": {"status": ["published"]}}}
+    now = datetime.utcnow()
+
+    async def seed(data_dir: str):
+        storage = FileStorage(data_dir, format=args.format)
+        rng = random.Random(42)
+        docs = []
+        for i in range(args.docs):
+            # Mostly old published posts, with fresh drafts on top
+            fresh = rng.random() < args.hot_share
+            docs.append({
+                "_id": f"doc-{i}", "user_id": f"user-{i % args.users}", "type": "post", "title": f"Post {i}",
+                "platform": "twitter", "status": "draft" if fresh else "published", "content": "x" * 512,
+                "engagement": {"views": i, "likes": 0, "shares": 0},
+                "created_at": now - timedelta(days=rng.uniform(0, 30) if fresh else rng.uniform(90, 1000)),
+            })
+        await storage.insert_many("content", docs)
+        await storage.close()
+
+    async def load(data_dir: str, tiering: bool) -> FileStorage:
+        storage = FileStorage(data_dir, format=args.format, tiering=policy if tiering else None, tier_interval=0)
+        storage.register_codec("content", app_storage.codecs["content"])
+        await storage.create_index("content", "user_id")
+        await storage.create_index("content", [("user_id", 1), ("created_at", -1)])
+        return storage
+
+    async def run(data_dir: str, tiering: bool) -> dict:
+        if tiering:
+            # Archives are clustered by the indexes in place when they are written
+            storage = await load(data_dir, tiering)
+            await storage.tier("content")
+            await storage.close()
+        began = time.perf_counter()
+        storage = await load(data_dir, tiering)
+        results = {"load": time.perf_counter() - began}
+        queries = {
+            "recent": lambda user: storage.find("content", {"user_id": user}, sort=[("created_at", -1)], limit=5),
+            "drafts": lambda user: storage.find("content", {"user_id": user, "status": "draft"}),
+            "by id": lambda user: storage.find_one("content", {"_id": f"doc-{int(user[5:])}"}),
+            "all": lambda user: storage.find("content", {"user_id": user}, projection=["type", "engagement"]),
+        }
+        for name, query in queries.items():
+            began = time.perf_counter()
+            for user in range(args.users):
+                await query(f"user-{user}")
+            results[name] = (time.perf_counter() - began) / args.users
+        results["resident"] = storage.cache_stats()["bytes"]
+        await storage.close()
+        return results
+
+    print(f"{args.docs:,} documents, {args.hot_share:.0%} fresh drafts, {args.users} users ({args.format} files):")
+    print(f"  {'tiering':8} {'load':>9} {'resident':>10} {'recent':>9} {'drafts':>9} {'by id':>9} {'all':>9}")
+    for tiering in (False, True):
+        with tempfile.TemporaryDirectory() as data_dir:
+            asyncio.run(seed(data_dir))
+            results = asyncio.run(run(data_dir, tiering))
+        print(f"  {'on' if tiering else 'off':8} {results['load'] * 1000:7.1f}ms {results['resident'] / 2 ** 20:8.1f}MB"
+              + "".join(f" {results[name] * 1000:7.2f}ms" for name in ("recent", "drafts", "by id", "all")))
+
+def bench_auth(args):
+    """Compare the per-call cost of verify_auth for a reused JWT with and without the token cache."""
+    from fastapi.security import HTTPAuthorizationCredentials
+    import auth
+
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=auth.create_access_token({"sub": "bench"}))
+
+    async def run() -> float:
+        began = time.perf_counter()
+        for _ in range(args.calls):
+            await auth.verify_auth(None, credentials, None)
+        return (time.perf_counter() - began) / args.calls
+
+    print(f"verify_auth with one reused token, {args.calls:,} calls:")
+    for size in (0, args.cache_size):
+        auth.token_cache = auth.TokenCache(size)
+        print(f"  cache {size:>6}  {asyncio.run(run()) * 1e6:8.2f} µs/call")
+
+def main():
+    """Run a storage benchmark."""
+    parser = argparse.ArgumentParser(description="Blotato storage benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    topk = commands.add_parser("topk", help="sort+limit: full sort vs bounded heap")
+    topk.add_argument("--docs", type=int, default=1_000_000, help="number of documents")
+    topk.add_argument("--limit", type=int, default=5, help="results to keep")
+    topk.add_argument("--repeat", type=int, default=3, help="runs per variant")
+    topk.set_defaults(func=bench_topk)
+
+    workers = commands.add_parser("workers", help="read throughput of processes sharing a data directory")
+    workers.add_argument("--docs", type=int, default=100_000, help="number of documents")
+    workers.add_argument("--users", type=int, default=100, help="distinct user_id values")
+    workers.add_argument("--max-workers", type=int, default=os.cpu_count() or 1, help="largest worker count")
+    workers.add_argument("--seconds", type=float, default=3, help="duration of each run")
+    workers.set_defaults(func=bench_workers)
+
+    mixed = commands.add_parser("mixed", help="read latency under a concurrent write load")
+    mixed.add_argument("--docs", type=int, default=100_000, help="number of documents")
+    mixed.add_argument("--readers", type=int, default=4, help="concurrent reader tasks")
+    mixed.add_argument("--rates", type=lambda value: [int(rate) for rate in value.split(",")],
+                       default=[0, 100, 1000], help="comma separated write rates per second")
+    mixed.add_argument("--seconds", type=float, default=3, help="duration of each run")
+    mixed.set_defaults(func=bench_mixed)
+
+    listing = commands.add_parser("listing", help="eager vs lazy decoding of large documents")
+    listing.add_argument("--docs", type=int, default=20_000, help="number of documents")
+    listing.add_argument("--users", type=int, default=100, help="distinct user_id values")
+    listing.add_argument("--body-kb", type=int, default=4, help="size of each document body")
+    listing.set_defaults(func=bench_listing)
+
+    compaction = commands.add_parser("compaction", help="file size and load time after update churn")
+    compaction.add_argument("--docs", type=int, default=10_000, help="number of documents")
+    compaction.add_argument("--updates", type=int, default=20, help="updates per document")
+    compaction.add_argument("--format", choices=["json", "binary"], default="json", help="file format")
+    compaction.set_defaults(func=bench_compaction)
+
+    tiering = commands.add_parser("tiering", help="hot and cold queries with cold documents archived")
+    tiering.add_argument("--docs", type=int, default=100_000, help="number of documents")
+    tiering.add_argument("--users", type=int, default=20, help="distinct user_id values")
+    tiering.add_argument("--hot-share", type=float, default=0.05, help="share of fresh drafts")
+    tiering.add_argument("--format", choices=["json", "binary"], default="json", help="file format")
+    tiering.set_defaults(func=bench_tiering)
+
+    auth = commands.add_parser("auth", help="JWT verification with and without the token cache")
+    auth.add_argument("--calls", type=int, default=100_000, help="verify_auth calls per variant")
+    auth.add_argument("--cache-size", type=int, default=1024, help="token cache entries")
+    auth.set_defaults(func=bench_auth)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
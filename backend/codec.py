@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Typed document codecs for storage collections.
+
+Storage engines hold documents in a plain *stored* form: enums as their
+values, nested models as dicts and datetimes as datetimes, which is what
+queries, indexes and sort keys see. A :class:`DocumentCodec` describes
+the typed fields of one collection and converts between that form and
+the values the application works with::
+
+    DocumentCodec({"created_at": datetime, "status": ContentStatus, "engagement": Engagement})
+
+- :meth:`DocumentCodec.encode` turns typed values into stored ones before
+  a document is serialized, so a model is kept as a dict rather than
+  ``str()`` of it.
+- :meth:`DocumentCodec.restore` runs once when a document is read from
+  disk or written, turning datetime fields that a JSON file or journal
+  keeps as strings back into datetimes.
+- :meth:`DocumentCodec.decode` produces the typed document handed to
+  callers. It runs lazily, on the first read of a stored
+  :class:`Document`, and the result is cached on it; stored documents
+  are never changed in place, so the cache is dropped along with the
+  version it belongs to.
+"""
+
+from datetime import datetime
+from enum import Enum
+from typing import Any, Callable, Dict, Optional
+
+class Document(dict):
+    """A stored document that caches its decoded form."""
+
+    __slots__ = ("_decoded",)
+
+def _parse_datetime(value: Any) -> Any:
+    """Parse a datetime written as a string; leave anything else alone."""
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            return value
+    return value
+
+def _enum_decoder(cls: type) -> Callable[[Any], Any]:
+    def decode(value: Any) -> Any:
+        try:
+            return cls(value)
+        except ValueError:
+            return value
+    return decode
+
+def _model_decoder(cls: type) -> Callable[[Any], Any]:
+    def decode(value: Any) -> Any:
+        if not isinstance(value, dict):
+            return value
+        try:
+            return cls.model_validate(value)
+        except ValueError:
+            return value
+    return decode
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, Enum):
+        return value.value
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    return value
+
+class DocumentCodec:
+    """Typed fields of a collection: datetimes, enums and pydantic models.
+
+    Fields not named are stored and returned as they are.
+    """
+
+    def __init__(self, fields: Dict[str, type]):
+        self.fields = dict(fields)
+        self._datetimes = tuple(field for field, cls in self.fields.items() if cls is datetime)
+        self._decoders: Dict[str, Callable[[Any], Any]] = {}
+        for field, cls in self.fields.items():
+            if isinstance(cls, type) and issubclass(cls, Enum):
+                self._decoders[field] = _enum_decoder(cls)
+            elif hasattr(cls, "model_validate"):
+                self._decoders[field] = _model_decoder(cls)
+            elif cls is not datetime:
+                raise TypeError(f"Cannot encode field '{field}' of type {cls!r}")
+
+    def encode(self, document: Dict) -> Dict:
+        """Return ``document`` with typed values replaced by their stored form."""
+        encoded: Optional[Dict] = None
+        for field in self._decoders:
+            value = document.get(field)
+            stored = _encode_value(value)
+            if stored is not value:
+                if encoded is None:
+                    encoded = dict(document)
+                encoded[field] = stored
+        return document if encoded is None else encoded
+
+    def restore(self, document: Dict) -> Document:
+        """Return a freshly deserialized document as a stored :class:`Document`.
+
+        Datetime fields read back as strings are parsed again. The document
+        may be changed in place, so it must not be shared yet.
+        """
+        for field in self._datetimes:
+            value = document.get(field)
+            if isinstance(value, str):
+                document[field] = _parse_datetime(value)
+        return document if isinstance(document, Document) else Document(document)
+
+    def decode(self, document: Dict) -> Dict:
+        """Return a typed copy of a stored document, decoding it at most once."""
+        decoded = getattr(document, "_decoded", None)
+        if decoded is None:
+            decoded = dict(document)
+            for field, decode in self._decoders.items():
+                value = decoded.get(field)
+                if value is not None:
+                    decoded[field] = decode(value)
+            if isinstance(document, Document):
+                document._decoded = decoded
+        return dict(decoded)
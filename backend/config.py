@@ -13,7 +13,9 @@ class SingleUserConfig(BaseModel):
     """Configuration for the single user system."""
     name: str
     email: EmailStr
-    password: str
+    # Plaintext, only when given by BLOTATO_USER_PASSWORD or a config file from an earlier version
+    password: Optional[str] = None
+    password_hash: Optional[str] = None
     avatar: Optional[str] = None
     plan: str = "premium"
 
@@ -29,12 +31,25 @@ class AppConfig:
         self.jwt_secret_key = os.environ.get("JWT_SECRET_KEY", "your-secret-key-change-in-production")
         self.jwt_algorithm = "HS256"
         self.jwt_expire_minutes = 30 * 24 * 60  # 30 days
+        # Verified tokens remembered so reused ones skip signature checks (0 disables)
+        self.jwt_cache_size = int(os.environ.get("JWT_CACHE_SIZE", "1024"))
+        self.token_revocation_sync_seconds = float(os.environ.get("TOKEN_REVOCATION_SYNC_S", "5"))
         
         # API Settings
         self.api_key_length = 32
         self.max_api_keys = 10
+        # Secret API keys are digested with; changing it invalidates every key
+        self.api_key_secret_is_jwt_secret = not os.environ.get("API_KEY_SECRET")
+        self.api_key_secret = (os.environ.get("API_KEY_SECRET") or self.jwt_secret_key).encode("utf-8")
+        self.api_key_sync_seconds = float(os.environ.get("API_KEY_SYNC_S", "5"))
+        self.api_key_usage_flush_seconds = float(os.environ.get("API_KEY_USAGE_FLUSH_S", "30"))
+
+        # Password hashing: bcrypt cost (log2 rounds) and threads hashing off the event loop
+        self.password_hash_rounds = int(os.environ.get("PASSWORD_HASH_ROUNDS", "12"))
+        self.password_hash_workers = int(os.environ.get("PASSWORD_HASH_WORKERS", "2"))
         
         # Single user configuration
+        self.user_from_env = False
         self.user_config = self._load_user_config()
     
     def _load_user_config(self) -> Optional[SingleUserConfig]:
@@ -44,12 +59,15 @@ class AppConfig:
         env_name = os.environ.get("BLOTATO_USER_NAME")
         env_email = os.environ.get("BLOTATO_USER_EMAIL")
         env_password = os.environ.get("BLOTATO_USER_PASSWORD")
+        env_password_hash = os.environ.get("BLOTATO_USER_PASSWORD_HASH")
         
-        if env_name and env_email and env_password:
+        if env_name and env_email and (env_password or env_password_hash):
+            self.user_from_env = True
             return SingleUserConfig(
                 name=env_name,
                 email=env_email,
-                password=env_password,
+                password=None if env_password_hash else env_password,
+                password_hash=env_password_hash,
                 avatar=os.environ.get("BLOTATO_USER_AVATAR"),
                 plan=os.environ.get("BLOTATO_USER_PLAN", "premium")
             )
@@ -67,7 +85,7 @@ class AppConfig:
     
     def save_user_config(self, user_config: SingleUserConfig):
         """Save user configuration to config file."""
-        config_data = {"user": user_config.dict()}
+        config_data = {"user": user_config.dict(exclude_none=True)}
         
         with open(self.config_file, 'w', encoding='utf-8') as f:
             json.dump(config_data, f, indent=2, ensure_ascii=False)
@@ -81,14 +99,6 @@ class AppConfig:
     def get_user_id(self) -> str:
         """Get the single user ID."""
         return "single-user"
-    
-    def validate_user_credentials(self, email: str, password: str) -> bool:
-        """Validate user credentials."""
-        if not self.user_config:
-            return False
-        
-        return (self.user_config.email == email and 
-                self.user_config.password == password)
 
 # Global configuration instance
 config = AppConfig()
@@ -97,15 +107,19 @@ def get_config() -> AppConfig:
     """Get the global configuration instance."""
     return config
 
-def setup_initial_user(name: str, email: str, password: str, avatar: str = None) -> bool:
-    """Setup the initial user if not already configured."""
+def setup_initial_user(name: str, email: str, password_hash: str, avatar: str = None) -> bool:
+    """Setup the initial user if not already configured.
+
+    Takes the hash of the password (see ``auth.hash_password``), which is
+    all the config file keeps.
+    """
     if config.is_configured():
         return False
     
     user_config = SingleUserConfig(
         name=name,
         email=email,
-        password=password,
+        password_hash=password_hash,
         avatar=avatar or f"https://ui-avatars.com/api/?name={name.replace(' ', '+')}&background=6366f1&color=fff",
         plan="premium"
     )
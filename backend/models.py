@@ -181,10 +181,12 @@ class APIKey(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()), alias="_id")
     name: str
     description: Optional[str] = None
-    key: str
+    key_digest: str  # HMAC-SHA256 of the key; the key itself is never stored
+    key_preview: str
     is_active: bool = True
     created_at: datetime = Field(default_factory=datetime.utcnow)
     last_used: Optional[datetime] = None
+    request_count: int = 0
 
     class Config:
         populate_by_name = True
@@ -208,4 +210,22 @@ class APIKeyListItem(BaseModel):
     key_preview: str  # Only first 8 characters + "..."
     is_active: bool
     created_at: datetime
-    last_used: Optional[datetime] = None
\ No newline at end of file
+    last_used: Optional[datetime] = None
+    request_count: int = 0
+
+
+# Backup Models
+class BackupInfo(BaseModel):
+    id: str
+    kind: str  # "full" or "incremental"
+    created_at: datetime
+    size: int
+
+class BackupCounts(BaseModel):
+    documents: int  # in the collection when the backup was taken
+    written: int  # stored in this backup
+    deleted: int  # since the base backup
+
+class BackupResult(BackupInfo):
+    base: Optional[str] = None
+    counts: Dict[str, BackupCounts] = {}
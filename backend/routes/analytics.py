@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends
 from typing import List
-from models import UserStats, RecentContentItem
+from models import UserStats, RecentContentItem, Engagement, ContentType
 from auth import verify_auth
 from storage import content_collection
 import random
@@ -11,21 +11,26 @@ router = APIRouter(prefix="/analytics", tags=["Analytics"])
 async def get_user_stats(user_id: str = Depends(verify_auth)):
     """Get analytics stats for the authenticated user."""
 
-    # Get all content for the user
-    content_list = await content_collection.find({"user_id": user_id})
+    # Count content and sum engagement per type inside the storage engine
+    totals = await content_collection.aggregate([
+        {"$match": {"user_id": user_id}},
+        {"$group": {
+            "_id": "$type",
+            "count": {"$count": {}},
+            "views": {"$sum": "$engagement.views"},
+            "likes": {"$sum": "$engagement.likes"},
+            "shares": {"$sum": "$engagement.shares"},
+        }},
+    ])
+    by_type = {row["_id"]: row for row in totals}
 
     # Calculate counts
-    total_content = len(content_list)
-    posts_count = len([c for c in content_list if c.get("type") == "post"])
-    videos_count = len([c for c in content_list if c.get("type") == "video"])
+    total_content = sum(row["count"] for row in totals)
+    posts_count = by_type.get(ContentType.post.value, {}).get("count", 0)
+    videos_count = by_type.get(ContentType.video.value, {}).get("count", 0)
 
     # Calculate engagement
-    total_engagement = sum([
-        content.get("engagement", {}).get("views", 0) +
-        content.get("engagement", {}).get("likes", 0) +
-        content.get("engagement", {}).get("shares", 0)
-        for content in content_list
-    ])
+    total_engagement = sum(row["views"] + row["likes"] + row["shares"] for row in totals)
 
     # Mock followers growth based on content activity
     followers_growth = min(total_content * 50 + random.randint(100, 500), 5000)
@@ -41,15 +46,18 @@ async def get_user_stats(user_id: str = Depends(verify_auth)):
 async def get_recent_content(user_id: str = Depends(verify_auth)):
     """Get recent content for the authenticated user."""
 
-    cursor = content_collection.find_cursor({"user_id": user_id}).sort("created_at", -1).limit(5)
+    cursor = content_collection.find_cursor(
+        {"user_id": user_id}, projection=["type", "title", "platform", "status", "engagement"]
+    ).sort("created_at", -1).limit(5)
     content_list = await cursor.to_list()
     
     recent_items = []
     for content in content_list:
         engagement_text = "Not published"
         if content.get("status") == "published":
-            views = content.get("engagement", {}).get("views", 0)
-            likes = content.get("engagement", {}).get("likes", 0)
+            engagement = content.get("engagement") or Engagement()
+            views = engagement.views or 0
+            likes = engagement.likes or 0
             if views > 0:
                 engagement_text = f"{views:,} views"
             elif likes > 0:
@@ -2,7 +2,10 @@ from fastapi import APIRouter, HTTPException, status, Depends
 from typing import List
 from models import (UserCreate, UserLogin, User, AuthResponse, UserResponse,
                    APIKeyCreate, APIKey, APIKeyResponse, APIKeyListItem)
-from auth import get_password_hash, verify_password, create_access_token, verify_token, verify_auth, generate_api_key
+from fastapi.security import HTTPAuthorizationCredentials
+from auth import (hash_password, authenticate_user, create_access_token, verify_token, verify_auth,
+                  generate_api_key, hash_api_key, api_key_preview, api_key_index, api_key_usage,
+                  revoke_token, security)
 from storage import users_collection, api_keys_collection
 from config import get_config, get_user_data, setup_initial_user
 import uuid
@@ -32,11 +35,11 @@ async def setup_system(user_data: UserCreate):
             detail="System is already configured"
         )
 
-    # Setup the initial user
+    # Setup the initial user, keeping only a hash of the password
     success = setup_initial_user(
         name=user_data.name,
         email=user_data.email,
-        password=user_data.password
+        password_hash=await hash_password(user_data.password)
     )
 
     if not success:
@@ -79,7 +82,7 @@ async def login(login_data: UserLogin):
         )
 
     # Validate credentials against single user
-    if not config.validate_user_credentials(login_data.email, login_data.password):
+    if not await authenticate_user(login_data.email, login_data.password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid email or password"
@@ -106,8 +109,10 @@ async def login(login_data: UserLogin):
     )
 
 @router.post("/logout")
-async def logout(user_id: str = Depends(verify_token)):
-    """Logout user (client-side token removal)."""
+async def logout(user_id: str = Depends(verify_token),
+                 credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Logout user, revoking the token used until it expires."""
+    await revoke_token(credentials.credentials)
     return {"success": True, "message": "Logged out successfully"}
 
 @router.get("/me", response_model=UserResponse)
@@ -137,10 +142,10 @@ async def create_api_key(api_key_data: APIKeyCreate, user_id: str = Depends(veri
     """Create a new API key for external integrations."""
 
     # Check if user has reached the maximum number of API keys
-    existing_keys = await api_keys_collection.find({"is_active": True})
+    active_keys = await api_keys_collection.count_documents({"is_active": True})
     config = get_config()
 
-    if len(existing_keys) >= config.max_api_keys:
+    if active_keys >= config.max_api_keys:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Maximum number of API keys ({config.max_api_keys}) reached"
@@ -154,7 +159,8 @@ async def create_api_key(api_key_data: APIKeyCreate, user_id: str = Depends(veri
         "_id": str(uuid.uuid4()),
         "name": api_key_data.name,
         "description": api_key_data.description,
-        "key": api_key,
+        "key_digest": hash_api_key(api_key),
+        "key_preview": api_key_preview(api_key),
         "is_active": True,
         "created_at": datetime.utcnow(),
         "last_used": None
@@ -168,7 +174,18 @@ async def create_api_key(api_key_data: APIKeyCreate, user_id: str = Depends(veri
             detail="Failed to create API key"
         )
 
-    return APIKeyResponse(**api_key_doc)
+    api_key_index.add(api_key_doc)
+
+    # The key itself is only returned here; storage keeps its digest
+    return APIKeyResponse(
+        id=api_key_doc["_id"],
+        name=api_key_doc["name"],
+        description=api_key_doc["description"],
+        key=api_key,
+        is_active=api_key_doc["is_active"],
+        created_at=api_key_doc["created_at"],
+        last_used=api_key_doc["last_used"]
+    )
 
 @router.get("/api-keys", response_model=List[APIKeyListItem])
 async def list_api_keys(user_id: str = Depends(verify_token)):
@@ -176,18 +193,21 @@ async def list_api_keys(user_id: str = Depends(verify_token)):
 
     api_keys = await api_keys_collection.find({"is_active": True})
 
-    return [
-        APIKeyListItem(
+    items = []
+    for key in api_keys:
+        # Include usage not yet written to storage
+        last_used, request_count = api_key_usage.usage(key)
+        items.append(APIKeyListItem(
             id=key["_id"],
             name=key["name"],
             description=key.get("description"),
-            key_preview=key["key"][:8] + "...",
+            key_preview=key["key_preview"],
             is_active=key["is_active"],
             created_at=key["created_at"],
-            last_used=key.get("last_used")
-        )
-        for key in api_keys
-    ]
+            last_used=last_used,
+            request_count=request_count
+        ))
+    return items
 
 @router.delete("/api-keys/{key_id}")
 async def revoke_api_key(key_id: str, user_id: str = Depends(verify_token)):
@@ -204,4 +224,6 @@ async def revoke_api_key(key_id: str, user_id: str = Depends(verify_token)):
             detail="API key not found"
         )
 
+    api_key_index.remove(key_id)
+
     return {"success": True, "message": "API key revoked successfully"}
\ No newline at end of file
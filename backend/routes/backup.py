@@ -0,0 +1,42 @@
+import asyncio
+from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi.responses import FileResponse
+from typing import List
+from models import BackupInfo, BackupResult
+from auth import verify_token
+from backup import backup_dir, create_backup, list_backups
+from storage import storage
+
+router = APIRouter(prefix="/backups", tags=["Backups"])
+
+# Backups hold every collection, including API key digests and revoked
+# tokens, so these routes take a login token and never an API key.
+
+# One backup at a time per process
+_backup_lock = asyncio.Lock()
+
+@router.post("/", response_model=BackupResult)
+async def create(incremental: bool = False, user_id: str = Depends(verify_token)):
+    """Back up every collection while the server keeps running.
+
+    An incremental backup holds only what changed since the last backup.
+    """
+    async with _backup_lock:
+        manifest = await create_backup(storage, incremental)
+    return BackupResult(**manifest)
+
+@router.get("/", response_model=List[BackupInfo])
+async def get_backups(user_id: str = Depends(verify_token)):
+    """List backups, oldest first."""
+    return [BackupInfo(**backup) for backup in list_backups()]
+
+@router.get("/{backup_id}")
+async def download_backup(backup_id: str, user_id: str = Depends(verify_token)):
+    """Download a backup archive."""
+    if not any(backup["id"] == backup_id for backup in list_backups()):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Backup not found"
+        )
+    return FileResponse(backup_dir() / f"{backup_id}.tar.gz", media_type="application/gzip",
+                        filename=f"{backup_id}.tar.gz")
@@ -9,11 +9,11 @@ from datetime import datetime
 router = APIRouter(prefix="/content", tags=["Content Management"])
 
 @router.get("/", response_model=List[Content])
-async def get_user_content(user_id: str = Depends(verify_auth)):
-    """Get all content for the authenticated user."""
+async def get_user_content(skip: int = 0, limit: int = 1000, user_id: str = Depends(verify_auth)):
+    """Get content for the authenticated user, newest first."""
 
-    cursor = content_collection.find_cursor({"user_id": user_id}).sort("created_at", -1)
-    content_list = await cursor.to_list(1000)
+    cursor = content_collection.find_cursor({"user_id": user_id}).sort("created_at", -1).skip(max(skip, 0))
+    content_list = await cursor.to_list(min(max(limit, 1), 1000))
 
     return [Content(**content) for content in content_list]
 
@@ -39,7 +39,7 @@ async def create_content(content_data: ContentCreate, user_id: str = Depends(ver
     }
     
     result = await content_collection.insert_one(content_dict)
-    if not result.inserted_id:
+    if not result.get("inserted_id"):
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to create content"
@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+"""
+Compact binary segment format for storage collections.
+
+A segment file starts with a small header followed by length-prefixed
+records::
+
+    header:  b"BLSG" | version (1 byte)
+    record:  payload length (uint32 LE) | crc32 of payload (uint32 LE) | payload
+
+Each payload is one document in a typed binary encoding that keeps
+datetimes as datetimes instead of strings. Map entries carry the length
+of their value, so a reader can pick single fields out of a record
+without decoding the rest (see :class:`LazyDocument`). The same record
+framing is used for journals, where a torn or corrupt trailing record is
+detected by its length or checksum.
+
+Archive segments hold cold documents that are rarely read. They are split
+into blocks of records, each compressed on its own, followed by an index
+of the blocks and a footer pointing at it::
+
+    header:  b"BLAR" | version (1 byte)
+    block:   zlib-compressed records, or a JSON array of documents
+    index:   zlib-compressed encoded map
+    footer:  index offset (uint64 LE) | index length (uint32 LE) | b"BLAR"
+
+so a reader loads the index and decompresses a block only when it needs
+a document in it.
+
+Run this module to convert collection files between formats::
+
+    python segments.py to-binary data/content.json
+    python segments.py to-json data/content.seg
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple, Union
+
+from codec import Document
+
+MAGIC = b"BLSG"
+VERSION = 1
+HEADER = MAGIC + bytes([VERSION])
+
+ARCHIVE_MAGIC = b"BLAR"
+ARCHIVE_HEADER = ARCHIVE_MAGIC + bytes([VERSION])
+
+_RECORD_HEADER = struct.Struct("<II")
+_ARCHIVE_FOOTER = struct.Struct("<QI4s")
+RECORD_OVERHEAD = _RECORD_HEADER.size
+_DOUBLE = struct.Struct("<d")
+
+# Value tags
+_NONE = 0x00
+_FALSE = 0x01
+_TRUE = 0x02
+_INT = 0x03
+_FLOAT = 0x04
+_STR = 0x05
+_DATETIME = 0x06
+_DATETIME_TZ = 0x07
+_LIST = 0x08
+_MAP = 0x09
+_BYTES = 0x0A
+
+_EPOCH = datetime(1970, 1, 1)
+
+class SegmentError(ValueError):
+    """Raised when a segment file is not in the expected format."""
+
+def _put_varint(out: bytearray, value: int):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def _get_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+def _micros(delta: timedelta) -> int:
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+def _encode(value: Any, out: bytearray):
+    if isinstance(value, str):
+        data = value.encode("utf-8")
+        out.append(_STR)
+        _put_varint(out, len(data))
+        out += data
+    elif value is None:
+        out.append(_NONE)
+    elif value is True:
+        out.append(_TRUE)
+    elif value is False:
+        out.append(_FALSE)
+    elif isinstance(value, int):
+        out.append(_INT)
+        _put_varint(out, (value << 1) if value >= 0 else ((-value << 1) - 1))
+    elif isinstance(value, float):
+        out.append(_FLOAT)
+        out += _DOUBLE.pack(value)
+    elif isinstance(value, datetime):
+        if value.tzinfo is None:
+            out.append(_DATETIME)
+            micros = _micros(value - _EPOCH)
+        else:
+            out.append(_DATETIME_TZ)
+            offset = value.utcoffset()
+            micros = _micros(value.replace(tzinfo=None) - offset - _EPOCH)
+            _put_varint(out, (offset.days * 86400 + offset.seconds) // 60 + 1440)
+        _put_varint(out, (micros << 1) if micros >= 0 else ((-micros << 1) - 1))
+    elif isinstance(value, dict):
+        if isinstance(value, LazyDocument) and not value._changed:
+            out += value._buffer[value._start:value._end]
+            return
+        out.append(_MAP)
+        _put_varint(out, len(value))
+        for key, item in value.items():
+            key = str(key).encode("utf-8")
+            _put_varint(out, len(key))
+            out += key
+            encoded = bytearray()
+            _encode(item, encoded)
+            _put_varint(out, len(encoded))
+            out += encoded
+    elif isinstance(value, (list, tuple)):
+        out.append(_LIST)
+        _put_varint(out, len(value))
+        for item in value:
+            _encode(item, out)
+    elif isinstance(value, (bytes, bytearray)):
+        out.append(_BYTES)
+        _put_varint(out, len(value))
+        out += value
+    else:
+        # Same fallback as the JSON files, which are written with default=str.
+        _encode(str(value), out)
+
+def _unzigzag(value: int) -> int:
+    return (value >> 1) if not value & 1 else -((value + 1) >> 1)
+
+def _decode(data: bytes, pos: int) -> Tuple[Any, int]:
+    tag = data[pos]
+    pos += 1
+    if tag == _STR:
+        length, pos = _get_varint(data, pos)
+        return data[pos:pos + length].decode("utf-8"), pos + length
+    if tag == _MAP:
+        count, pos = _get_varint(data, pos)
+        result = {}
+        for _ in range(count):
+            length, pos = _get_varint(data, pos)
+            key = data[pos:pos + length].decode("utf-8")
+            length, pos = _get_varint(data, pos + length)
+            result[key], _ = _decode(data, pos)
+            pos += length
+        return result, pos
+    if tag == _NONE:
+        return None, pos
+    if tag == _TRUE:
+        return True, pos
+    if tag == _FALSE:
+        return False, pos
+    if tag == _INT:
+        value, pos = _get_varint(data, pos)
+        return _unzigzag(value), pos
+    if tag == _FLOAT:
+        return _DOUBLE.unpack_from(data, pos)[0], pos + 8
+    if tag == _DATETIME:
+        value, pos = _get_varint(data, pos)
+        return _EPOCH + timedelta(microseconds=_unzigzag(value)), pos
+    if tag == _DATETIME_TZ:
+        offset, pos = _get_varint(data, pos)
+        value, pos = _get_varint(data, pos)
+        tz = timezone(timedelta(minutes=offset - 1440))
+        return (_EPOCH + timedelta(microseconds=_unzigzag(value))).replace(tzinfo=timezone.utc).astimezone(tz), pos
+    if tag == _LIST:
+        count, pos = _get_varint(data, pos)
+        result = []
+        for _ in range(count):
+            item, pos = _decode(data, pos)
+            result.append(item)
+        return result, pos
+    if tag == _BYTES:
+        length, pos = _get_varint(data, pos)
+        return bytes(data[pos:pos + length]), pos + length
+    raise SegmentError(f"Unknown value tag 0x{tag:02x}")
+
+def encode_value(value: Any) -> bytes:
+    """Encode a value (usually a document) as a record payload."""
+    out = bytearray()
+    _encode(value, out)
+    return bytes(out)
+
+def decode_value(payload: bytes) -> Any:
+    """Decode a record payload produced by :func:`encode_value`."""
+    return _decode(payload, 0)[0]
+
+def field_offsets(data: Union[bytes, mmap.mmap], pos: int = 0) -> Dict[str, int]:
+    """Map each field of the document encoded at ``pos`` to the offset of its value.
+
+    Only the keys are decoded; values are stepped over by their lengths.
+    """
+    if len(data) <= pos or data[pos] != _MAP:
+        raise SegmentError("Record is not a document")
+    count, pos = _get_varint(data, pos + 1)
+    offsets = {}
+    for _ in range(count):
+        # Keys are short, so their lengths nearly always fit in one byte.
+        length = data[pos]
+        if length < 0x80:
+            pos += 1
+        else:
+            length, pos = _get_varint(data, pos)
+        key = data[pos:pos + length].decode("utf-8")
+        length, pos = _get_varint(data, pos + length)
+        offsets[key] = pos
+        pos += length
+    return offsets
+
+class LazyDocument(Document):
+    """A document that stays encoded in its record and decodes fields on first access.
+
+    ``buffer`` is usually a memory-mapped segment file, so the encoded
+    document lives in the page cache rather than on the heap and only the
+    offsets of its fields are kept. Iterating, ``len`` and ``in`` need
+    nothing more; reading a field decodes that one value and keeps it.
+    Code that copies the whole document (``dict(doc)``, ``items()``)
+    decodes every field, so readers that need a few fields should ask for
+    them by name. An unchanged document is written back as its original
+    record.
+    """
+
+    __slots__ = ("_buffer", "_start", "_end", "_offsets", "_changed")
+
+    def __init__(self, buffer: Union[bytes, mmap.mmap], start: int = 0, end: Optional[int] = None):
+        super().__init__()
+        self._buffer = buffer
+        self._start = start
+        self._end = len(buffer) if end is None else end
+        self._offsets: Dict[str, Optional[int]] = field_offsets(buffer, start)
+        self._changed = False
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return dict.__getitem__(self, key)
+        except KeyError:
+            offset = self._offsets.get(key)
+            if offset is None:
+                raise
+        value = _decode(self._buffer, offset)[0]
+        dict.__setitem__(self, key, value)
+        return value
+
+    def __setitem__(self, key: str, value: Any):
+        dict.__setitem__(self, key, value)
+        self._offsets.setdefault(key, None)
+        self._changed = True
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self[key] if key in self._offsets else default
+
+    def setdefault(self, key: str, default: Any = None) -> Any:
+        if key not in self._offsets:
+            self[key] = default
+        return self[key]
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._offsets
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._offsets)
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def keys(self):
+        return self._offsets.keys()
+
+    def values(self) -> List[Any]:
+        return [self[key] for key in self._offsets]
+
+    def items(self) -> List[Tuple[str, Any]]:
+        return [(key, self[key]) for key in self._offsets]
+
+    def copy(self) -> Dict:
+        return dict(self.items())
+
+    def __eq__(self, other: object) -> bool:
+        return self.copy() == other
+
+    def __ne__(self, other: object) -> bool:
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return repr(self.copy())
+
+def frame(payload: bytes) -> bytes:
+    """Prefix a payload with its length and checksum."""
+    return _RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+def iter_records(f: BinaryIO) -> Iterator[Tuple[int, bytes]]:
+    """Yield ``(offset, payload)`` for each intact record from the current position.
+
+    Stops at the first truncated or corrupt record.
+    """
+    offset = f.tell()
+    while True:
+        header = f.read(_RECORD_HEADER.size)
+        if len(header) < _RECORD_HEADER.size:
+            return
+        length, checksum = _RECORD_HEADER.unpack(header)
+        payload = f.read(length)
+        if len(payload) < length or zlib.crc32(payload) != checksum:
+            return
+        yield offset, payload
+        offset += _RECORD_HEADER.size + length
+
+def _record_spans(buffer: mmap.mmap, pos: int) -> Iterator[Tuple[int, int]]:
+    """Yield ``(start, end)`` of each intact record payload in a mapped file from ``pos``."""
+    size = len(buffer)
+    while pos + _RECORD_HEADER.size <= size:
+        length, checksum = _RECORD_HEADER.unpack_from(buffer, pos)
+        start = pos + _RECORD_HEADER.size
+        end = start + length
+        if end > size or zlib.crc32(memoryview(buffer)[start:end]) != checksum:
+            return
+        yield start, end
+        pos = end
+
+def _check_header(f: BinaryIO, path: Path):
+    if f.read(len(HEADER)) != HEADER:
+        raise SegmentError(f"{path} is not a version {VERSION} segment file")
+
+def read_segment(path: Path, lazy: bool = False) -> List[Dict]:
+    """Read every document in a segment file.
+
+    With ``lazy``, the file is memory-mapped and documents are returned as
+    :class:`LazyDocument` views of their records instead of being decoded
+    up front. The mapping stays valid after the file is replaced.
+    """
+    with open(path, "rb") as f:
+        _check_header(f, path)
+        if not lazy:
+            return [decode_value(payload) for _, payload in iter_records(f)]
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return [LazyDocument(buffer, start, end) for start, end in _record_spans(buffer, len(HEADER))]
+
+def write_segment(f: BinaryIO, docs: List[Dict]) -> int:
+    """Write documents to an open file as a segment; return the bytes written."""
+    nbytes = f.write(HEADER)
+    for doc in docs:
+        nbytes += f.write(frame(encode_value(doc)))
+    return nbytes
+
+def encode_block(docs: List[Dict], format: str = "binary", level: int = 6) -> bytes:
+    """Encode documents as one compressed archive block.
+
+    ``format`` is ``"binary"`` for records as in segment files, or
+    ``"json"`` for a JSON array as in JSON collection files.
+    """
+    if format == "json":
+        return zlib.compress(json.dumps(docs, default=str, ensure_ascii=False).encode("utf-8"), level)
+    return zlib.compress(b"".join(frame(encode_value(doc)) for doc in docs), level)
+
+def decode_block(data: bytes, format: str = "binary", lazy: bool = False) -> List[Dict]:
+    """Decompress an archive block and return its documents.
+
+    With ``lazy``, documents of a binary block are :class:`LazyDocument`
+    views of the decompressed block.
+    """
+    buffer = zlib.decompress(data)
+    if format == "json":
+        return json.loads(buffer)
+    if lazy:
+        return [LazyDocument(buffer, start, end) for start, end in _record_spans(buffer, 0)]
+    return [decode_value(buffer[start:end]) for start, end in _record_spans(buffer, 0)]
+
+def write_archive_index(f: BinaryIO, index: Dict, offset: int) -> int:
+    """Write an archive's index and footer at ``offset``, the end of its blocks.
+
+    Returns the bytes written.
+    """
+    data = zlib.compress(encode_value(index))
+    return f.write(data) + f.write(_ARCHIVE_FOOTER.pack(offset, len(data), ARCHIVE_MAGIC))
+
+def read_archive_index(f: BinaryIO, path: Path) -> Dict:
+    """Read the index of an open archive file."""
+    if f.read(len(ARCHIVE_HEADER)) != ARCHIVE_HEADER:
+        raise SegmentError(f"{path} is not a version {VERSION} archive file")
+    f.seek(-_ARCHIVE_FOOTER.size, os.SEEK_END)
+    offset, length, magic = _ARCHIVE_FOOTER.unpack(f.read(_ARCHIVE_FOOTER.size))
+    if magic != ARCHIVE_MAGIC:
+        raise SegmentError(f"{path} has no archive index")
+    f.seek(offset)
+    return decode_value(zlib.decompress(f.read(length)))
+
+def json_to_segment(json_path: Path, segment_path: Optional[Path] = None) -> Path:
+    """Convert a JSON collection file into a segment file."""
+    json_path = Path(json_path)
+    segment_path = Path(segment_path) if segment_path else json_path.with_suffix(".seg")
+    with open(json_path, "r", encoding="utf-8") as f:
+        docs = json.load(f)
+    with open(segment_path, "wb") as f:
+        write_segment(f, docs)
+    return segment_path
+
+def segment_to_json(segment_path: Path, json_path: Optional[Path] = None) -> Path:
+    """Convert a segment file back into a JSON collection file."""
+    segment_path = Path(segment_path)
+    json_path = Path(json_path) if json_path else segment_path.with_suffix(".json")
+    docs = read_segment(segment_path)
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(docs, f, indent=2, default=str, ensure_ascii=False)
+    return json_path
+
+def main():
+    """Convert collection files between the JSON and segment formats."""
+    if len(sys.argv) < 3 or sys.argv[1] not in ("to-binary", "to-json"):
+        print("Usage: python segments.py (to-binary|to-json) FILE [FILE ...]")
+        sys.exit(1)
+
+    convert = json_to_segment if sys.argv[1] == "to-binary" else segment_to_json
+    for name in sys.argv[2:]:
+        source = Path(name)
+        target = convert(source)
+        print(f"{source} ({os.path.getsize(source)} bytes) -> {target} ({os.path.getsize(target)} bytes)")
+
+if __name__ == "__main__":
+    main()
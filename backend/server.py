@@ -9,7 +9,11 @@ from routes.auth import router as auth_router
 from routes.content import router as content_router
 from routes.analytics import router as analytics_router
 from routes.public import router as public_router
-from storage import init_storage
+from routes.backup import router as backup_router
+from storage import init_storage, storage
+from auth import api_key_index, api_key_usage, token_revocations
+from config import get_config
+import os
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -39,6 +43,7 @@ api_router.include_router(auth_router)
 api_router.include_router(content_router)
 api_router.include_router(analytics_router)
 api_router.include_router(public_router)
+api_router.include_router(backup_router)
 
 # Include the main router in the app
 app.include_router(api_router)
@@ -54,9 +59,27 @@ logger = logging.getLogger(__name__)
 async def startup_storage():
     """Initialize storage on startup."""
     await init_storage()
-    logger.info("File storage initialized successfully")
+    logger.info(f"Storage initialized successfully ({type(storage).__name__})")
+    config = get_config()
+    if config.api_key_secret_is_jwt_secret:
+        logger.warning(
+            "API_KEY_SECRET is not set, so API keys are digested with JWT_SECRET_KEY: "
+            "changing the JWT secret invalidates every API key. Set API_KEY_SECRET to a separate secret."
+        )
+    await api_key_index.load()
+    await token_revocations.load()
+    shared = os.environ.get("STORAGE_SHARED", "false").lower() in ("1", "true", "yes")
+    api_key_usage.start(config.api_key_usage_flush_seconds)
+    token_revocations.start(config.token_revocation_sync_seconds, shared)
+    if shared:
+        # Other workers create and revoke keys too
+        api_key_index.start_sync(config.api_key_sync_seconds)
 
 @app.on_event("shutdown")
 async def shutdown_storage():
     """Cleanup on shutdown."""
-    logger.info("Shutting down file storage")
\ No newline at end of file
+    await api_key_index.stop_sync()
+    await token_revocations.stop()
+    await api_key_usage.stop()
+    await storage.close()
+    logger.info("Shutting down storage")
\ No newline at end of file
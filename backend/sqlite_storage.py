@@ -0,0 +1,505 @@
+"""
+SQLite storage engine.
+
+Keeps every collection as a table of JSON documents in a single embedded
+SQLite database, behind the same interface as ``FileStorage``. Select it
+with ``STORAGE_ENGINE=sqlite``.
+
+Each table has the document ``_id`` as its primary key and the document
+itself in a JSON text column. Secondary indexes are expression indexes
+over ``json_extract`` of the indexed fields, and queries are translated
+into ``WHERE`` clauses over the same expressions so SQLite can use them.
+"""
+
+import asyncio
+import heapq
+import json
+import queue
+import re
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime
+from functools import partial
+from itertools import islice
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Union
+
+from storage import (
+    COLLECTIONS, DuplicateKeyError, StorageEngine, _compile_query, _datetime_text, _is_operator_expression,
+    _sort_key,
+)
+
+# Fields that can be named in a JSON path inlined into SQL. Dotted paths
+# are left to the Python filter, which also walks into lists.
+_PLAIN_FIELD = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+_RANGE_OPERATORS = {"$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+class _Unsupported(Exception):
+    """A query condition that cannot be expressed exactly in SQL."""
+
+def _column(field: str) -> Optional[str]:
+    """Return the SQL expression for a field, or ``None`` if it has none."""
+    if field == "_id":
+        return "id"
+    if _PLAIN_FIELD.fullmatch(field):
+        return f"json_extract(doc, '$.{field}')"
+    return None
+
+def _sql_value(value: Any) -> Any:
+    """Return a query operand as the value ``json_extract`` yields for it."""
+    if isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, datetime):
+        # Datetimes are stored as the strings json.dumps(default=str) writes.
+        return str(value)
+    raise _Unsupported
+
+def _translate_operator(field: str, column: str, op: str, operand: Any, params: list) -> str:
+    """Translate one operator into a SQL condition selecting the same documents.
+
+    Raises :class:`_Unsupported` when the SQL would not match exactly what
+    :func:`storage._compile_query` does.
+    """
+    if column == "id" and op not in ("$eq", "$in"):
+        raise _Unsupported
+    if op == "$exists":
+        return f"json_type(doc, '$.{field}') IS {'NOT ' if operand else ''}NULL"
+    if op in ("$eq", "$in"):
+        values = [operand] if op == "$eq" else list(operand)
+        if not values or any(value is None for value in values):
+            raise _Unsupported
+        values = [_sql_value(value) for value in values]
+        params.extend(values)
+        if len(values) == 1:
+            sql = f"{column} = ?"
+        else:
+            sql = f"{column} IN ({', '.join('?' * len(values))})"
+        if column != "id" and any(isinstance(value, str) for value in values):
+            # Objects and arrays come back from json_extract as JSON text.
+            sql += f" AND json_type(doc, '$.{field}') NOT IN ('object', 'array')"
+        return sql
+    if op in _RANGE_OPERATORS:
+        if operand is None:
+            raise _Unsupported
+        value = _sql_value(operand)
+        # Values only compare within the same type, as in _compile_operator.
+        if isinstance(value, str):
+            # Datetimes are stored with a space before the time, so an ISO
+            # bound with a "T" is compared in that form too.
+            value = _datetime_text(value)
+            types = "('text')"
+        else:
+            types = "('integer', 'real', 'true', 'false')"
+        params.append(value)
+        return f"{column} {_RANGE_OPERATORS[op]} ? AND json_type(doc, '$.{field}') IN {types}"
+    raise _Unsupported
+
+def _translate_query(query: Dict) -> tuple:
+    """Translate a query into ``(where, params, exact)``.
+
+    The ``WHERE`` clause selects a superset of the matching documents.
+    ``exact`` is true when it selects exactly the matches, so the rows need
+    no further filtering and ``LIMIT``/``OFFSET`` can be left to SQLite.
+    """
+    clauses = []
+    params = []
+    exact = True
+    for field, condition in query.items():
+        column = _column(field)
+        if column is None:
+            exact = False
+            continue
+        if not _is_operator_expression(condition):
+            condition = {"$eq": condition}
+        for op, operand in condition.items():
+            condition_params = []
+            try:
+                clauses.append(_translate_operator(field, column, op, operand, condition_params))
+            except _Unsupported:
+                exact = False
+                continue
+            params.extend(condition_params)
+    return " AND ".join(f"({clause})" for clause in clauses) or "1", params, exact
+
+class _Plan:
+    """A query prepared for execution: SQL plus the work left to Python."""
+
+    __slots__ = ("table", "sql", "params", "matches", "sort", "skip", "end", "restore")
+
+    def __init__(self, table: str, query: Dict, sort: Optional[List[tuple]], limit: Optional[int], skip: int,
+                 restore: Callable[[Dict], Dict]):
+        self.table = table
+        self.restore = restore
+        where, self.params, exact = _translate_query(query)
+        self.matches = None if exact else _compile_query(query)
+        order = [(_column(field), direction) for field, direction in sort or ()]
+        self.sort = None
+        if order and all(column is not None for column, _ in order):
+            # rowid keeps ties in insertion order, as FileStorage does
+            order_by = ", ".join(f"{column}{' DESC' if direction == -1 else ''}" for column, direction in order)
+            order_by = f" ORDER BY {order_by}, rowid"
+        else:
+            self.sort = sort or None
+            order_by = " ORDER BY rowid"
+        self.sql = f'SELECT doc FROM "{table}" WHERE {where}{order_by}'
+        self.skip = skip
+        self.end = skip + limit if limit else None
+        if exact and not self.sort and (limit or skip):
+            self.sql += " LIMIT ? OFFSET ?"
+            self.params = self.params + [limit or -1, skip]
+            self.skip = 0
+            self.end = limit or None
+
+    def documents(self, rows: Iterable[tuple]) -> Iterator[Dict]:
+        """Decode result rows and apply what SQL could not."""
+        docs = (self.restore(json.loads(row[0])) for row in rows)
+        if self.matches is not None:
+            docs = filter(self.matches, docs)
+        if self.sort:
+            key, reverse = _sort_key(self.sort)
+            if self.end is not None:
+                select = heapq.nlargest if reverse else heapq.nsmallest
+                docs = iter(select(self.end, docs, key=key))
+            else:
+                docs = iter(sorted(docs, key=key, reverse=reverse))
+        return islice(docs, self.skip, self.end)
+
+class _ConnectionPool:
+    """Fixed set of SQLite connections shared by the executor threads.
+
+    Cursors and snapshots hold a connection across awaits, so they take
+    one of the reader connections instead. Those are opened as needed,
+    since any number of cursors may be open, and up to ``size`` idle ones
+    are kept for the next reader.
+    """
+
+    def __init__(self, path: Path, size: int, synchronous: str):
+        self.path = path
+        self.synchronous = synchronous
+        self._idle: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        for _ in range(size):
+            self._idle.put(self.open())
+        self._idle_readers: "queue.Queue[sqlite3.Connection]" = queue.Queue(maxsize=size)
+        self._closed = False
+
+    def open(self) -> sqlite3.Connection:
+        """Open a new connection in autocommit mode with WAL journaling."""
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False,
+                               cached_statements=256)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        return conn
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        conn = self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    def acquire_reader(self) -> sqlite3.Connection:
+        """Return an idle reader connection, opening one if there is none."""
+        try:
+            return self._idle_readers.get_nowait()
+        except queue.Empty:
+            return self.open()
+
+    def release_reader(self, conn: sqlite3.Connection):
+        """End the reader's transaction and keep it for reuse, or close it."""
+        if conn.in_transaction:
+            conn.rollback()
+        if self._closed:
+            conn.close()
+            return
+        try:
+            self._idle_readers.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        self._closed = True
+        for idle in (self._idle, self._idle_readers):
+            while True:
+                try:
+                    idle.get_nowait().close()
+                except queue.Empty:
+                    break
+
+class SQLiteStorage(StorageEngine):
+    """Storage engine keeping collections in an embedded SQLite database.
+
+    The database runs in WAL mode, so readers never block the writer or
+    each other. All SQLite calls run on a thread pool of ``pool_size``
+    threads, each borrowing one of as many pooled connections; statements
+    use bound parameters and their SQL depends only on the shape of a
+    query, so SQLite's per-connection statement cache keeps them prepared.
+
+    Queries are pushed down to SQL where the translation is exact and
+    filtered in Python otherwise. Sorts on top-level fields run in SQL too,
+    which orders values as ``FileStorage`` does except objects and arrays:
+    SQLite compares those by their JSON text among the strings, where the
+    file engine puts them after every scalar. A batch of writes runs in one
+    transaction, with a savepoint per operation so a failing operation
+    leaves the others applied. ``durability`` maps to ``PRAGMA
+    synchronous``: ``"none"`` is ``OFF``, ``"batch"`` is ``NORMAL`` (fsync
+    at checkpoints) and ``"always"`` is ``FULL`` (fsync every commit).
+    Several processes can share the database; SQLite's own file locking
+    coordinates them.
+    """
+
+    SYNCHRONOUS = {"none": "OFF", "batch": "NORMAL", "always": "FULL"}
+
+    def __init__(self, path: str = "data/blotato.db", pool_size: int = 4, durability: str = "batch"):
+        if durability not in self.SYNCHRONOUS:
+            raise ValueError(f"durability must be one of {', '.join(self.SYNCHRONOUS)}")
+        super().__init__()
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.durability = durability
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="storage-sqlite")
+        self._pool = _ConnectionPool(self.path, pool_size, self.SYNCHRONOUS[durability])
+        # Unique index name -> indexed fields, for duplicate key errors
+        self._unique_fields: Dict[str, str] = {}
+
+        with self._pool.connection() as conn:
+            for collection in COLLECTIONS:
+                conn.execute(f'CREATE TABLE IF NOT EXISTS "{collection}" (id PRIMARY KEY, doc TEXT NOT NULL)')
+
+    async def _run(self, func: Callable, *args) -> Any:
+        """Run a blocking call on the SQLite thread pool."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, partial(func, *args))
+
+    @staticmethod
+    def _table(collection: str) -> str:
+        if collection not in COLLECTIONS:
+            raise KeyError(collection)
+        return collection
+
+    @asynccontextmanager
+    async def _reader(self) -> AsyncIterator[sqlite3.Connection]:
+        """Borrow a reader connection for as long as a cursor or snapshot is open."""
+        conn = await self._run(self._pool.acquire_reader)
+        try:
+            yield conn
+        finally:
+            await self._run(self._pool.release_reader, conn)
+
+    def _execute(self, sql: str, params: tuple = ()) -> List[tuple]:
+        with self._pool.connection() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    async def create_index(self, collection: str, keys: Union[str, List[tuple]], unique: bool = False) -> str:
+        """Create an expression index on a collection and return its name.
+
+        Takes the same field name or ``(field, direction)`` list as
+        ``FileStorage.create_index``. Only top-level fields can be indexed.
+        """
+        table = self._table(collection)
+        name = self._index_name(keys)
+        fields = [(keys, 1)] if isinstance(keys, str) else keys
+        columns = []
+        for field, direction in fields:
+            column = _column(field)
+            if column is None:
+                raise ValueError(f"Cannot index field '{field}'")
+            columns.append(f"{column}{' DESC' if direction == -1 else ''}")
+        index = f"{table}_{name}"
+        if unique:
+            self._unique_fields[index] = ", ".join(field for field, _ in fields)
+        sql = (f'CREATE {"UNIQUE " if unique else ""}INDEX IF NOT EXISTS "{index}" '
+               f'ON "{table}" ({", ".join(columns)})')
+        try:
+            await self._run(self._execute, sql)
+        except sqlite3.IntegrityError as exc:
+            raise self._duplicate_error(exc, None) from exc
+        return name
+
+    def _plan(self, collection: str, query: Dict, sort: Optional[List[tuple]] = None,
+              limit: Optional[int] = None, skip: int = 0) -> _Plan:
+        table = self._table(collection)
+        return _Plan(table, query, sort, limit, skip, partial(self._restore, table))
+
+    def _find(self, plan: _Plan, projection: Union[List[str], Dict[str, Any]] = None) -> List[Dict]:
+        decode = self._decoder(plan.table, projection)
+        with self._pool.connection() as conn:
+            return list(map(decode, plan.documents(conn.execute(plan.sql, plan.params))))
+
+    async def find_one(self, collection: str, query: Dict,
+                       projection: Union[List[str], Dict[str, Any]] = None) -> Optional[Dict]:
+        """Find a single document matching the query."""
+        docs = await self._run(self._find, self._plan(collection, query, limit=1), projection)
+        return docs[0] if docs else None
+
+    async def find(self, collection: str, query: Dict = None, sort: List[tuple] = None, limit: int = None,
+                   skip: int = 0, projection: Union[List[str], Dict[str, Any]] = None) -> List[Dict]:
+        """Find multiple documents matching the query."""
+        return await self._run(self._find, self._plan(collection, query or {}, sort, limit, skip), projection)
+
+    async def find_batches(self, collection: str, query: Dict = None, sort: List[tuple] = None,
+                           limit: int = None, skip: int = 0, batch_size: int = 100,
+                           projection: Union[List[str], Dict[str, Any]] = None) -> AsyncIterator[List[Dict]]:
+        """Yield the documents matching a query in lists of up to ``batch_size``.
+
+        The query runs on a reader connection that is stepped one batch at
+        a time. Its statement keeps a read transaction open, so unlike the
+        file engine every batch comes from the same snapshot of the
+        collection, however many writes happen in between.
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        plan = self._plan(collection, query or {}, sort, limit, skip)
+        async with self._reader() as conn:
+            rows = await self._run(conn.execute, plan.sql, plan.params)
+            try:
+                docs = map(self._decoder(collection, projection), plan.documents(rows))
+                while True:
+                    batch = await self._run(lambda: list(islice(docs, batch_size)))
+                    if batch:
+                        yield batch
+                    if len(batch) < batch_size:
+                        return
+            finally:
+                # Resetting the statement ends its read transaction.
+                await self._run(rows.close)
+
+    async def _stored_batches(self, collection: str, query: Dict, sort: Optional[List[tuple]] = None,
+                              limit: Optional[int] = None) -> AsyncIterator[List[Dict]]:
+        """Yield the documents matching a query in stored form, a batch at a time."""
+        plan = self._plan(collection, query, sort, limit)
+        async with self._reader() as conn:
+            rows = await self._run(conn.execute, plan.sql, plan.params)
+            try:
+                docs = plan.documents(rows)
+                while True:
+                    batch = await self._run(lambda: list(islice(docs, self.AGGREGATE_BATCH_DOCS)))
+                    if batch:
+                        yield batch
+                    if len(batch) < self.AGGREGATE_BATCH_DOCS:
+                        return
+            finally:
+                await self._run(rows.close)
+
+    async def count_documents(self, collection: str, query: Dict = None) -> int:
+        """Count the documents matching a query.
+
+        A query that translates exactly into SQL is counted by SQLite
+        without reading the documents; others are filtered in Python.
+        """
+        query = query or {}
+        table = self._table(collection)
+        where, params, exact = _translate_query(query)
+        if exact:
+            rows = await self._run(self._execute, f'SELECT COUNT(*) FROM "{table}" WHERE {where}', tuple(params))
+            return rows[0][0]
+        return await super().count_documents(collection, query)
+
+    @asynccontextmanager
+    async def snapshot(self) -> AsyncIterator[Callable[..., AsyncIterator[List[Dict]]]]:
+        """Read every table within one transaction on a reader connection.
+
+        In WAL mode the transaction sees the database as of its first read
+        and does not hold up writers.
+        """
+        async with self._reader() as conn:
+            def begin():
+                conn.execute("BEGIN")
+                # The snapshot is fixed by the first read, not by BEGIN.
+                conn.execute(f'SELECT 1 FROM "{COLLECTIONS[0]}" LIMIT 1').fetchall()
+
+            async def read(collection: str, batch_size: int = 1000) -> AsyncIterator[List[Dict]]:
+                table = self._table(collection)
+                rows = await self._run(conn.execute, f'SELECT doc FROM "{table}" ORDER BY rowid')
+                try:
+                    while True:
+                        batch = await self._run(
+                            lambda: [self._restore(table, json.loads(row[0])) for row in rows.fetchmany(batch_size)]
+                        )
+                        if batch:
+                            yield batch
+                        if len(batch) < batch_size:
+                            return
+                finally:
+                    await self._run(rows.close)
+
+            # Releasing the connection ends the transaction.
+            await self._run(begin)
+            yield read
+
+    def _duplicate_error(self, exc: sqlite3.IntegrityError, doc: Optional[Dict]) -> Exception:
+        """Turn a unique constraint failure into a :class:`DuplicateKeyError`."""
+        message = str(exc)
+        index = re.search(r"index '([^']+)'", message)
+        if index and index.group(1) in self._unique_fields:
+            return DuplicateKeyError(f"Duplicate value for unique index on '{self._unique_fields[index.group(1)]}'")
+        if message.startswith("UNIQUE") and doc is not None:
+            return DuplicateKeyError(f"Duplicate _id '{doc['_id']}'")
+        return exc
+
+    def _apply_write(self, conn: sqlite3.Connection, table: str, op: str, spec: Dict) -> Dict:
+        """Apply one write operation within the open transaction."""
+        if op == "insert_one":
+            document = spec["document"]
+            doc = self._prepare_insert(table, document)
+            try:
+                conn.execute(f'INSERT INTO "{table}" (id, doc) VALUES (?, ?)',
+                             (doc["_id"], json.dumps(doc, default=str, ensure_ascii=False)))
+            except sqlite3.IntegrityError as exc:
+                raise self._duplicate_error(exc, doc) from exc
+            return {"inserted_id": document.get("_id")}
+
+        plan = self._plan(table, spec.get("filter") or {}, limit=1 if op.endswith("_one") else None)
+        # Read every match before changing the table under the cursor.
+        matches = list(plan.documents(conn.execute(plan.sql, plan.params).fetchall()))
+
+        if op.startswith("update"):
+            for item in matches:
+                doc = self._apply_update(table, item, spec["update"])
+                try:
+                    conn.execute(f'UPDATE "{table}" SET doc = ? WHERE id = ?',
+                                 (json.dumps(doc, default=str, ensure_ascii=False), doc["_id"]))
+                except sqlite3.IntegrityError as exc:
+                    raise self._duplicate_error(exc, doc) from exc
+            return {"modified_count": len(matches)}
+
+        conn.executemany(f'DELETE FROM "{table}" WHERE id = ?', [(item["_id"],) for item in matches])
+        return {"deleted_count": len(matches)}
+
+    def _apply_batch(self, table: str, operations: List[tuple], ordered: bool) -> tuple:
+        results: List[Optional[Dict]] = [None] * len(operations)
+        errors = []
+        with self._pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for index, (op, spec) in enumerate(operations):
+                    conn.execute("SAVEPOINT operation")
+                    try:
+                        results[index] = self._apply_write(conn, table, op, spec)
+                    except Exception as exc:
+                        conn.execute("ROLLBACK TO operation")
+                        errors.append((index, exc))
+                        if ordered:
+                            break
+                    finally:
+                        conn.execute("RELEASE operation")
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return results, errors
+
+    async def _write(self, collection: str, operations: List[tuple], ordered: bool = True) -> tuple:
+        """Apply ``(op, spec)`` operations in one transaction."""
+        return await self._run(self._apply_batch, self._table(collection), operations, ordered)
+
+    async def checkpoint(self):
+        """Copy the write-ahead log into the database file and truncate it."""
+        await self._run(self._execute, "PRAGMA wal_checkpoint(TRUNCATE)")
+
+    async def close(self):
+        """Checkpoint the log and close every connection."""
+        await self.checkpoint()
+        self._pool.close()
+        self._executor.shutdown(wait=True)
@@ -6,16 +6,22 @@ Blotato Single User - Startup Script
 import uvicorn
 import os
 from pathlib import Path
+from dotenv import load_dotenv
 
 def main():
     """Start the Blotato API server."""
+    load_dotenv(Path(__file__).parent / '.env')
 
     # Set default environment variables if not set
     # Railway provides PORT automatically
     os.environ.setdefault("HOST", "0.0.0.0")
     os.environ.setdefault("PORT", os.environ.get("PORT", "8000"))
     os.environ.setdefault("DATA_DIR", "data")
-    
+    workers = int(os.environ.get("WORKERS", "1"))
+    if workers > 1:
+        # Worker processes share DATA_DIR, so storage must coordinate them.
+        os.environ["STORAGE_SHARED"] = "true"
+        
     # Create data directory if it doesn't exist
     data_dir = Path(os.environ.get("DATA_DIR", "data"))
     data_dir.mkdir(exist_ok=True)
@@ -23,6 +29,8 @@ def main():
     print("🚀 Starting Blotato Single User API...")
     print(f"📁 Data directory: {data_dir.absolute()}")
     print(f"🌐 Server will be available at: http://{os.environ['HOST']}:{os.environ['PORT']}")
+    if workers > 1:
+        print(f"⚙️  Worker processes: {workers}")
     print("📖 API documentation will be available at: /docs")
     print()
     
@@ -49,7 +57,8 @@ def main():
         "server:app",
         host=os.environ["HOST"],
         port=int(os.environ["PORT"]),
-        reload=True,
+        reload=workers == 1,
+        workers=workers,
         log_level="info"
     )
 
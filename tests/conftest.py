@@ -0,0 +1,116 @@
+"""
+Shared setup for the storage tests.
+
+The backend modules are imported the way the server imports them, from the
+backend directory. Importing ``storage`` builds the app's storage engine, so
+DATA_DIR (and BACKUP_DIR) are pointed at a scratch directory first; the tests
+then open their own engines in ``tmp_path``.
+
+Tests may be ``async def``; each one runs to completion on a fresh event loop.
+Route tests use ``client`` instead, which serves the app on its own loop.
+"""
+
+import asyncio
+import inspect
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="blotato-tests-")
+os.environ["BACKUP_DIR"] = os.path.join(os.environ["DATA_DIR"], "backups")
+os.environ["STORAGE_ENGINE"] = "file"
+# The cheapest bcrypt cost, so logins in the tests are quick
+os.environ["PASSWORD_HASH_ROUNDS"] = "4"
+
+from storage import FileStorage, storage as app_storage  # noqa: E402
+
+EMAIL = "test@example.com"
+PASSWORD = "correct horse battery staple"
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem):
+    if inspect.iscoroutinefunction(pyfuncitem.obj):
+        arguments = {name: pyfuncitem.funcargs[name] for name in pyfuncitem._fixtureinfo.argnames}
+        asyncio.run(pyfuncitem.obj(**arguments))
+        return True
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    return tmp_path / "data"
+
+
+@pytest.fixture
+def open_storage(data_dir):
+    """Return a function opening a FileStorage with the app's codecs, on ``data_dir`` by default.
+
+    Engines skip fsync unless a test asks for a durability level.
+    """
+    def open_storage(directory=None, **options) -> FileStorage:
+        options.setdefault("durability", "none")
+        engine = FileStorage(str(directory or data_dir), **options)
+        engine.codecs.update(app_storage.codecs)
+        return engine
+    return open_storage
+
+
+@pytest.fixture
+def client(open_storage, tmp_path, monkeypatch):
+    """Return a TestClient for the app, with a configured user and a fresh engine on ``data_dir``.
+
+    The engine runs on the client's event loop, so a test reaches it with
+    ``client.portal.call(storage.storage.find, ...)``.
+    """
+    import config
+    import server
+    import storage
+    from fastapi.testclient import TestClient
+
+    engine = open_storage()
+    monkeypatch.setattr(storage, "storage", engine)
+    monkeypatch.setattr(server, "storage", engine)
+    monkeypatch.setattr(config.get_config(), "config_file", tmp_path / "config.json")
+    monkeypatch.setattr(config.get_config(), "user_config",
+                        config.SingleUserConfig(name="Test User", email=EMAIL, password=PASSWORD))
+    with TestClient(server.app) as client:
+        yield client
+
+
+@pytest.fixture
+def bearer():
+    """Return headers carrying a fresh JWT for the configured user."""
+    from auth import create_access_token
+    return {"Authorization": f"Bearer {create_access_token(data={'sub': 'single-user'})}"}
+
+
+async def ids(engine, collection, query=None):
+    """Return the sorted ``_id`` of every document matching ``query``."""
+    return sorted(doc["_id"] for doc in await engine.find(collection, query or {}))
+
+
+# Fields the engines stamp with the time of each write
+TIMESTAMPS = ("created_at", "updated_at")
+
+
+def strip(docs, fields=TIMESTAMPS):
+    """Drop fields the engines fill in themselves, so results can be compared."""
+    return [{key: value for key, value in doc.items() if key not in fields} for doc in docs]
+
+
+async def open_pair(open_storage, tmp_path, collection, docs, options=None, indexes=(), **shared):
+    """Return an engine opened with ``options`` and ``indexes`` and a plain one, holding the same ``docs``.
+
+    ``shared`` options are given to both engines.
+    """
+    engine = open_storage(**dict(shared, **(options or {})))
+    plain = open_storage(tmp_path / "plain", **shared)
+    for keys in indexes:
+        await engine.create_index(collection, keys)
+    for opened in (engine, plain):
+        await opened.insert_many(collection, [dict(doc) for doc in docs])
+    return engine, plain
@@ -0,0 +1,105 @@
+"""Aggregation pipelines, checked against the same computation in plain Python."""
+
+import random
+from collections import defaultdict
+
+import pytest
+
+from sqlite_storage import SQLiteStorage
+
+STATUSES = ["draft", "scheduled", "published"]
+
+
+def _documents(count=1500):
+    rng = random.Random(11)
+    docs = []
+    for i in range(count):
+        doc = {"_id": f"d{i:04d}", "user_id": f"u{rng.randrange(4)}", "status": rng.choice(STATUSES),
+               "stats": {"views": rng.randrange(1000), "likes": rng.randrange(50)}}
+        if i % 97 == 0:
+            doc["stats"]["views"] = "n/a"  # not a number: left out of sums and averages
+        docs.append(doc)
+    return docs
+
+
+def _group(docs, key, field):
+    """Reference ``$group``: count, sum and average of a numeric field per key."""
+    groups = defaultdict(lambda: {"count": 0, "values": []})
+    for doc in docs:
+        group = groups[key(doc)]
+        group["count"] += 1
+        if isinstance(doc["stats"][field], int):
+            group["values"].append(doc["stats"][field])
+    return {
+        key: (group["count"], sum(group["values"]),
+              sum(group["values"]) / len(group["values"]) if group["values"] else None)
+        for key, group in groups.items()
+    }
+
+
+@pytest.fixture(params=["file", "indexed", "partitioned", "sqlite"])
+def engine(request, open_storage, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteStorage(str(tmp_path / "blotato.db"), durability="none")
+    if request.param == "partitioned":
+        return open_storage(partitions={"content": "user_id"})
+    return open_storage()
+
+
+async def test_group_by_field_and_compound_key(engine, request):
+    docs = _documents()
+    if request.node.callspec.params["engine"] == "indexed":
+        await engine.create_index("content", [("user_id", 1), ("status", 1)])
+    await engine.insert_many("content", [dict(doc) for doc in docs])
+
+    rows = await engine.aggregate("content", [
+        {"$group": {"_id": "$user_id", "n": {"$count": {}}, "views": {"$sum": "$stats.views"},
+                    "avg": {"$avg": "$stats.views"}}},
+    ])
+    expected = _group(docs, lambda doc: doc["user_id"], "views")
+    assert {row["_id"]: (row["n"], row["views"], pytest.approx(row["avg"])) for row in rows} == expected
+
+    rows = await engine.aggregate("content", [
+        {"$match": {"status": {"$ne": "draft"}}},
+        {"$group": {"_id": {"user": "$user_id", "status": "$status"}, "likes": {"$sum": "$stats.likes"}}},
+        {"$sort": {"likes": -1}},
+        {"$limit": 3},
+    ])
+    totals = _group([doc for doc in docs if doc["status"] != "draft"],
+                    lambda doc: (doc["user_id"], doc["status"]), "likes")
+    top = sorted(totals.items(), key=lambda item: -item[1][1])[:3]
+    assert [row["likes"] for row in rows] == [total for _, (_, total, _) in top]
+    for row in rows:
+        assert totals[(row["_id"]["user"], row["_id"]["status"])][1] == row["likes"]
+    await engine.close()
+
+
+async def test_match_sort_limit_without_a_group(engine):
+    docs = _documents(300)
+    await engine.insert_many("content", [dict(doc) for doc in docs])
+    rows = await engine.aggregate("content", [
+        {"$match": {"user_id": "u2", "stats.likes": {"$gte": 10}}},
+        {"$sort": {"stats.likes": -1, "_id": 1}},
+        {"$limit": 5},
+    ])
+    matches = [doc for doc in docs if doc["user_id"] == "u2" and doc["stats"]["likes"] >= 10]
+    expected = sorted(matches, key=lambda doc: (-doc["stats"]["likes"], doc["_id"]))[:5]
+    assert [row["_id"] for row in rows] == [doc["_id"] for doc in expected]
+    assert await engine.aggregate("content", [{"$match": {"user_id": "nobody"}}]) == []
+    assert await engine.count_documents("content", {"user_id": "u2"}) == \
+        sum(doc["user_id"] == "u2" for doc in docs)
+    await engine.close()
+
+
+@pytest.mark.parametrize("pipeline", [
+    [{"$project": {"_id": 1}}],
+    [{"$group": {"n": {"$sum": 1}}}],
+    [{"$group": {"_id": None, "n": {"$max": "$stats.likes"}}}],
+    [{"$sort": {"n": 2}}],
+    [{"$limit": 0}],
+    [{"$match": {}, "$limit": 1}],
+])
+async def test_invalid_pipelines_are_rejected(engine, pipeline):
+    with pytest.raises(ValueError):
+        await engine.aggregate("content", pipeline)
+    await engine.close()
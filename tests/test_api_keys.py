@@ -0,0 +1,174 @@
+"""API keys: creating them and authenticating requests with them."""
+
+import asyncio
+import hashlib
+import hmac
+
+import pytest
+
+import storage
+from auth import api_key_index, api_key_usage, hash_api_key
+from config import get_config
+
+
+def _store_key(client, key, is_active=True):
+    client.portal.call(storage.storage.insert_one, "api_keys", {
+        "_id": f"id-{key}", "name": key, "description": None,
+        "key_digest": hash_api_key(key), "key_preview": key[:8] + "...",
+        "is_active": is_active, "last_used": None,
+    })
+    client.portal.call(api_key_index.load)
+
+
+def test_an_api_key_alone_authenticates(client):
+    _store_key(client, "good")
+    _store_key(client, "revoked", is_active=False)
+
+    assert client.get("/api/auth/me", headers={"X-API-Key": "good"}).json()["email"] == "test@example.com"
+    for headers in ({}, {"X-API-Key": "wrong"}, {"X-API-Key": "revoked"}):
+        assert client.get("/api/auth/me", headers=headers).status_code == 401, headers
+
+
+def test_a_bearer_token_still_authenticates(client, bearer):
+    assert client.get("/api/auth/me", headers=bearer).status_code == 200
+    assert client.get("/api/auth/me", headers={"Authorization": "Bearer nope"}).status_code == 401
+
+
+def test_a_created_key_is_returned_once_and_works(client, bearer):
+    created = client.post("/api/auth/api-keys", json={"name": "zapier"}, headers=bearer)
+    assert created.status_code == 200
+    key = created.json()["key"]
+
+    assert client.get("/api/auth/me", headers={"X-API-Key": key}).status_code == 200
+    [listed] = client.get("/api/auth/api-keys", headers=bearer).json()
+    assert listed["id"] == created.json()["id"]
+    assert "key" not in listed and listed["key_preview"] == key[:8] + "..."
+
+
+def test_only_a_keyed_digest_of_the_key_is_stored(client, bearer):
+    key = client.post("/api/auth/api-keys", json={"name": "zapier"}, headers=bearer).json()["key"]
+    [stored] = client.portal.call(storage.storage.find, "api_keys", {})
+    assert "key" not in stored
+    assert stored["key_digest"] == hmac.new(get_config().api_key_secret, key.encode(), hashlib.sha256).hexdigest()
+    assert key not in repr(stored)
+
+
+def test_keys_are_checked_without_reading_storage(client, bearer, monkeypatch):
+    key = client.post("/api/auth/api-keys", json={"name": "zapier"}, headers=bearer).json()["key"]
+
+    async def no_reads(*args, **kwargs):
+        raise AssertionError("storage was read")
+    monkeypatch.setattr(storage.storage, "find", no_reads)
+    monkeypatch.setattr(storage.storage, "find_one", no_reads)
+    assert client.get("/api/auth/me", headers={"X-API-Key": key}).status_code == 200
+    assert client.get("/api/auth/me", headers={"X-API-Key": key + "x"}).status_code == 401
+
+
+def test_a_revoked_key_stops_working_at_once(client, bearer):
+    created = client.post("/api/auth/api-keys", json={"name": "zapier"}, headers=bearer).json()
+    headers = {"X-API-Key": created["key"]}
+    assert client.get("/api/auth/me", headers=headers).status_code == 200
+    assert client.delete(f"/api/auth/api-keys/{created['id']}", headers=bearer).status_code == 200
+    assert client.get("/api/auth/me", headers=headers).status_code == 401
+    assert len(api_key_index) == 0
+
+
+def test_revoking_a_key_leaves_the_others(client, bearer):
+    _store_key(client, "loaded")
+    created = [client.post("/api/auth/api-keys", json={"name": f"k{i}"}, headers=bearer).json() for i in range(3)]
+    for key_id in (created[1]["id"], "id-loaded"):
+        assert client.delete(f"/api/auth/api-keys/{key_id}", headers=bearer).status_code == 200
+    api_key_index.remove("unknown")
+    assert len(api_key_index) == 2
+    for record, status in [(created[0], 200), (created[1], 401), (created[2], 200)]:
+        assert client.get("/api/auth/me", headers={"X-API-Key": record["key"]}).status_code == status
+    assert client.get("/api/auth/me", headers={"X-API-Key": "loaded"}).status_code == 401
+
+
+@pytest.mark.parametrize("separate", [False, True])
+def test_startup_warns_when_keys_share_the_jwt_secret(request, monkeypatch, caplog, separate):
+    monkeypatch.setattr(get_config(), "api_key_secret_is_jwt_secret", not separate)
+    with caplog.at_level("WARNING", logger="server"):
+        request.getfixturevalue("client")
+    assert any("API_KEY_SECRET" in message for message in caplog.messages) != separate
+
+
+def test_plaintext_keys_are_replaced_by_their_digest_at_startup(client):
+    client.portal.call(storage.storage.insert_one, "api_keys", {
+        "_id": "legacy", "name": "old", "description": None, "key": "plaintext-key-from-v1",
+        "is_active": True, "last_used": None,
+    })
+    client.portal.call(api_key_index.load)
+
+    stored = client.portal.call(storage.storage.find_one, "api_keys", {"_id": "legacy"})
+    assert "key" not in stored
+    assert (stored["key_digest"], stored["key_preview"]) == (hash_api_key("plaintext-key-from-v1"), "plaintex...")
+    assert client.get("/api/auth/me", headers={"X-API-Key": "plaintext-key-from-v1"}).status_code == 200
+
+
+def test_usage_is_counted_in_memory_and_written_behind(client, bearer, monkeypatch):
+    created = client.post("/api/auth/api-keys", json={"name": "zapier"}, headers=bearer).json()
+    writes = []
+    update_one = storage.storage.update_one
+    monkeypatch.setattr(storage.storage, "update_one", lambda *args: writes.append(args) or update_one(*args))
+    for _ in range(3):
+        assert client.get("/api/auth/me", headers={"X-API-Key": created["key"]}).status_code == 200
+    assert writes == []
+    [listed] = client.get("/api/auth/api-keys", headers=bearer).json()
+    assert listed["request_count"] == 3 and listed["last_used"]
+
+    client.portal.call(api_key_usage.flush)
+    stored = client.portal.call(storage.storage.find_one, "api_keys", {"_id": created["id"]})
+    assert stored["request_count"] == 3 and stored["last_used"]
+    # Counts are added to, so workers flushing the same key keep each other's.
+    client.portal.call(storage.storage.update_one, "api_keys", {"_id": created["id"]}, {"$inc": {"request_count": 10}})
+    client.get("/api/auth/me", headers={"X-API-Key": created["key"]})
+    client.portal.call(api_key_usage.flush)
+    assert client.portal.call(storage.storage.find_one, "api_keys", {"_id": created["id"]})["request_count"] == 14
+
+
+def test_usage_from_a_failed_flush_is_kept(client, bearer, monkeypatch):
+    created = client.post("/api/auth/api-keys", json={"name": "zapier"}, headers=bearer).json()
+    client.get("/api/auth/me", headers={"X-API-Key": created["key"]})
+
+    async def failing_bulk_write(*args, **kwargs):
+        raise IOError("disk full")
+    bulk_write = storage.storage.bulk_write
+    monkeypatch.setattr(storage.storage, "bulk_write", failing_bulk_write)
+    with pytest.raises(IOError):
+        client.portal.call(api_key_usage.flush)
+    client.get("/api/auth/me", headers={"X-API-Key": created["key"]})
+
+    monkeypatch.setattr(storage.storage, "bulk_write", bulk_write)
+    client.portal.call(api_key_usage.flush)
+    assert client.portal.call(storage.storage.find_one, "api_keys", {"_id": created["id"]})["request_count"] == 2
+
+
+def test_usage_is_written_at_shutdown(client, bearer, open_storage):
+    created = client.post("/api/auth/api-keys", json={"name": "zapier"}, headers=bearer).json()
+    client.get("/api/auth/me", headers={"X-API-Key": created["key"]})
+    # Leaving the client shuts the app down.
+    client.__exit__(None, None, None)
+    [stored] = asyncio.run(open_storage().find("api_keys", {}))
+    assert stored["request_count"] == 1
+
+
+def test_only_the_failed_updates_of_a_flush_are_kept(client, bearer, monkeypatch):
+    keys = [client.post("/api/auth/api-keys", json={"name": name}, headers=bearer).json() for name in ("a", "b")]
+    for key in keys:
+        client.get("/api/auth/me", headers={"X-API-Key": key["key"]})
+
+    bulk_write = storage.storage.bulk_write
+
+    async def second_fails(collection, operations, ordered=True):
+        await bulk_write(collection, operations[:1], ordered=ordered)
+        raise storage.BulkWriteError([{"index": 1, "error": "failed"}], {})
+    monkeypatch.setattr(storage.storage, "bulk_write", second_fails)
+    with pytest.raises(storage.BulkWriteError):
+        client.portal.call(api_key_usage.flush)
+
+    monkeypatch.setattr(storage.storage, "bulk_write", bulk_write)
+    client.portal.call(api_key_usage.flush)
+    counts = [client.portal.call(storage.storage.find_one, "api_keys", {"_id": key["id"]})["request_count"]
+              for key in keys]
+    assert counts == [1, 1]
@@ -0,0 +1,180 @@
+"""Backups: full and incremental round trips, and backing up under a running writer."""
+
+import os
+import subprocess
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+import backup
+import routes.backup
+import storage
+from sqlite_storage import SQLiteStorage
+
+from .conftest import ids
+
+BACKEND = Path(backup.__file__).resolve().parent
+
+
+async def _dump(engine):
+    return {
+        collection: sorted(await engine.find(collection, {}), key=lambda doc: doc["_id"])
+        for collection in ("content", "faqs", "api_keys")
+    }
+
+
+async def _fill(engine):
+    now = datetime.utcnow()
+    await engine.insert_many("content", [
+        {"_id": f"c{i}", "user_id": "u", "title": f"t{i}", "status": "draft", "content_type": "text",
+         "created_at": now - timedelta(days=i)}
+        for i in range(2500)
+    ])
+    await engine.insert_many("faqs", [{"_id": f"f{i}", "q": i} for i in range(5)])
+
+
+@pytest.fixture(params=["file", "journal", "sqlite"])
+def open_engine(request, open_storage, data_dir):
+    """Return a function opening the same kind of engine on a given directory."""
+    def open_engine(directory=None):
+        if request.param == "sqlite":
+            directory = directory or data_dir
+            directory.mkdir(parents=True, exist_ok=True)
+            return SQLiteStorage(str(directory / "blotato.db"), durability="none")
+        if request.param == "journal":
+            return open_storage(directory, journal=True, format="binary")
+        return open_storage(directory)
+    return open_engine
+
+
+async def test_incremental_backups_restore_to_each_point(open_engine, tmp_path):
+    engine = open_engine()
+    await _fill(engine)
+    full = await backup.create_backup(engine, directory=tmp_path / "backups")
+    states = [await _dump(engine)]
+
+    await engine.update_many("content", {"title": "t7"}, {"$set": {"title": "changed"}})
+    await engine.delete_many("faqs", {"q": {"$in": [1, 2]}})
+    await engine.insert_one("api_keys", {"_id": "k", "name": "x"})
+    first = await backup.create_backup(engine, incremental=True, directory=tmp_path / "backups")
+    states.append(await _dump(engine))
+
+    await engine.delete_one("api_keys", {"_id": "k"})
+    await engine.insert_one("faqs", {"_id": "f1", "q": "back"})
+    second = await backup.create_backup(engine, incremental=True, directory=tmp_path / "backups")
+    states.append(await _dump(engine))
+    await engine.close()
+
+    assert (full["kind"], first["kind"], second["kind"]) == ("full", "incremental", "incremental")
+    assert first["counts"]["content"]["written"] == 1
+    assert first["counts"]["faqs"]["deleted"] == 2
+    assert [entry["id"] for entry in backup.list_backups(tmp_path / "backups")] == \
+        [full["id"], first["id"], second["id"]]
+
+    for manifest, state in zip([full, first, second], states):
+        archive = tmp_path / "backups" / f"{manifest['id']}.tar.gz"
+        target = open_engine(tmp_path / manifest["id"])
+        await backup.restore_backup(target, archive)
+        assert await _dump(target) == state
+        await target.close()
+        # The restore was written to disk.
+        reopened = open_engine(tmp_path / manifest["id"])
+        assert await _dump(reopened) == state
+        await reopened.close()
+
+
+async def test_restore_refuses_to_overwrite_without_force(open_engine, tmp_path):
+    engine = open_engine()
+    await _fill(engine)
+    manifest = await backup.create_backup(engine, directory=tmp_path / "backups")
+    archive = tmp_path / "backups" / f"{manifest['id']}.tar.gz"
+    expected = await _dump(engine)
+    await engine.insert_one("faqs", {"_id": "extra"})
+
+    with pytest.raises(ValueError):
+        await backup.restore_backup(engine, archive)
+    await backup.restore_backup(engine, archive, force=True)
+    assert await _dump(engine) == expected
+    await engine.close()
+
+
+async def test_a_snapshot_is_not_changed_by_writes_made_while_it_is_read(open_engine):
+    engine = open_engine()
+    await _fill(engine)
+    expected = await _dump(engine)
+    async with engine.snapshot() as read:
+        await engine.delete_many("faqs", {})
+        await engine.update_many("content", {}, {"$set": {"status": "published"}})
+        await engine.insert_one("api_keys", {"_id": "late"})
+        seen = {}
+        for collection in expected:
+            seen[collection] = sorted([doc async for batch in read(collection, 300) for doc in batch],
+                                      key=lambda doc: doc["_id"])
+    assert [len(docs) for docs in seen.values()] == [2500, 5, 0]
+    assert {doc["status"] for doc in seen["content"]} == {"draft"}
+    await engine.close()
+
+
+async def test_command_line_backup_leaves_a_running_writer_intact(open_storage, tmp_path, data_dir):
+    """The server keeps its journal open while ``backup.py create`` reads the same files."""
+    server = open_storage(journal=True)
+    for i in range(5):
+        await server.insert_one("faqs", {"_id": f"a{i}"})
+    journal = server._journal_path("faqs")
+    # An append the server is part way through when the backup starts
+    partial = b'{"op": "put", "doc": {"_id"'
+    with open(journal, "ab") as f:
+        f.write(partial)
+    size = journal.stat().st_size
+
+    env = dict(os.environ, DATA_DIR=str(data_dir), STORAGE_JOURNAL="true", BACKUP_DIR=str(tmp_path / "backups"))
+    subprocess.run([sys.executable, "backup.py", "create"], cwd=BACKEND, env=env, check=True, capture_output=True)
+    assert journal.stat().st_size == size
+
+    with open(journal, "r+b") as f:
+        f.truncate(size - len(partial))
+    for i in range(5, 8):
+        await server.insert_one("faqs", {"_id": f"a{i}"})
+    # The server dies without a checkpoint; its journal still has every write.
+    reloaded = open_storage(journal=True)
+    assert await ids(reloaded, "faqs") == [f"a{i}" for i in range(8)]
+
+    restored = open_storage(tmp_path / "restored")
+    [manifest] = backup.list_backups(tmp_path / "backups")
+    await backup.restore_backup(restored, tmp_path / "backups" / f"{manifest['id']}.tar.gz")
+    assert await ids(restored, "faqs") == [f"a{i}" for i in range(5)]
+    await restored.close()
+    await reloaded.close()
+
+
+async def test_a_read_only_engine_changes_nothing(open_storage, data_dir):
+    engine = open_storage(journal=True)
+    await engine.insert_many("faqs", [{"_id": f"f{i}"} for i in range(3)])
+    files = {path: path.read_bytes() for path in data_dir.iterdir()}
+
+    reader = open_storage(journal=True, read_only=True)
+    assert await ids(reader, "faqs") == ["f0", "f1", "f2"]
+    with pytest.raises(IOError):
+        await reader.insert_one("faqs", {"_id": "f3"})
+    await reader.close()
+    assert {path: path.read_bytes() for path in data_dir.iterdir()} == files
+    open_storage(data_dir.parent / "missing", read_only=True)
+    assert not (data_dir.parent / "missing").exists()
+    await engine.close()
+
+
+def test_backup_routes_need_a_login_token(client, bearer, monkeypatch, tmp_path):
+    monkeypatch.setattr(routes.backup, "storage", storage.storage)
+    monkeypatch.setenv("BACKUP_DIR", str(tmp_path / "backups"))
+    key = client.post("/api/auth/api-keys", json={"name": "zapier"}, headers=bearer).json()["key"]
+    created = client.post("/api/backups/", headers=bearer)
+    assert created.status_code == 200
+    backup_id = created.json()["id"]
+
+    for method, path in [("post", "/api/backups/"), ("get", "/api/backups/"), ("get", f"/api/backups/{backup_id}")]:
+        response = client.request(method, path, headers={"X-API-Key": key})
+        assert response.status_code in (401, 403), path
+    assert [entry["id"] for entry in client.get("/api/backups/", headers=bearer).json()] == [backup_id]
+    assert client.get(f"/api/backups/{backup_id}", headers=bearer).content[:2] == b"\x1f\x8b"
@@ -0,0 +1,65 @@
+"""Bulk writes: one lock and one commit per batch, ordered and unordered failures."""
+
+import pytest
+
+from storage import BulkWriteError, FileStorage
+from .conftest import ids
+
+
+async def test_a_batch_is_committed_in_one_journal_append(open_storage, monkeypatch):
+    engine = open_storage(journal=True)
+    appends = []
+    append = FileStorage._append_journal
+    monkeypatch.setattr(FileStorage, "_append_journal",
+                        lambda self, collection, records, *args: appends.append(len(records)) or append(self, collection, records, *args))
+
+    result = await engine.bulk_write("faqs", [
+        {"insert_one": {"document": {"_id": "f1", "n": 1}}},
+        {"insert_one": {"document": {"_id": "f2", "n": 2}}},
+        {"insert_one": {"document": {"_id": "f3", "n": 2}}},
+        {"update_many": {"filter": {"n": 2}, "update": {"$set": {"n": 20}}}},
+        {"delete_one": {"filter": {"_id": "f1"}}},
+        {"update_one": {"filter": {"_id": "nobody"}, "update": {"$set": {"n": 0}}}},
+    ])
+    assert (result["inserted_count"], result["modified_count"], result["deleted_count"]) == (3, 2, 1)
+    assert result["results"][-1] == {"modified_count": 0}
+    assert appends == [6]
+    docs = await open_storage(journal=True).find("faqs", {}, sort=[("_id", 1)])
+    assert [(doc["_id"], doc["n"]) for doc in docs] == [("f2", 20), ("f3", 20)]
+
+
+@pytest.mark.parametrize("ordered, expected", [
+    (True, ["f0", "f1"]),
+    (False, ["f0", "f1", "f3"]),
+])
+async def test_failures_stop_ordered_batches_and_keep_what_succeeded(open_storage, ordered, expected):
+    engine = open_storage()
+    await engine.insert_one("faqs", {"_id": "f0"})
+    documents = [{"_id": "f1"}, {"_id": "f0"}, {"_id": "f3"}]
+
+    with pytest.raises(BulkWriteError) as raised:
+        await engine.insert_many("faqs", documents, ordered=ordered)
+    assert [error["index"] for error in raised.value.errors] == [1]
+    assert raised.value.result["inserted_count"] == len(expected) - 1
+    assert await ids(engine, "faqs") == expected
+    assert await ids(open_storage(), "faqs") == expected
+
+
+async def test_many_variants_touch_every_match(open_storage):
+    engine = open_storage()
+    await engine.insert_many("faqs", [{"_id": f"f{i}", "n": i % 3} for i in range(9)])
+    assert await engine.update_many("faqs", {"n": 1}, {"$set": {"seen": True}}) == {"modified_count": 3}
+    assert len(await engine.find("faqs", {"seen": True})) == 3
+    assert await engine.delete_many("faqs", {"n": 0}) == {"deleted_count": 3}
+    assert await ids(engine, "faqs") == ["f1", "f2", "f4", "f5", "f7", "f8"]
+
+
+@pytest.mark.parametrize("operations", [
+    [{"insert_one": {"document": {}}, "delete_one": {"filter": {}}}],
+    [{"replace_one": {"filter": {}, "replacement": {}}}],
+])
+async def test_malformed_operations_are_rejected_before_anything_runs(open_storage, operations):
+    engine = open_storage()
+    with pytest.raises(ValueError):
+        await engine.bulk_write("faqs", [{"insert_one": {"document": {"_id": "f1"}}}] + operations)
+    assert await ids(engine, "faqs") == []
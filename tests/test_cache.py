@@ -0,0 +1,63 @@
+"""The resident collection cache: write-through, budgets and eviction."""
+
+import json
+from datetime import datetime
+
+
+async def test_writes_reach_the_file_before_returning(open_storage, data_dir):
+    engine = open_storage()
+    await engine.insert_one("faqs", {"_id": "f1", "q": "one"})
+    await engine.update_one("faqs", {"_id": "f1"}, {"$set": {"q": "uno"}})
+    await engine.insert_one("faqs", {"_id": "f2", "q": "two"})
+    await engine.delete_one("faqs", {"_id": "f2"})
+
+    on_disk = json.loads((data_dir / "faqs.json").read_text())
+    assert [(doc["_id"], doc["q"]) for doc in on_disk] == [("f1", "uno")]
+    assert [doc["_id"] for doc in await open_storage().find("faqs", {})] == ["f1"]
+
+
+async def test_cached_documents_read_back_as_they_are_stored(open_storage):
+    cached = open_storage()
+    uncached = open_storage(cache_budget=0)
+    created = datetime(2024, 5, 1, 12, 30)
+    await cached.insert_one("content", {"_id": "c1", "created_at": created})
+
+    expected = await uncached.find_one("content", {"_id": "c1"})
+    # The JSON file keeps a string, which the content codec parses back.
+    assert expected["created_at"] == created
+    assert await cached.find_one("content", {"_id": "c1"}) == expected
+
+
+async def test_results_are_not_changed_by_later_writes(open_storage):
+    engine = open_storage()
+    await engine.insert_one("faqs", {"_id": "f1", "q": "one"})
+    before = await engine.find("faqs", {})
+    await engine.update_one("faqs", {"_id": "f1"}, {"$set": {"q": "changed"}})
+    before[0]["q"] = "scribbled"
+
+    assert before[0]["q"] == "scribbled"
+    assert (await engine.find_one("faqs", {"_id": "f1"}))["q"] == "changed"
+
+
+async def test_zero_budget_rereads_the_file(open_storage, data_dir):
+    engine = open_storage(cache_budget=0)
+    await engine.insert_one("faqs", {"_id": "f1"})
+    (data_dir / "faqs.json").write_text(json.dumps([{"_id": "edited"}]))
+
+    assert [doc["_id"] for doc in await engine.find("faqs", {})] == ["edited"]
+    assert engine.cache_stats()["collections"] == {}
+
+
+async def test_least_recently_used_collections_are_evicted(open_storage):
+    engine = open_storage(cache_budget=4000)
+    for name in ("faqs", "features", "testimonials"):
+        for i in range(10):
+            await engine.insert_one(name, {"_id": f"{name}-{i}", "text": "x" * 50})
+    await engine.find("features", {})
+
+    stats = engine.cache_stats()
+    assert stats["bytes"] <= 4000
+    assert "features" in stats["collections"]
+    assert "faqs" not in stats["collections"]
+    # An evicted collection reloads from its file.
+    assert len(await engine.find("faqs", {})) == 10
@@ -0,0 +1,80 @@
+"""Document codecs: typed values on the way out, plain stored values underneath."""
+
+import json
+from datetime import datetime
+
+import pytest
+
+from codec import Document, DocumentCodec
+from models import ContentStatus, Engagement
+from sqlite_storage import SQLiteStorage
+
+CODEC = DocumentCodec({"created_at": datetime, "status": ContentStatus, "engagement": Engagement})
+
+
+def test_encode_keeps_enums_and_models_as_plain_values():
+    document = {"_id": "c1", "status": ContentStatus.published, "engagement": Engagement(views=3)}
+    encoded = CODEC.encode(document)
+    assert encoded == {"_id": "c1", "status": "published", "engagement": {"views": 3, "likes": 0, "shares": 0}}
+    assert document["status"] is ContentStatus.published
+    plain = {"_id": "c2", "status": "draft"}
+    assert CODEC.encode(plain) is plain
+
+
+def test_restore_parses_datetimes_and_decode_types_the_rest():
+    stored = CODEC.restore({"created_at": "2024-05-01T12:30:00", "status": "draft",
+                            "engagement": {"views": 7}, "other": "2024-05-01T12:30:00"})
+    assert isinstance(stored, Document)
+    assert stored["created_at"] == datetime(2024, 5, 1, 12, 30)
+    assert stored["other"] == "2024-05-01T12:30:00"
+
+    decoded = CODEC.decode(stored)
+    assert decoded["status"] is ContentStatus.draft
+    assert decoded["engagement"] == Engagement(views=7)
+    assert stored["status"] == "draft"
+
+
+def test_decoding_is_cached_but_callers_get_their_own_copy():
+    stored = CODEC.restore({"status": "scheduled"})
+    first = CODEC.decode(stored)
+    first["status"] = "scribbled"
+    second = CODEC.decode(stored)
+    assert second["status"] is ContentStatus.scheduled
+    assert stored._decoded is not first and stored._decoded is not second
+
+
+def test_values_that_do_not_decode_are_left_alone():
+    decoded = CODEC.decode({"status": "archived", "engagement": {"views": "many"}, "created_at": "not a date"})
+    assert decoded == {"status": "archived", "engagement": {"views": "many"}, "created_at": "not a date"}
+
+
+def test_unsupported_field_types_are_rejected():
+    with pytest.raises(TypeError):
+        DocumentCodec({"tags": list})
+
+
+@pytest.mark.parametrize("kind", ["json", "binary", "sqlite"])
+async def test_engines_store_plain_values_and_return_typed_ones(open_storage, data_dir, tmp_path, kind):
+    if kind == "sqlite":
+        engine = SQLiteStorage(str(tmp_path / "blotato.db"))
+        engine.register_codec("content", CODEC)
+    else:
+        engine = open_storage(format=kind, journal=True)
+    created = datetime(2024, 5, 1, 12, 30)
+    await engine.insert_many("content", [
+        {"_id": "c1", "created_at": created, "status": ContentStatus.published, "engagement": Engagement(views=5)},
+        {"_id": "c2", "created_at": "2024-06-01T08:00:00", "status": "draft"},
+    ])
+    await engine.update_one("content", {"_id": "c2"}, {"$set": {"engagement": Engagement(likes=2)}})
+
+    doc = await engine.find_one("content", {"status": "published"})
+    assert doc["status"] is ContentStatus.published and doc["engagement"] == Engagement(views=5)
+    assert doc["created_at"] == created
+    # Datetime fields compare as datetimes, however they were written.
+    latest = await engine.find("content", {"created_at": {"$gt": created}}, sort=[("created_at", -1)])
+    assert [(d["_id"], d["created_at"]) for d in latest] == [("c2", datetime(2024, 6, 1, 8))]
+    assert (await engine.find_one("content", {"engagement.likes": 2}))["_id"] == "c2"
+    await engine.close()
+    if kind == "json":
+        stored = {doc["_id"]: doc for doc in json.loads((data_dir / "content.json").read_text())}
+        assert stored["c1"]["status"] == "published" and stored["c1"]["engagement"]["views"] == 5
@@ -0,0 +1,103 @@
+"""Background compaction must not lose or resurrect writes made while it runs."""
+
+import asyncio
+
+import pytest
+
+from storage import FileStorage
+
+
+async def _writes(engine, expected, start, count):
+    """Insert, update and delete documents, mirroring them in ``expected``."""
+    for i in range(start, start + count):
+        await engine.insert_one("faqs", {"_id": f"f{i}", "n": i})
+        expected[f"f{i}"] = i
+        if i % 3 == 0:
+            await engine.update_one("faqs", {"_id": f"f{i // 2}"}, {"$set": {"n": -i}})
+            if f"f{i // 2}" in expected:
+                expected[f"f{i // 2}"] = -i
+        if i % 5 == 0:
+            await engine.delete_one("faqs", {"_id": f"f{i // 3}"})
+            expected.pop(f"f{i // 3}", None)
+        await asyncio.sleep(0)
+
+
+async def _contents(engine):
+    return {doc["_id"]: doc["n"] for doc in await engine.find("faqs", {})}
+
+
+def test_compaction_needs_the_journal(open_storage):
+    with pytest.raises(ValueError):
+        open_storage(compaction=True)
+
+
+@pytest.mark.parametrize("format", ["json", "binary"])
+async def test_writes_during_compaction_are_kept(open_storage, format):
+    options = dict(journal=True, compaction=True, compact_interval=0, snapshot_every=10 ** 6, format=format)
+    engine = open_storage(**options)
+    expected = {}
+    await _writes(engine, expected, 0, 300)
+    journaled = engine.compaction_stats()["collections"]["faqs"]["journal_records"]
+
+    # Pace the compaction so the writes below land while it runs.
+    engine.compact_io_budget = 50_000
+    compaction = asyncio.ensure_future(engine.compact("faqs"))
+    await _writes(engine, expected, 300, 200)
+    assert await compaction
+    await _writes(engine, expected, 500, 20)
+
+    stats = engine.compaction_stats()["collections"]["faqs"]
+    assert stats["compactions"] == 1
+    assert stats["journal_records"] < journaled
+    assert await _contents(engine) == expected
+    # Without close() the reload replays what the compaction left in the journal.
+    assert await _contents(open_storage(**options)) == expected
+    await engine.close()
+    assert await _contents(open_storage(**options)) == expected
+
+
+async def test_a_long_journal_is_compacted_in_the_background(open_storage):
+    engine = open_storage(journal=True, compaction=True, compact_interval=0, snapshot_every=50)
+    expected = {}
+    await _writes(engine, expected, 0, 60)
+    while engine.compaction_stats()["running"]:
+        await asyncio.sleep(0.01)
+    stats = engine.compaction_stats()["collections"]["faqs"]
+    assert stats["compactions"] >= 1
+    assert stats["journal_records"] < 50
+    assert await _contents(open_storage(journal=True)) == expected
+    await engine.close()
+
+
+async def test_cursor_open_across_a_compaction_sees_one_version(open_storage):
+    engine = open_storage(journal=True, compaction=True, compact_interval=0)
+    await engine.insert_many("faqs", [{"_id": f"f{i:03d}", "n": i} for i in range(250)])
+    seen = []
+    async for batch in engine.find_batches("faqs", {}, sort=[("n", 1)], batch_size=50):
+        seen.extend(doc["_id"] for doc in batch)
+        if len(seen) == 50:
+            await engine.delete_many("faqs", {"n": {"$gte": 200}})
+            await engine.insert_one("faqs", {"_id": "late", "n": 1000})
+            assert await engine.compact("faqs")
+    assert seen == [f"f{i:03d}" for i in range(250)]
+    assert await engine.count_documents("faqs") == 201
+    await engine.close()
+
+
+async def test_background_compaction_failures_are_logged(open_storage, monkeypatch, caplog):
+    engine = open_storage(journal=True, compaction=True, compact_interval=0.01)
+
+    def full_disk(*args):
+        raise OSError("disk full")
+    monkeypatch.setattr(FileStorage, "_install_snapshot", full_disk)
+    with caplog.at_level("ERROR", logger="storage"):
+        await engine.insert_many("faqs", [{"_id": f"f{i}", "n": i} for i in range(10)])
+        for _ in range(200):
+            if "Failed to compact 'faqs'" in caplog.messages:
+                break
+            await asyncio.sleep(0.01)
+    assert "Failed to compact 'faqs'" in caplog.messages
+    assert "last_error" in engine.compaction_stats()["collections"]["faqs"]
+    monkeypatch.undo()
+    assert await _contents(open_storage(journal=True)) == {f"f{i}": i for i in range(10)}
+    await engine.close()
@@ -0,0 +1,66 @@
+"""Concurrent use of one engine: lock-free reads, queued writes and shared loads."""
+
+import asyncio
+import threading
+
+import pytest
+
+from storage import FileStorage
+from .conftest import ids
+
+
+async def test_reads_do_not_wait_for_writers(open_storage):
+    engine = open_storage()
+    await engine.insert_one("faqs", {"_id": "f0"})
+    async with engine._get_lock("faqs"):
+        write = asyncio.ensure_future(engine.insert_one("faqs", {"_id": "f1"}))
+        assert await asyncio.wait_for(ids(engine, "faqs"), 1) == ["f0"]
+        assert not write.done()
+    await write
+    assert await ids(engine, "faqs") == ["f0", "f1"]
+
+
+async def test_concurrent_writes_are_all_kept(open_storage):
+    engine = open_storage(journal=True)
+    await asyncio.gather(*(engine.insert_one("faqs", {"_id": f"f{i:02d}", "n": i}) for i in range(40)))
+    await asyncio.gather(*(engine.update_one("faqs", {"_id": f"f{i:02d}"}, {"$set": {"n": -i}}) for i in range(0, 40, 2)))
+
+    expected = [f"f{i:02d}" for i in range(40)]
+    assert await ids(engine, "faqs") == expected
+    await engine.close()
+    reopened = open_storage()
+    assert await ids(reopened, "faqs") == expected
+    assert {doc["n"] for doc in await reopened.find("faqs", {"n": -2})} == {-2}
+
+
+async def test_readers_missing_the_cache_together_share_one_load(open_storage, monkeypatch):
+    engine = open_storage()
+    await engine.insert_one("faqs", {"_id": "f1"})
+    await engine.close()
+
+    loads = []
+    read = FileStorage._read_collection
+    monkeypatch.setattr(FileStorage, "_read_collection",
+                        lambda self, *args: loads.append(args[0]) or read(self, *args))
+    engine = open_storage()
+    results = await asyncio.gather(*(engine.find("faqs", {}) for _ in range(10)))
+    assert all(result == results[0] for result in results)
+    assert loads == ["faqs"]
+
+
+async def test_a_write_cancelled_while_on_disk_is_still_committed(open_storage, monkeypatch):
+    engine = open_storage()
+    await engine.insert_one("faqs", {"_id": "f0"})
+    writing = threading.Event()
+    write_file = FileStorage._write_file
+    monkeypatch.setattr(FileStorage, "_write_file", lambda self, *args: writing.set() or write_file(self, *args))
+
+    write = asyncio.ensure_future(engine.insert_one("faqs", {"_id": "f1", "text": "x" * 100_000}))
+    while not writing.is_set():
+        await asyncio.sleep(0)
+    write.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await write
+
+    await engine.insert_one("faqs", {"_id": "f2"})
+    assert await ids(engine, "faqs") == await ids(open_storage(), "faqs")
@@ -0,0 +1,67 @@
+"""Cursors: skip and limit, batched iteration, and writes between batches."""
+
+import pytest
+
+import storage
+from .conftest import strip
+
+
+async def _fill(engine, count=250, index=True):
+    if index:
+        await engine.create_index("faqs", [("n", 1)])
+    await engine.insert_many("faqs", [{"_id": f"f{i:03d}", "n": i, "odd": i % 2} for i in range(count)])
+
+
+async def _batches(engine, *args, **kwargs):
+    return [[doc["_id"] for doc in batch] async for batch in engine.find_batches("faqs", *args, **kwargs)]
+
+
+@pytest.mark.parametrize("index", [True, False])
+@pytest.mark.parametrize("query, sort", [
+    ({}, None),
+    ({"odd": 1}, [("n", -1)]),
+    ({"n": {"$gte": 40}}, [("n", 1)]),
+])
+@pytest.mark.parametrize("skip, limit", [(0, None), (7, None), (0, 33), (12, 100)])
+async def test_batches_add_up_to_find(open_storage, index, query, sort, skip, limit):
+    engine = open_storage()
+    await _fill(engine, index=index)
+    expected = [doc["_id"] for doc in await engine.find("faqs", query, sort=sort, skip=skip, limit=limit)]
+    full = [doc["_id"] for doc in await engine.find("faqs", query, sort=sort)]
+    assert expected == full[skip:skip + limit if limit else None]
+
+    batches = await _batches(engine, query, sort=sort, skip=skip, limit=limit, batch_size=20)
+    assert [doc_id for batch in batches for doc_id in batch] == expected
+    assert all(len(batch) == 20 for batch in batches[:-1])
+
+
+@pytest.mark.parametrize("index", [True, False])
+async def test_a_cursor_reads_the_version_it_started_on(open_storage, index):
+    engine = open_storage()
+    await _fill(engine, 100, index=index)
+    seen = []
+    async for batch in engine.find_batches("faqs", {}, sort=[("n", 1)], batch_size=10):
+        seen.extend(doc["n"] for doc in batch)
+        if len(seen) == 30:
+            await engine.insert_many("faqs", [{"_id": "early", "n": 5.5}, {"_id": "late", "n": 50.5}])
+            await engine.delete_many("faqs", {"n": {"$in": [10, 60]}})
+            await engine.update_one("faqs", {"_id": "f070"}, {"$set": {"n": -1}})
+    assert seen == list(range(100))
+    assert len(await engine.find("faqs", {})) == 100
+
+
+async def test_batch_size_must_be_positive(open_storage):
+    with pytest.raises(ValueError):
+        await _batches(open_storage(), {}, batch_size=0)
+
+
+async def test_collection_cursors_iterate_in_batches():
+    await storage.content_collection.insert_many([
+        {"_id": f"cursor-{i}", "user_id": "cursor-test", "n": i} for i in range(12)
+    ])
+    cursor = storage.content_collection.find_cursor({"user_id": "cursor-test"}).sort("n", -1).skip(2).limit(7)
+    listed = await cursor.to_list()
+    iterated = [doc async for doc in cursor.batch_size(3)]
+    assert [doc["n"] for doc in listed] == list(range(9, 2, -1))
+    assert strip(iterated) == strip(listed)
+    await storage.content_collection.delete_many({"user_id": "cursor-test"})
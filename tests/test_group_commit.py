@@ -0,0 +1,83 @@
+"""Group commit: batched flushes, atomic snapshots and failed commits."""
+
+import asyncio
+import json
+
+import pytest
+
+from storage import FileStorage
+from .conftest import ids
+
+
+async def test_writes_in_one_window_share_a_journal_append(open_storage, monkeypatch):
+    engine = open_storage(journal=True, commit_window=0.01)
+    appends = []
+    append = FileStorage._append_journal
+    monkeypatch.setattr(FileStorage, "_append_journal",
+                        lambda self, collection, records, *args: appends.append(len(records)) or append(self, collection, records, *args))
+
+    await asyncio.gather(*(engine.insert_one("faqs", {"_id": f"f{i}"}) for i in range(20)))
+    assert appends == [20]
+    await engine.insert_one("faqs", {"_id": "late"})
+    assert appends == [20, 1]
+    assert len(await ids(open_storage(journal=True), "faqs")) == 21
+
+
+async def test_always_durability_flushes_each_write_on_its_own(open_storage, monkeypatch):
+    engine = open_storage(journal=True, durability="always", commit_window=0.01)
+    appends = []
+    append = FileStorage._append_journal
+    monkeypatch.setattr(FileStorage, "_append_journal",
+                        lambda self, collection, records, *args: appends.append(len(records)) or append(self, collection, records, *args))
+
+    await asyncio.gather(*(engine.insert_one("faqs", {"_id": f"f{i}"}) for i in range(5)))
+    await engine.insert_many("faqs", [{"_id": f"g{i}"} for i in range(3)])
+    assert appends == [1, 1, 1, 1, 1, 3]
+    assert len(await ids(open_storage(journal=True), "faqs")) == 8
+
+
+def test_unknown_durability_is_rejected(data_dir):
+    with pytest.raises(ValueError):
+        FileStorage(str(data_dir), durability="sometimes")
+
+
+@pytest.mark.parametrize("durability", ["none", "batch", "always"])
+async def test_every_durability_level_keeps_the_writes(open_storage, durability):
+    engine = open_storage(durability=durability)
+    await asyncio.gather(*(engine.insert_one("faqs", {"_id": f"f{i}"}) for i in range(5)))
+    await engine.delete_one("faqs", {"_id": "f0"})
+    assert await ids(open_storage(), "faqs") == [f"f{i}" for i in range(1, 5)]
+
+
+async def test_a_failed_snapshot_leaves_the_previous_file(open_storage, data_dir, monkeypatch):
+    engine = open_storage()
+    await engine.insert_one("faqs", {"_id": "f1"})
+    before = (data_dir / "faqs.json").read_text()
+
+    def torn_dump(data, f, **kwargs):
+        f.write("[{")
+        raise OSError("disk full")
+    monkeypatch.setattr(json, "dump", torn_dump)
+    with pytest.raises(OSError):
+        await engine.insert_one("faqs", {"_id": "f2"})
+    monkeypatch.undo()
+
+    assert (data_dir / "faqs.json").read_text() == before
+    # The failed write is dropped from memory along with the file's copy.
+    assert await ids(engine, "faqs") == ["f1"]
+    await engine.insert_one("faqs", {"_id": "f3"})
+    assert await ids(open_storage(), "faqs") == ["f1", "f3"]
+
+
+async def test_writers_sharing_a_failed_commit_all_fail(open_storage, monkeypatch):
+    engine = open_storage(journal=True, commit_window=0.01)
+    await engine.insert_one("faqs", {"_id": "f0"})
+
+    def failing_append(self, collection, records, *args):
+        raise OSError("disk full")
+    monkeypatch.setattr(FileStorage, "_append_journal", failing_append)
+    results = await asyncio.gather(*(engine.insert_one("faqs", {"_id": f"f{i}"}) for i in range(1, 4)),
+                                   return_exceptions=True)
+    assert all(isinstance(result, OSError) for result in results)
+    monkeypatch.undo()
+    assert await ids(engine, "faqs") == ["f0"]
@@ -0,0 +1,89 @@
+"""Secondary indexes must return what a scan of the same documents returns."""
+
+import pytest
+
+from storage import DuplicateKeyError
+
+
+def _content(count=120):
+    return [
+        {"_id": f"c{i:03d}", "user_id": f"u{i % 3}", "status": ["draft", "published"][i % 2],
+         "created_at": f"2024-01-01T00:{i // 60:02d}:{i % 60:02d}"}
+        for i in range(count)
+    ]
+
+
+async def _fill(engine, indexed):
+    if indexed:
+        await engine.create_index("content", "user_id")
+        await engine.create_index("content", [("user_id", 1), ("created_at", -1)])
+    for doc in _content():
+        await engine.insert_one("content", doc)
+    # Later writes must keep the indexes in step.
+    await engine.update_one("content", {"_id": "c004"}, {"$set": {"user_id": "u2"}})
+    await engine.update_one("content", {"_id": "c007"}, {"$set": {"created_at": "2025-01-01T00:00:00"}})
+    await engine.delete_one("content", {"_id": "c010"})
+    return engine
+
+
+CASES = [
+    ({"user_id": "u1"}, None, None),
+    ({"user_id": "u2", "status": "draft"}, None, None),
+    ({"user_id": "u1"}, [("created_at", -1)], 5),
+    ({"user_id": "u2"}, [("created_at", 1)], 7),
+    ({"user_id": "u0", "status": "published"}, [("created_at", -1)], 3),
+    ({"status": "draft"}, [("user_id", 1), ("created_at", -1)], 10),
+    ({"user_id": "nobody"}, [("created_at", -1)], 5),
+]
+
+
+async def test_indexed_find_matches_a_scan(open_storage, tmp_path):
+    indexed = await _fill(open_storage(), indexed=True)
+    scanned = await _fill(open_storage(tmp_path / "scan"), indexed=False)
+
+    for query, sort, limit in CASES:
+        got = await indexed.find("content", query, sort=sort, limit=limit)
+        want = await scanned.find("content", query, sort=sort, limit=limit)
+        if sort is None:
+            got, want = sorted(got, key=lambda d: d["_id"]), sorted(want, key=lambda d: d["_id"])
+        assert [doc["_id"] for doc in got] == [doc["_id"] for doc in want], (query, sort, limit)
+        if not want:
+            assert await indexed.find_one("content", query) is None
+
+
+async def test_unique_indexes_reject_duplicates(open_storage):
+    engine = open_storage()
+    await engine.create_index("api_keys", "key", unique=True)
+    await engine.insert_one("api_keys", {"_id": "k1", "key": "abc"})
+    with pytest.raises(DuplicateKeyError):
+        await engine.insert_one("api_keys", {"_id": "k2", "key": "abc"})
+    with pytest.raises(DuplicateKeyError):
+        await engine.insert_one("api_keys", {"_id": "k1", "key": "other"})
+    await engine.insert_one("api_keys", {"_id": "k2", "key": "def"})
+    with pytest.raises(DuplicateKeyError):
+        await engine.update_one("api_keys", {"_id": "k2"}, {"$set": {"key": "abc"}})
+    assert await engine.find_one("api_keys", {"key": "def"}) is not None
+
+
+async def test_sorting_mixed_types_does_not_raise(open_storage):
+    engine = open_storage()
+    for i, value in enumerate([3, "b", None, 1.5, "a"]):
+        await engine.insert_one("faqs", {"_id": f"f{i}", "order": value})
+    await engine.insert_one("faqs", {"_id": "missing"})
+    docs = await engine.find("faqs", {}, sort=[("order", 1)])
+    assert [doc.get("order") for doc in docs][2:] == [1.5, 3, "a", "b"]
+
+
+async def test_an_index_built_over_existing_documents_matches_one_kept_in_step(open_storage, tmp_path):
+    kept = await _fill(open_storage(), indexed=True)
+    built = await _fill(open_storage(tmp_path / "built"), indexed=False)
+    await built.create_index("content", [("user_id", 1), ("created_at", -1)])
+
+    names = [name for name, index in (await kept._load("content")).indexes.items() if index.kind == "ordered"]
+    assert (await built._load("content")).indexes[names[0]].entries == \
+        (await kept._load("content")).indexes[names[0]].entries
+    for query, sort, limit in CASES:
+        if sort is not None:
+            got = await built.find("content", query, sort=sort, limit=limit)
+            want = await kept.find("content", query, sort=sort, limit=limit)
+            assert [doc["_id"] for doc in got] == [doc["_id"] for doc in want], (query, sort, limit)
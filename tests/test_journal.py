@@ -0,0 +1,67 @@
+"""Journaled storage: replaying the journal after a crash, and torn records."""
+
+import pytest
+
+from .conftest import ids
+
+
+@pytest.mark.parametrize("format", ["json", "binary"])
+async def test_journal_is_replayed_after_a_crash(open_storage, format):
+    engine = open_storage(journal=True, format=format)
+    for i in range(10):
+        await engine.insert_one("faqs", {"_id": f"f{i}", "n": i})
+    await engine.update_one("faqs", {"_id": "f3"}, {"$set": {"n": 30}})
+    await engine.delete_one("faqs", {"_id": "f1"})
+    expected = await engine.find("faqs", {}, sort=[("_id", 1)])
+    assert engine._journal_path("faqs").exists()
+    # No checkpoint, so the reload has to replay the journal.
+    reopened = open_storage(journal=True, format=format)
+    assert await reopened.find("faqs", {}, sort=[("_id", 1)]) == expected
+
+
+@pytest.mark.parametrize("format", ["json", "binary"])
+async def test_torn_journal_record_is_cut_off(open_storage, format):
+    engine = open_storage(journal=True, format=format)
+    for i in range(5):
+        await engine.insert_one("faqs", {"_id": f"f{i}"})
+    journal = engine._journal_path("faqs")
+    intact = journal.stat().st_size
+    with open(journal, "ab") as f:
+        f.write(b'{"op": "put", "doc": {"_id"' if format == "json" else b"\x40\x00\x00\x00\x01\x02")
+
+    reopened = open_storage(journal=True, format=format)
+    assert await ids(reopened, "faqs") == [f"f{i}" for i in range(5)]
+    assert journal.stat().st_size == intact
+    await reopened.insert_one("faqs", {"_id": "f5"})
+    assert await ids(open_storage(journal=True, format=format), "faqs") == [f"f{i}" for i in range(6)]
+
+
+async def test_snapshot_resets_the_journal(open_storage):
+    engine = open_storage(journal=True, snapshot_every=5)
+    for i in range(12):
+        await engine.insert_one("faqs", {"_id": f"f{i}"})
+    assert engine._cache["faqs"].journal_records < 5
+    await engine.checkpoint()
+    assert not engine._journal_path("faqs").exists()
+    assert await ids(open_storage(), "faqs") == sorted(f"f{i}" for i in range(12))
+
+
+async def test_inserts_without_an_id_are_given_one(open_storage):
+    engine = open_storage(journal=True)
+    await engine.insert_one("faqs", {"q": "first"})
+    await engine.insert_one("faqs", {"q": "second"})
+    docs = await open_storage(journal=True).find("faqs", {})
+    assert sorted(doc["q"] for doc in docs) == ["first", "second"]
+    assert len({doc["_id"] for doc in docs}) == 2
+
+
+async def test_shorter_journal_fails_the_write_instead_of_padding_it(open_storage):
+    engine = open_storage(journal=True)
+    for i in range(3):
+        await engine.insert_one("faqs", {"_id": f"f{i}"})
+    journal = engine._journal_path("faqs")
+    journal.write_bytes(b"")
+    with pytest.raises(IOError):
+        await engine.insert_one("faqs", {"_id": "f3"})
+    assert b"\0" not in journal.read_bytes()
+    await engine.close()
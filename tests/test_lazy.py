@@ -0,0 +1,96 @@
+"""Lazily decoded documents and query projections."""
+
+from datetime import datetime
+
+import pytest
+
+import segments
+from sqlite_storage import SQLiteStorage
+
+from .conftest import strip
+
+
+def _documents(count=50):
+    return [
+        {"_id": f"d{i:03d}", "user_id": f"u{i % 3}", "title": f"t{i}", "body": "x" * i,
+         "stats": {"views": i, "tags": ["a", i]}, "scheduled_at": datetime(2024, 1, 1 + i % 28)}
+        for i in range(count)
+    ]
+
+
+async def _reopened(open_storage, docs, **options):
+    """Write ``docs`` to disk and return an engine that reads them back."""
+    engine = open_storage(format="binary")
+    await engine.insert_many("content", [dict(doc) for doc in docs])
+    await engine.close()
+    return open_storage(format="binary", **options)
+
+
+def test_lazy_documents_decode_fields_on_first_access():
+    doc = {"_id": "a", "title": "t", "stats": {"views": 3}, "at": datetime(2024, 5, 1, 12)}
+    lazy = segments.LazyDocument(segments.encode_value(doc))
+    assert list(lazy) == ["_id", "title", "stats", "at"] and len(lazy) == 4
+    assert dict.__len__(lazy) == 0
+    assert lazy["at"] == datetime(2024, 5, 1, 12)
+    assert dict.__len__(lazy) == 1
+    assert lazy.get("missing", 1) == 1 and "missing" not in lazy
+    assert lazy == doc
+    with pytest.raises(KeyError):
+        lazy["missing"]
+
+
+def test_unchanged_documents_are_written_back_as_their_records():
+    payload = segments.encode_value({"_id": "a", "n": 1, "nested": {"b": [1, 2]}})
+    lazy = segments.LazyDocument(payload)
+    lazy["n"]
+    assert segments.encode_value(lazy) == payload
+
+    lazy["n"] = 2
+    assert segments.decode_value(segments.encode_value(lazy)) == {"_id": "a", "n": 2, "nested": {"b": [1, 2]}}
+
+
+def test_lazy_needs_the_binary_format(open_storage):
+    with pytest.raises(ValueError):
+        open_storage(lazy=True)
+
+
+async def test_lazy_reads_match_eager_ones(open_storage):
+    docs = _documents()
+    eager = await _reopened(open_storage, docs)
+    lazy = open_storage(format="binary", lazy=True)
+    await lazy.create_index("content", [("user_id", 1), ("stats.views", -1)])
+    for query, sort in [({}, None), ({"user_id": "u1"}, [("stats.views", -1)]),
+                        ({"stats.tags": 7}, None), ({"scheduled_at": {"$gte": datetime(2024, 1, 20)}}, [("_id", 1)])]:
+        assert await lazy.find("content", query, sort=sort) == await eager.find("content", query, sort=sort)
+
+    await lazy.update_one("content", {"_id": "d001"}, {"$set": {"title": "edited"}})
+    await lazy.delete_one("content", {"_id": "d002"})
+    await lazy.close()
+    reloaded = await open_storage(format="binary").find("content", {}, sort=[("_id", 1)])
+    assert strip(reloaded) == strip([dict(doc, title="edited") if doc["_id"] == "d001" else doc
+                                     for doc in docs if doc["_id"] != "d002"])
+
+
+@pytest.mark.parametrize("kind", ["json", "lazy", "sqlite"])
+async def test_projections_return_only_the_named_fields(open_storage, tmp_path, kind):
+    docs = _documents(10)
+    if kind == "sqlite":
+        engine = SQLiteStorage(str(tmp_path / "blotato.db"), durability="none")
+        await engine.insert_many("content", [dict(doc) for doc in docs])
+    elif kind == "lazy":
+        engine = await _reopened(open_storage, docs, lazy=True)
+    else:
+        engine = open_storage()
+        await engine.insert_many("content", [dict(doc) for doc in docs])
+
+    found = await engine.find("content", {"user_id": "u1"}, sort=[("_id", 1)], projection=["title", "stats"])
+    assert found == [{"_id": doc["_id"], "title": doc["title"], "stats": doc["stats"]}
+                     for doc in docs if doc["user_id"] == "u1"]
+    assert await engine.find_one("content", {"_id": "d004"}, projection={"_id": 0, "stats": 1}) == \
+        {"stats": {"views": 4, "tags": ["a", 4]}}
+    batches = [batch async for batch in engine.find_batches("content", {}, batch_size=4, projection=["nope"])]
+    assert sorted(doc for batch in batches for doc in (d["_id"] for d in batch)) == [doc["_id"] for doc in docs]
+    assert all(set(doc) == {"_id"} for batch in batches for doc in batch)
+    with pytest.raises(ValueError):
+        await engine.find("content", {}, projection={"title": 0})
+    await engine.close()
@@ -0,0 +1,98 @@
+"""Partitioned collections: routing queries to partitions, and migrating in and out."""
+
+import pytest
+
+from storage import FileStorage
+
+from .conftest import ids, open_pair
+
+PARTITIONS = {"content": "user_id"}
+
+
+def _content(count=60):
+    return [
+        {"_id": f"c{i:03d}", "user_id": f"u{i % 4}", "title": f"t{i}", "status": "draft", "content_type": "text",
+         "rank": (i * 7) % count}
+        for i in range(count)
+    ]
+
+
+async def test_each_key_value_gets_its_own_file(open_storage, data_dir):
+    engine = open_storage(partitions=PARTITIONS)
+    await engine.insert_many("content", _content())
+    await engine.close()
+    assert sorted(path.name for path in (data_dir / "content").glob("*.json")) == [
+        f"u{i}.json" for i in range(4)
+    ]
+    assert not (data_dir / "content.json").exists()
+
+
+async def test_queries_on_the_key_only_load_their_partitions(open_storage):
+    engine = open_storage(partitions=PARTITIONS)
+    await engine.insert_many("content", _content())
+    await engine.close()
+
+    engine = open_storage(partitions=PARTITIONS)
+    assert await ids(engine, "content", {"user_id": "u1"}) == [f"c{i:03d}" for i in range(1, 60, 4)]
+    assert list(engine.cache_stats()["collections"]) == ["content/u1"]
+    assert len(await engine.find("content", {"user_id": {"$in": ["u2", "u3", "nobody"]}})) == 30
+    assert sorted(engine.cache_stats()["collections"]) == ["content/u1", "content/u2", "content/u3"]
+    assert len(await engine.find("content", {"status": "draft"})) == 60
+    assert len(engine.cache_stats()["collections"]) == 4
+    await engine.close()
+
+
+async def test_sorted_queries_merge_every_partition(open_storage, tmp_path):
+    partitioned, plain = await open_pair(open_storage, tmp_path, "content", _content(),
+                                         options={"partitions": PARTITIONS})
+    for query in ({}, {"user_id": {"$in": ["u0", "u3"]}}, {"rank": {"$lt": 30}}):
+        for sort in ([("rank", 1)], [("rank", -1)], [("user_id", -1), ("rank", 1)]):
+            for skip, limit in [(0, None), (3, 10)]:
+                got = await partitioned.find("content", query, sort=sort, skip=skip, limit=limit)
+                want = await plain.find("content", query, sort=sort, skip=skip, limit=limit)
+                assert [doc["_id"] for doc in got] == [doc["_id"] for doc in want], (query, sort, skip, limit)
+
+
+async def test_updates_cannot_move_a_document_between_partitions(open_storage):
+    engine = open_storage(partitions=PARTITIONS)
+    await engine.insert_many("content", _content(8))
+    with pytest.raises(ValueError):
+        await engine.update_one("content", {"_id": "c001"}, {"$set": {"user_id": "u2"}})
+    await engine.update_many("content", {"user_id": "u1"}, {"$set": {"status": "published"}})
+    assert await ids(engine, "content", {"status": "published"}) == ["c001", "c005"]
+    await engine.close()
+
+
+async def test_switching_partitioning_on_and_off_keeps_every_document(open_storage, data_dir):
+    engine = open_storage()
+    await engine.insert_many("content", _content())
+    await engine.close()
+    expected = await ids(open_storage(), "content")
+
+    partitioned = open_storage(partitions=PARTITIONS)
+    assert await ids(partitioned, "content") == expected
+    await partitioned.delete_one("content", {"_id": "c000"})
+    await partitioned.close()
+
+    merged = open_storage()
+    assert await ids(merged, "content") == expected[1:]
+    assert not list((data_dir / "content").glob("*.json"))
+    await merged.close()
+
+
+async def test_a_failed_write_does_not_register_its_partition(open_storage, monkeypatch):
+    engine = open_storage(partitions=PARTITIONS)
+    await engine.insert_many("content", _content(8))
+
+    def full_disk(*args):
+        raise OSError("disk full")
+    monkeypatch.setattr(FileStorage, "_snapshot", full_disk)
+    with pytest.raises(OSError):
+        await engine.insert_many("content", [{"_id": "new", "user_id": "u9"}, {"_id": "c100", "user_id": "u1"}])
+    monkeypatch.undo()
+    assert engine._targets("content", {}) == [f"content/u{i}" for i in range(4)]
+
+    await engine.bulk_write("content", [{"insert_one": {"document": {"_id": "new", "user_id": "u9"}}}])
+    assert engine._targets("content", {"user_id": "u9"}) == ["content/u9"]
+    assert await ids(engine, "content", {"user_id": {"$in": ["u1", "u9"]}}) == ["c001", "c005", "new"]
+    await engine.close()
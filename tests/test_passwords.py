@@ -0,0 +1,86 @@
+"""Password hashing, logins against the stored hash and its upgrades."""
+
+import json
+import threading
+
+import pytest
+
+import auth
+import config
+
+from .conftest import EMAIL, PASSWORD
+
+
+def _login(client, password=PASSWORD):
+    return client.post("/api/auth/login", json={"email": EMAIL, "password": password})
+
+
+def _stored_user(client):
+    return json.loads(config.get_config().config_file.read_text())["user"]
+
+
+def test_setup_stores_only_a_hash(client, monkeypatch):
+    monkeypatch.setattr(config.get_config(), "user_config", None)
+    response = client.post("/api/auth/setup", json={"name": "Test User", "email": EMAIL, "password": PASSWORD})
+    assert response.status_code == 200
+
+    stored = _stored_user(client)
+    assert "password" not in stored and PASSWORD not in json.dumps(stored)
+    assert auth.verify_password(PASSWORD, stored["password_hash"])
+    assert _login(client).status_code == 200
+    assert _login(client, PASSWORD + "!").status_code == 401
+
+
+def test_a_plaintext_password_from_an_earlier_version_is_replaced_on_login(client):
+    assert _login(client, "wrong").status_code == 401
+    assert not config.get_config().config_file.exists()
+
+    assert _login(client).status_code == 200
+    stored = _stored_user(client)
+    assert "password" not in stored and auth.verify_password(PASSWORD, stored["password_hash"])
+    assert _login(client).status_code == 200
+
+
+def test_a_hash_with_another_cost_is_redone_on_login(client, monkeypatch):
+    user = config.get_config().user_config
+    old = auth.bcrypt.hashpw(PASSWORD.encode(), auth.bcrypt.gensalt(5)).decode()
+    monkeypatch.setattr(config.get_config(), "user_config", user.copy(update={"password": None, "password_hash": old}))
+
+    assert _login(client, "wrong").status_code == 401
+    assert config.get_config().user_config.password_hash == old
+    assert _login(client).status_code == 200
+    upgraded = config.get_config().user_config.password_hash
+    assert upgraded != old and auth._hash_rounds(upgraded) == 4
+    assert _stored_user(client)["password_hash"] == upgraded
+
+
+def test_a_password_from_the_environment_is_not_written_out(client, monkeypatch):
+    monkeypatch.setattr(config.get_config(), "user_from_env", True)
+    assert _login(client).status_code == 200
+    assert _login(client, "wrong").status_code == 401
+    assert not config.get_config().config_file.exists()
+
+
+@pytest.mark.parametrize("password", ["é" * 40, "x" * 100])
+def test_long_passwords_hash_and_verify(password):
+    hashed = auth.get_password_hash(password)
+    assert auth.verify_password(password, hashed)
+    assert not auth.verify_password("other", hashed)
+    assert not auth.verify_password(password, "not a hash")
+
+
+async def test_hashing_runs_on_the_password_pool(monkeypatch):
+    threads = []
+    hashpw = auth.bcrypt.hashpw
+    monkeypatch.setattr(auth.bcrypt, "hashpw", lambda *args: threads.append(threading.current_thread().name) or hashpw(*args))
+    hashed = await auth.hash_password(PASSWORD)
+    assert await auth.check_password(PASSWORD, hashed)
+    assert threads and all(name.startswith("password-hash") for name in threads)
+
+
+def test_a_plaintext_password_is_compared_whole(client, monkeypatch):
+    user = config.get_config().user_config
+    monkeypatch.setattr(config.get_config(), "user_config", user.copy(update={"password": "p" * 80}))
+    assert _login(client, "p" * 72 + "different").status_code == 401
+    assert not config.get_config().config_file.exists()
+    assert _login(client, "p" * 80).status_code == 200
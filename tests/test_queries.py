@@ -0,0 +1,107 @@
+"""Query operators, and index-backed queries checked against a full scan."""
+
+import random
+
+import pytest
+
+from .conftest import ids, open_pair, strip
+
+QUERIES = [
+    {},
+    {"user_id": "u1"},
+    {"user_id": {"$in": ["u0", "u3"]}},
+    {"user_id": "u2", "status": "draft"},
+    {"status": {"$ne": "published"}},
+    {"rank": {"$gte": 100, "$lt": 160}},
+    {"user_id": "u1", "rank": {"$gt": 250}},
+    {"user_id": {"$in": ["u1", "u4"]}, "rank": {"$lte": 40}},
+    {"status": {"$nin": ["draft", "scheduled"]}, "views": {"$gt": 50}},
+    {"tag": {"$exists": False}},
+    {"stats.likes": 3},
+    {"user_id": "nobody"},
+]
+
+SORTS = [None, [("rank", 1)], [("rank", -1)], [("user_id", 1), ("rank", -1)]]
+
+INDEXES = ["user_id", "status", [("rank", 1)], [("user_id", 1), ("rank", -1)]]
+
+
+def _documents(count=400):
+    rng = random.Random(7)
+    docs = []
+    for i in range(count):
+        doc = {
+            "_id": f"d{i:04d}",
+            "user_id": f"u{rng.randrange(5)}",
+            "status": rng.choice(["draft", "scheduled", "published"]),
+            "rank": (i * 37) % count,  # unique, so sorted results have one order
+            "views": rng.randrange(100),
+            "stats": {"likes": rng.randrange(5)},
+        }
+        if rng.random() < 0.5:
+            doc["tag"] = rng.choice(["a", "b"])
+        docs.append(doc)
+    return docs
+
+
+async def _open_pair(open_storage, tmp_path, options=None):
+    """Return an engine with indexes and one without, holding the same documents.
+
+    The indexed engine is reopened from disk, so with ``lazy`` it reads
+    documents that are still encoded.
+    """
+    indexed, scanned = await open_pair(open_storage, tmp_path, "faqs", _documents(), options, indexes=INDEXES)
+    await indexed.close()
+    indexed = open_storage(**(options or {}))
+    for index in INDEXES:
+        await indexed.create_index("faqs", index)
+    # Later writes must keep the indexes in step.
+    for engine in (indexed, scanned):
+        await engine.update_many("faqs", {"status": "scheduled", "views": {"$lt": 20}}, {"$set": {"user_id": "u9"}})
+        await engine.delete_many("faqs", {"rank": {"$gte": 380}})
+        await engine.update_one("faqs", {"_id": "d0001"}, {"$set": {"rank": 1000}})
+    return indexed, scanned
+
+
+async def test_operators_on_missing_mixed_and_nested_values(open_storage):
+    engine = open_storage()
+    await engine.insert_many("faqs", [
+        {"_id": "a", "n": 1, "stats": {"views": 10}},
+        {"_id": "b", "n": "1"},
+        {"_id": "c", "n": None, "stats": {"views": 30}},
+        {"_id": "d"},
+    ])
+    assert await ids(engine, "faqs", {"n": {"$ne": 1}}) == ["b", "c", "d"]
+    # Comparisons only match values of the operand's type.
+    assert await ids(engine, "faqs", {"n": {"$gte": 0}}) == ["a"]
+    assert await ids(engine, "faqs", {"n": {"$in": [1, None]}}) == ["a", "c"]
+    assert await ids(engine, "faqs", {"n": {"$nin": [1, "1"]}}) == ["c", "d"]
+    assert await ids(engine, "faqs", {"n": {"$exists": True}}) == ["a", "b", "c"]
+    assert await ids(engine, "faqs", {"stats.views": {"$gt": 5, "$lt": 20}}) == ["a"]
+    assert await ids(engine, "faqs", {"stats.views": {"$exists": False}}) == ["b", "d"]
+    assert await ids(engine, "faqs", {"n": {"$eq": None}}) == ["c"]
+
+
+@pytest.mark.parametrize("query", [{"n": {"$regex": "x"}}, {"$or": [{"n": 1}]}])
+async def test_unsupported_operators_are_rejected(open_storage, query):
+    with pytest.raises(ValueError):
+        await open_storage().find("faqs", query)
+
+
+@pytest.mark.parametrize("options", [{}, {"format": "binary", "lazy": True}])
+async def test_indexed_find_matches_a_full_scan(open_storage, tmp_path, options):
+    indexed, scanned = await _open_pair(open_storage, tmp_path, options)
+    for query in QUERIES:
+        for sort in SORTS:
+            for limit, skip in [(None, 0), (7, 0), (5, 3)]:
+                got = strip(await indexed.find("faqs", query, sort=sort, limit=limit, skip=skip))
+                want = strip(await scanned.find("faqs", query, sort=sort, limit=limit, skip=skip))
+                if sort is None:
+                    # Unsorted results may come back in any order.
+                    if limit is not None:
+                        continue
+                    got, want = sorted(got, key=lambda d: d["_id"]), sorted(want, key=lambda d: d["_id"])
+                assert got == want, (query, sort, limit, skip)
+        assert await indexed.count_documents("faqs", query) == await scanned.count_documents("faqs", query), query
+    await indexed.close()
+    await scanned.close()
@@ -0,0 +1,79 @@
+"""The binary segment format: value round trips, framing and format migration."""
+
+import io
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import segments
+from .conftest import ids
+
+VALUES = [
+    None, True, False, 0, 1, -1, 2 ** 70, -(2 ** 70), 0.5, -1e300, "", "naïve ✓",
+    datetime(2024, 2, 29, 23, 59, 59, 999999), datetime(1969, 7, 20, 20, 17),
+    datetime(2024, 5, 1, 9, 30, tzinfo=timezone(timedelta(hours=-4, minutes=-30))),
+    b"\x00\xff", [1, [2, "three"], {"four": 4}], {"nested": {"empty": {}, "list": []}},
+]
+
+
+@pytest.mark.parametrize("value", VALUES)
+def test_values_round_trip_with_their_types(value):
+    decoded = segments.decode_value(segments.encode_value(value))
+    assert decoded == value and type(decoded) is type(value)
+    if isinstance(value, datetime) and value.tzinfo:
+        assert decoded.utcoffset() == value.utcoffset()
+
+
+def test_reading_stops_at_a_torn_or_corrupt_record():
+    docs = [{"_id": f"d{i}", "n": i} for i in range(3)]
+    data = io.BytesIO()
+    segments.write_segment(data, docs)
+    intact = data.getvalue()[len(segments.HEADER):]
+    last = len(segments.frame(segments.encode_value(docs[-1])))
+
+    torn = io.BytesIO(intact[:-1])
+    assert [segments.decode_value(p) for _, p in segments.iter_records(torn)] == docs[:2]
+    corrupt = bytearray(intact)
+    corrupt[-last + segments.RECORD_OVERHEAD] ^= 0xFF
+    assert [segments.decode_value(p) for _, p in segments.iter_records(io.BytesIO(bytes(corrupt)))] == docs[:2]
+
+
+def test_segment_files_are_checked_for_their_header(tmp_path):
+    path = tmp_path / "faqs.seg"
+    path.write_bytes(b"[]")
+    with pytest.raises(segments.SegmentError):
+        segments.read_segment(path)
+
+
+def test_converter_round_trips_a_json_collection(tmp_path):
+    source = tmp_path / "faqs.json"
+    source.write_text('[{"_id": "f1", "tags": ["a"], "n": 1.5}]', encoding="utf-8")
+    segment = segments.json_to_segment(source)
+    assert segments.read_segment(segment) == [{"_id": "f1", "tags": ["a"], "n": 1.5}]
+    back = segments.segment_to_json(segment, tmp_path / "back.json")
+    assert json.loads(back.read_text(encoding="utf-8")) == json.loads(source.read_text(encoding="utf-8"))
+
+
+async def test_binary_collections_keep_datetimes(open_storage):
+    created = datetime(2024, 5, 1, 12, 30)
+    engine = open_storage(format="binary", journal=True)
+    await engine.insert_one("content", {"_id": "c1", "created_at": created})
+    assert (await engine.find_one("content", {"_id": "c1"}))["created_at"] == created
+    await engine.close()
+    assert (await open_storage(format="binary").find_one("content", {"_id": "c1"}))["created_at"] == created
+
+
+@pytest.mark.parametrize("source, target", [("json", "binary"), ("binary", "json")])
+async def test_collections_are_converted_on_startup(open_storage, data_dir, source, target):
+    engine = open_storage(format=source, journal=True)
+    for i in range(5):
+        await engine.insert_one("faqs", {"_id": f"f{i}"})
+    await engine.delete_one("faqs", {"_id": "f0"})
+    # Left unclosed, so the journal has to be folded into the conversion.
+
+    converted = open_storage(format=target)
+    assert await ids(converted, "faqs") == [f"f{i}" for i in range(1, 5)]
+    old_suffix = engine.FORMATS[source][0]
+    assert (data_dir / f"faqs{old_suffix}.migrated").exists()
+    assert not engine._journal_path("faqs").exists()
@@ -0,0 +1,72 @@
+"""Shared storage: several processes reading and writing one data directory."""
+
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+import storage
+from .conftest import ids
+
+BACKEND = Path(storage.__file__).resolve().parent
+
+WRITER = """
+import asyncio, sys
+from storage import FileStorage
+
+async def main(data_dir, name, journal):
+    engine = FileStorage(data_dir, shared=True, journal=journal, durability="none", commit_window=0)
+    for i in range(30):
+        await engine.insert_one("faqs", {"_id": f"{name}-{i:02d}", "writer": name})
+        await engine.update_one("faqs", {"_id": f"{name}-{i:02d}"}, {"$set": {"done": True}})
+    await engine.close()
+
+asyncio.run(main(sys.argv[1], sys.argv[2], sys.argv[3] == "journal"))
+"""
+
+
+@pytest.mark.parametrize("journal", [False, True])
+async def test_concurrent_writer_processes_lose_nothing(open_storage, data_dir, journal):
+    # Create the data directory, as the app does before starting workers.
+    await open_storage(shared=True, journal=journal).close()
+    mode = "journal" if journal else "snapshot"
+    writers = [
+        subprocess.Popen([sys.executable, "-c", WRITER, str(data_dir), f"w{n}", mode], cwd=BACKEND)
+        for n in range(4)
+    ]
+    assert [writer.wait(timeout=60) for writer in writers] == [0] * 4
+
+    engine = open_storage(journal=journal)
+    docs = await engine.find("faqs", {})
+    assert len(docs) == 120
+    assert all(doc["done"] for doc in docs)
+
+
+@pytest.mark.parametrize("journal", [False, True])
+async def test_each_process_sees_the_others_writes(open_storage, journal):
+    first = open_storage(shared=True, journal=journal, snapshot_every=4)
+    second = open_storage(shared=True, journal=journal, snapshot_every=4)
+    await first.find("faqs", {})
+    await second.find("faqs", {})
+
+    for i in range(6):
+        writer, reader = (first, second) if i % 2 else (second, first)
+        await writer.insert_one("faqs", {"_id": f"f{i}"})
+        assert await ids(reader, "faqs") == [f"f{n}" for n in range(i + 1)]
+    await first.delete_one("faqs", {"_id": "f0"})
+    assert await ids(second, "faqs") == [f"f{n}" for n in range(1, 6)]
+    await first.close()
+    await second.close()
+
+
+async def test_new_partitions_are_picked_up(open_storage):
+    partitions = {"content": "user_id"}
+    first = open_storage(shared=True, partitions=partitions)
+    second = open_storage(shared=True, partitions=partitions)
+    await first.insert_one("content", {"_id": "c1", "user_id": "u1"})
+    assert await ids(second, "content") == ["c1"]
+    await second.insert_one("content", {"_id": "c2", "user_id": "u2"})
+    assert await ids(first, "content") == ["c1", "c2"]
+    await first.close()
+    await second.close()
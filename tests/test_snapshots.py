@@ -0,0 +1,79 @@
+"""Copy-on-write versions: pinned snapshots survive writes, unpinned ones are not copied."""
+
+import pytest
+
+
+async def _fill(engine, count=50):
+    await engine.create_index("faqs", "group")
+    await engine.create_index("faqs", [("group", 1), ("n", -1)])
+    await engine.insert_many("faqs", [{"_id": f"f{i:02d}", "n": i, "group": i % 3} for i in range(count)])
+    return engine._cache["faqs"]
+
+
+@pytest.mark.parametrize("query, sort", [
+    ({}, None),
+    ({"group": 1}, None),
+    ({"group": 2}, [("n", -1)]),
+    ({"n": {"$gte": 10}}, [("n", 1)]),
+])
+async def test_a_pinned_snapshot_survives_writes(open_storage, query, sort):
+    engine = open_storage()
+    await _fill(engine)
+    expected = await engine.find("faqs", query, sort=sort)
+
+    seen = []
+    async for batch in engine.find_batches("faqs", query, sort=sort, batch_size=4):
+        if not seen:
+            # Every kind of write, to documents the cursor has yet to reach
+            await engine.update_many("faqs", {}, {"$set": {"group": 9}})
+            await engine.delete_many("faqs", {"n": {"$lt": 25}})
+            await engine.insert_many("faqs", [{"_id": f"new{i}", "n": i, "group": 1} for i in range(5)])
+        seen.extend(batch)
+    assert seen == expected
+    assert len(await engine.find("faqs", {})) == 30
+
+
+async def test_writes_without_readers_change_the_state_in_place(open_storage):
+    engine = open_storage()
+    state = await _fill(engine)
+    docs, indexes = state.docs, state.indexes
+    await engine.update_one("faqs", {"_id": "f01"}, {"$set": {"n": 100}})
+    await engine.delete_one("faqs", {"_id": "f02"})
+    assert state.docs is docs and state.indexes is indexes
+    assert state.generation == 0
+
+
+async def test_only_the_first_write_under_a_pin_copies(open_storage):
+    engine = open_storage()
+    state = await _fill(engine)
+    version = state.pin()
+    docs = state.docs
+    await engine.update_one("faqs", {"_id": "f01"}, {"$set": {"n": 100}})
+    copied = state.docs
+    assert copied is not docs and version.docs is docs
+    assert version.docs["f01"]["n"] == 1
+    assert version.indexes["group_hash"].lookup(1) == state.indexes["group_hash"].lookup(1)
+
+    await engine.insert_one("faqs", {"_id": "f99", "group": 1})
+    assert state.docs is copied
+    assert "f99" in state.indexes["group_hash"].lookup(1)
+    assert "f99" not in version.indexes["group_hash"].lookup(1)
+    version.release()
+    assert state.pins == 0
+
+
+async def test_a_write_under_a_pin_copies_only_the_hash_buckets_it_changes(open_storage):
+    engine = open_storage()
+    state = await _fill(engine)
+    version = state.pin()
+    await engine.update_one("faqs", {"_id": "f01"}, {"$set": {"n": 100}})
+
+    pinned, current = version.indexes["group_hash"].buckets, state.indexes["group_hash"].buckets
+    # Only the bucket holding f01 is copied.
+    assert current[0] is pinned[0] and current[2] is pinned[2] and current[1] is not pinned[1]
+    await engine.update_one("faqs", {"_id": "f01"}, {"$set": {"group": 0}})
+    assert current[2] is pinned[2]
+    assert current[0] is not pinned[0] and current[1] is not pinned[1]
+    assert "f01" in pinned[1] and "f01" not in pinned[0]
+    assert "f01" in current[0] and "f01" not in current[1]
+    version.release()
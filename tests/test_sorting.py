@@ -0,0 +1,85 @@
+"""Sorted queries: a bounded heap for sort+limit must agree with a full sort."""
+
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from sqlite_storage import SQLiteStorage
+
+SORTS = [
+    [("score", 1)],
+    [("score", -1)],
+    [("group", 1), ("score", -1)],
+    [("group", -1), ("score", 1), ("_id", -1)],
+    [("meta.rank", 1)],
+]
+
+
+def _documents(count=300):
+    rng = random.Random(5)
+    docs = []
+    for i in range(count):
+        doc = {"_id": f"d{i:03d}", "group": rng.choice(["a", "b", None]), "meta": {"rank": rng.randrange(20)}}
+        # Ties, missing values and mixed types all have to order the same way.
+        kind = rng.randrange(4)
+        if kind == 0:
+            doc["score"] = rng.randrange(10)
+        elif kind == 1:
+            doc["score"] = rng.randrange(10) + 0.5
+        elif kind == 2:
+            doc["score"] = rng.choice(["x", "y"])
+        docs.append(doc)
+    return docs
+
+
+@pytest.mark.parametrize("sort", SORTS)
+async def test_sort_with_limit_matches_a_full_sort(open_storage, sort):
+    engine = open_storage()
+    await engine.insert_many("faqs", _documents())
+    full = [doc["_id"] for doc in await engine.find("faqs", {}, sort=sort)]
+    for skip, limit in [(0, 1), (0, 5), (10, 25), (290, 50)]:
+        top = await engine.find("faqs", {}, sort=sort, skip=skip, limit=limit)
+        assert [doc["_id"] for doc in top] == full[skip:skip + limit], (skip, limit)
+        batches = [doc["_id"] async for batch in engine.find_batches("faqs", {}, sort=sort, skip=skip,
+                                                                      limit=limit, batch_size=7)
+                   for doc in batch]
+        assert batches == full[skip:skip + limit], (skip, limit)
+
+
+async def test_mixed_directions_order_by_each_field(open_storage):
+    engine = open_storage()
+    await engine.insert_many("faqs", _documents())
+    docs = await engine.find("faqs", {"score": {"$exists": True}, "group": {"$in": ["a", "b"]}},
+                             sort=[("group", 1), ("score", -1)])
+    rank = {int: 1, float: 1, str: 2}
+    keys = [(doc["group"], rank[type(doc["score"])], doc["score"]) for doc in docs]
+    # The same order from one stable sort per field, last field first
+    expected = sorted(sorted(keys, key=lambda key: key[1:], reverse=True), key=lambda key: key[0])
+    assert keys == expected
+
+
+async def test_datetimes_and_iso_strings_order_together(open_storage, tmp_path):
+    start = datetime(2026, 3, 1, 9, 30)
+    times = [start + timedelta(hours=7 * i) for i in range(12)]
+    # Every other value is an ISO string with a "T", as a client would send it.
+    docs = [{"_id": f"d{i:02d}", "at": at if i % 2 else at.isoformat()} for i, at in enumerate(times)]
+    random.Random(2).shuffle(docs)
+    engine = open_storage()
+    await engine.insert_many("faqs", docs)
+    chronological = [f"d{i:02d}" for i in range(12)]
+    assert [doc["_id"] for doc in await engine.find("faqs", {}, sort=[("at", 1)])] == chronological
+    for bound in (times[5], times[5].isoformat()):
+        later = await engine.find("faqs", {"at": {"$gt": bound}}, sort=[("at", 1)])
+        assert [doc["_id"] for doc in later] == chronological[6:], bound
+        earlier = await engine.find("faqs", {"at": {"$lt": bound}}, sort=[("at", 1)])
+        assert [doc["_id"] for doc in earlier] == chronological[:5], bound
+
+    # SQLite compares stored strings as text, but an ISO bound still matches stored datetimes.
+    sqlite = SQLiteStorage(str(tmp_path / "blotato.db"), durability="none")
+    await sqlite.insert_many("faqs", [{"_id": f"d{i:02d}", "at": at} for i, at in enumerate(times)])
+    for query in ({"at": {"$gt": times[5].isoformat()}}, {"at": {"$lte": times[5].isoformat()}}):
+        assert [doc["_id"] for doc in await sqlite.find("faqs", query, sort=[("at", 1)])] == \
+            [doc["_id"] for doc in await engine.find("faqs", query, sort=[("at", 1)])], query
+    await sqlite.close()
+    await engine.close()
@@ -0,0 +1,178 @@
+"""The SQLite engine must answer queries exactly as the file engine does."""
+
+import pytest
+
+import storage
+from sqlite_storage import SQLiteStorage, _translate_query
+from storage import BulkWriteError, DuplicateKeyError
+from .conftest import ids, open_pair, strip
+
+DOCS = [
+    {"_id": "d00", "n": 1, "s": "apple", "tags": ["a", "b"], "meta": {"a": 1}},
+    {"_id": "d01", "n": 1.0, "s": "Banana", "tags": "a", "meta": '{"a":1}'},
+    {"_id": "d02", "n": "1", "s": "cherry", "meta": {"a": 2, "b": [1]}},
+    {"_id": "d03", "n": None, "s": "", "tags": []},
+    {"_id": "d04", "s": "date", "meta": {"a": {"deep": True}}},
+    {"_id": "d05", "n": True, "s": "elder"},
+    {"_id": "d06", "n": 2.5, "s": "fig", "meta": None},
+    {"_id": "d07", "n": -3, "s": "grape", "tags": ["b"]},
+    {"_id": "d08", "n": "zeta", "s": "apple"},
+    {"_id": "d09", "n": 0, "s": "kiwi", "meta": {"a": 1}},
+]
+
+QUERIES = [
+    # Pushed down to SQL exactly
+    {"s": "apple"},
+    {"n": 1},
+    {"n": {"$in": [1, "zeta"]}},
+    {"n": {"$gt": 0}},
+    {"n": {"$lte": "m"}},
+    {"s": {"$gte": "c", "$lt": "g"}},
+    {"tags": {"$exists": True}},
+    {"meta": {"$exists": False}},
+    {"tags": "a"},
+    {"meta": '{"a":1}'},
+    {"tags": '["b"]'},
+    {"_id": {"$in": ["d01", "d05", "nope"]}},
+    # Left to the Python filter, alone or alongside SQL conditions
+    {"n": None},
+    {"n": {"$in": [None, 2.5]}},
+    {"n": {"$ne": 1}},
+    {"n": {"$nin": ["1", None]}, "s": {"$gt": "b"}},
+    {"meta": {"a": 1}},
+    {"tags": ["b"]},
+    {"meta.a": 1},
+    {"meta.a.deep": True},
+    {"_id": {"$gt": "d05"}},
+    {"n": {"$in": []}},
+]
+
+SORTS = [None, [("n", 1)], [("s", -1), ("n", 1)], [("meta.a", 1)]]
+
+
+async def _engines(open_storage, tmp_path, docs=DOCS):
+    """Return a file engine and a SQLite engine holding the same documents."""
+    file = open_storage()
+    sqlite = SQLiteStorage(str(tmp_path / "blotato.db"), durability="none")
+    for engine in (file, sqlite):
+        await engine.insert_many("faqs", [dict(doc) for doc in docs])
+    return file, sqlite
+
+
+async def _ids_in_order(engine, sort):
+    return [doc["_id"] for doc in await engine.find("faqs", {}, sort=sort)]
+
+
+def test_translation_is_exact_only_where_sql_matches_python():
+    assert _translate_query({"s": "apple", "n": {"$gt": 0}})[2]
+    for query in ({"n": None}, {"n": {"$ne": 1}}, {"meta": {"a": 1}}, {"meta.a": 1}, {"_id": {"$gt": "d"}}):
+        assert not _translate_query(query)[2], query
+
+
+async def test_queries_match_the_file_engine(open_storage, tmp_path):
+    file, sqlite = await _engines(open_storage, tmp_path)
+    for query in QUERIES:
+        for sort in SORTS:
+            for skip, limit in [(0, None), (1, 2)]:
+                if sort is None and (skip or limit):
+                    continue
+                want = strip(await file.find("faqs", query, sort=sort, skip=skip, limit=limit))
+                got = strip(await sqlite.find("faqs", query, sort=sort, skip=skip, limit=limit))
+                assert got == want, (query, sort, skip, limit)
+        first = await file.find_one("faqs", query)
+        assert strip([await sqlite.find_one("faqs", query) or {}]) == strip([first or {}]), query
+        assert await sqlite.count_documents("faqs", query) == await file.count_documents("faqs", query), query
+    await sqlite.close()
+
+
+async def test_writes_match_the_file_engine(open_storage, tmp_path):
+    engines = await _engines(open_storage, tmp_path)
+    for engine in engines:
+        await engine.create_index("faqs", "s")
+        assert await engine.update_many("faqs", {"n": {"$gt": 0}}, {"$set": {"positive": True}}) == {"modified_count": 4}
+        assert await engine.delete_many("faqs", {"s": "apple"}) == {"deleted_count": 2}
+        assert await engine.update_one("faqs", {"_id": "d03"}, {"$set": {"n": 7}}) == {"modified_count": 1}
+        assert await engine.delete_one("faqs", {"_id": "nobody"}) == {"deleted_count": 0}
+        for _ in range(2):
+            await engine.update_many("faqs", {"_id": {"$in": ["d03", "d04", "d06", "d07"]}}, {"$inc": {"n": 2, "hits": 1}})
+    file, sqlite = engines
+    assert strip(await sqlite.find("faqs", {}, sort=[("_id", 1)])) == strip(await file.find("faqs", {}, sort=[("_id", 1)]))
+    await sqlite.close()
+    reopened = SQLiteStorage(str(tmp_path / "blotato.db"))
+    assert await ids(reopened, "faqs") == await ids(file, "faqs")
+    await reopened.close()
+
+
+@pytest.mark.parametrize("ordered, expected", [(True, ["a", "b"]), (False, ["a", "b", "d"])])
+async def test_failed_bulk_operations_roll_back_alone(tmp_path, ordered, expected):
+    engine = SQLiteStorage(str(tmp_path / "blotato.db"))
+    await engine.create_index("api_keys", "key", unique=True)
+    await engine.insert_one("api_keys", {"_id": "a", "key": "k1"})
+    with pytest.raises(BulkWriteError) as raised:
+        await engine.bulk_write("api_keys", [
+            {"insert_one": {"document": {"_id": "b", "key": "k2"}}},
+            {"insert_one": {"document": {"_id": "c", "key": "k1"}}},
+            {"insert_one": {"document": {"_id": "d", "key": "k4"}}},
+        ], ordered=ordered)
+    assert [error["index"] for error in raised.value.errors] == [1]
+    assert await ids(engine, "api_keys") == expected
+    with pytest.raises(DuplicateKeyError):
+        await engine.insert_one("api_keys", {"_id": "a"})
+    with pytest.raises(DuplicateKeyError):
+        await engine.update_one("api_keys", {"_id": "b"}, {"$set": {"key": "k1"}})
+    await engine.close()
+
+
+async def test_a_cursor_reads_one_snapshot(tmp_path):
+    engine = SQLiteStorage(str(tmp_path / "blotato.db"))
+    await engine.insert_many("faqs", [{"_id": f"f{i:02d}", "n": i} for i in range(30)])
+    seen = []
+    async for batch in engine.find_batches("faqs", {}, sort=[("n", 1)], batch_size=10):
+        seen.extend(doc["_id"] for doc in batch)
+        if len(seen) == 10:
+            await engine.delete_many("faqs", {"n": {"$gte": 20}})
+            await engine.insert_one("faqs", {"_id": "late", "n": 15.5})
+    assert seen == [f"f{i:02d}" for i in range(30)]
+    assert len(await engine.find("faqs", {})) == 21
+    await engine.close()
+
+
+async def test_engines_are_picked_by_name():
+    engine = storage.create_storage("sqlite")
+    assert isinstance(engine, SQLiteStorage)
+    await engine.close()
+    with pytest.raises(ValueError):
+        storage.create_storage("mongodb")
+
+
+async def test_cursors_and_snapshots_reuse_reader_connections(open_storage, tmp_path, monkeypatch):
+    _, sqlite = await _engines(open_storage, tmp_path)
+    opened = []
+    open_connection = sqlite._pool.open
+    monkeypatch.setattr(sqlite._pool, "open", lambda: opened.append(1) or open_connection())
+    for _ in range(3):
+        assert [doc async for batch in sqlite.find_batches("faqs", {}, batch_size=3) for doc in batch]
+        async with sqlite.snapshot() as read:
+            assert [doc async for batch in read("faqs") for doc in batch]
+        assert await sqlite.count_documents("faqs", {"meta.a": 1}) == 2
+    assert len(opened) == 1
+
+    # A reader left mid-way gives its connection back without a transaction.
+    async for batch in sqlite.find_batches("faqs", {}, batch_size=2):
+        break
+    async with sqlite.snapshot() as read:
+        async for batch in read("faqs", 2):
+            break
+    await sqlite.insert_one("faqs", {"_id": "late"})
+    assert "late" in await ids(sqlite, "faqs")
+    await sqlite.close()
+
+
+async def test_objects_and_arrays_sort_by_their_json_text(open_storage, tmp_path):
+    """The documented difference from the file engine, which sorts them after every scalar."""
+    file, sqlite = await _engines(open_storage, tmp_path)
+    unset = ["d03", "d05", "d06", "d07", "d08"]
+    # d01 holds the string '{"a":1}', the JSON text of the d00 and d09 objects.
+    assert await _ids_in_order(file, [("meta", 1)]) == unset + ["d01", "d00", "d09", "d02", "d04"]
+    assert await _ids_in_order(sqlite, [("meta", 1)]) == unset + ["d00", "d01", "d09", "d02", "d04"]
+    await sqlite.close()
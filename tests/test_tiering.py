@@ -0,0 +1,154 @@
+"""Tiered storage: cold documents move to the archive and queries route around it."""
+
+import asyncio
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import storage
+
+from .conftest import open_pair, strip
+
+POLICY = {"content": {"field": "created_at", "days": 90, "final": {"status": ["published"]}}}
+
+QUERIES = [
+    ({}, None, None),
+    ({"user_id": "u1"}, [("created_at", -1)], 10),
+    ({"status": "draft"}, [("created_at", -1)], 5),
+    ({"created_at": {"$gte": datetime.utcnow() - timedelta(days=30)}}, None, None),
+    ({"status": "published", "user_id": {"$in": ["u0", "u2"]}}, [("created_at", 1)], None),
+]
+
+
+def _content(now, count=600):
+    rng = random.Random(3)
+    return [
+        {
+            "_id": f"c{i:04d}",
+            "user_id": f"u{i % 3}",
+            "title": f"t{i}",
+            "content_type": "text",
+            "status": rng.choice(["draft", "scheduled", "published"]),
+            "created_at": now - timedelta(days=i * 400 / count, minutes=i),
+        }
+        for i in range(count)
+    ]
+
+
+def _cold(doc, now):
+    return doc["status"] == "published" or doc["created_at"] < now - timedelta(days=90)
+
+
+async def _open_pair(open_storage, tmp_path, docs, policy=POLICY):
+    """Return a tiered engine and an untiered one holding the same documents."""
+    return await open_pair(open_storage, tmp_path, "content", docs, {"tiering": policy, "tier_interval": 0},
+                           indexes=[[("user_id", 1), ("created_at", -1)]])
+
+
+async def _same_results(tiered, plain):
+    for query, sort, limit in QUERIES:
+        got = strip(await tiered.find("content", query, sort=sort, limit=limit), ("updated_at",))
+        want = strip(await plain.find("content", query, sort=sort, limit=limit), ("updated_at",))
+        if sort is None:
+            # Archived documents come after the hot ones.
+            got, want = sorted(got, key=lambda d: d["_id"]), sorted(want, key=lambda d: d["_id"])
+        assert got == want, query
+        assert await tiered.count_documents("content", query) == await plain.count_documents("content", query)
+
+
+async def test_cold_documents_move_to_the_archive(open_storage, tmp_path, data_dir):
+    now = datetime.utcnow()
+    docs = _content(now)
+    tiered, plain = await _open_pair(open_storage, tmp_path, docs)
+    cold = sum(_cold(doc, now) for doc in docs)
+
+    assert await tiered.tier("content") == cold
+    stats = tiered.tiering_stats()["collections"]["content"]
+    assert (stats["hot_docs"], stats["archived_docs"]) == (len(docs) - cold, cold)
+    assert (data_dir / "content.arc").exists()
+    await _same_results(tiered, plain)
+
+    await tiered.close()
+    await _same_results(open_storage(tiering=POLICY, tier_interval=0), plain)
+    await plain.close()
+
+
+async def test_recent_queries_do_not_read_the_archive(open_storage, tmp_path, monkeypatch):
+    now = datetime.utcnow()
+    policy = {"content": {"field": "created_at", "days": 90}}
+    tiered, plain = await _open_pair(open_storage, tmp_path, _content(now), policy)
+    await tiered.tier("content")
+
+    reads = []
+    read_block = storage._Archive.docs
+    monkeypatch.setattr(storage._Archive, "docs", lambda archive, number: reads.append(number) or read_block(archive, number))
+    for query, sort, limit in [
+        ({"user_id": "u2", "created_at": {"$gte": now - timedelta(days=10)}}, [("created_at", -1)], None),
+        ({"status": "draft", "created_at": {"$gte": now - timedelta(days=60)}}, None, None),
+        # The newest documents come from the hot tier alone.
+        ({"user_id": "u1"}, [("created_at", -1)], 5),
+    ]:
+        got = strip(await tiered.find("content", query, sort=sort, limit=limit), ("updated_at",))
+        want = strip(await plain.find("content", query, sort=sort, limit=limit), ("updated_at",))
+        if sort is None:
+            got, want = sorted(got, key=lambda d: d["_id"]), sorted(want, key=lambda d: d["_id"])
+        assert got == want, query
+    latest = {"status": "draft", "created_at": {"$gte": now - timedelta(days=60)}}
+    assert await tiered.count_documents("content", latest) == await plain.count_documents("content", latest)
+    assert reads == []
+
+    assert await tiered.count_documents("content", {"status": "published"}) == \
+        await plain.count_documents("content", {"status": "published"})
+    assert reads
+    await tiered.close()
+    await plain.close()
+
+
+async def test_writes_to_archived_documents_move_them_back(open_storage, tmp_path):
+    now = datetime.utcnow()
+    docs = _content(now)
+    tiered, plain = await _open_pair(open_storage, tmp_path, docs)
+    await tiered.tier("content")
+    archived = tiered.tiering_stats()["collections"]["content"]["archived_docs"]
+    old = docs[-1]["_id"]
+
+    for engine in (tiered, plain):
+        await engine.update_one("content", {"_id": old}, {"$set": {"title": "edited"}})
+        await engine.delete_one("content", {"_id": docs[-2]["_id"]})
+    assert tiered.tiering_stats()["collections"]["content"]["archived_docs"] == archived - 2
+    await _same_results(tiered, plain)
+
+    await tiered.close()
+    reopened = open_storage(tiering=POLICY, tier_interval=0)
+    assert (await reopened.find_one("content", {"_id": old}))["title"] == "edited"
+    await _same_results(reopened, plain)
+    await plain.close()
+
+
+async def test_archived_ids_stay_unique(open_storage, tmp_path):
+    docs = _content(datetime.utcnow(), 50)
+    tiered, plain = await _open_pair(open_storage, tmp_path, docs)
+    await tiered.tier("content")
+    with pytest.raises(storage.DuplicateKeyError):
+        await tiered.insert_one("content", dict(docs[-1]))
+    await tiered.close()
+    await plain.close()
+
+
+async def test_background_tiering_failures_are_logged(open_storage, monkeypatch, caplog):
+    engine = open_storage(tiering=POLICY, tier_interval=0.01)
+    await engine.insert_many("content", _content(datetime.utcnow(), 50))
+
+    def full_disk(*args):
+        raise OSError("disk full")
+    monkeypatch.setattr(storage.FileStorage, "_write_archive", full_disk)
+    with caplog.at_level("ERROR", logger="storage"):
+        for _ in range(200):
+            if "Failed to tier 'content'" in caplog.messages:
+                break
+            await asyncio.sleep(0.01)
+    assert "Failed to tier 'content'" in caplog.messages
+    assert "last_error" in engine.tiering_stats()["collections"]["content"]
+    assert engine.tiering_stats()["collections"]["content"]["archived_docs"] == 0
+    await engine.close()
@@ -0,0 +1,127 @@
+"""JWT verification and the cache of verified tokens."""
+
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+
+import auth
+import storage
+
+
+def _credentials(token):
+    return HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+
+
+@pytest.fixture
+def decodes(monkeypatch):
+    """Count the signature checks made, with a fresh token cache."""
+    monkeypatch.setattr(auth, "token_cache", auth.TokenCache(4))
+    calls = []
+    decode = auth.jwt.decode
+    monkeypatch.setattr(auth.jwt, "decode", lambda *args, **kwargs: calls.append(args[0]) or decode(*args, **kwargs))
+    return calls
+
+
+def test_a_reused_token_is_checked_once(decodes):
+    token = auth.create_access_token({"sub": "single-user"})
+    assert [auth.verify_token(_credentials(token)) for _ in range(3)] == ["single-user"] * 3
+    assert decodes == [token]
+
+
+def test_tokens_that_fail_are_not_cached(decodes):
+    token = auth.create_access_token({"sub": "single-user"}) + "x"
+    for _ in range(2):
+        with pytest.raises(HTTPException):
+            auth.verify_token(_credentials(token))
+    assert len(decodes) == 2
+
+
+def test_an_expired_token_is_checked_again(decodes, monkeypatch):
+    token = auth.create_access_token({"sub": "single-user"}, expires_delta=timedelta(seconds=60))
+    auth.verify_token(_credentials(token))
+    later = time.time() + 120
+    monkeypatch.setattr(auth.time, "time", lambda: later)
+    assert auth.token_cache.get(token) is None
+    assert len(auth.token_cache._entries) == 0
+
+
+def test_the_cache_keeps_the_most_recently_used_tokens(decodes):
+    tokens = [auth.create_access_token({"sub": f"user-{i}"}) for i in range(5)]
+    for token in tokens:
+        auth.verify_token(_credentials(token))
+    auth.verify_token(_credentials(tokens[1]))
+    auth.verify_token(_credentials(tokens[0]))
+    assert decodes == tokens + [tokens[0]]
+    assert auth.token_cache.get(tokens[2]) is None and auth.token_cache.get(tokens[1])[0] == "user-1"
+
+
+def test_tokens_without_an_expiry_and_a_zero_size_are_not_cached(decodes, monkeypatch):
+    token = auth.jwt.encode({"sub": "single-user"}, auth.SECRET_KEY, algorithm=auth.ALGORITHM)
+    auth.verify_token(_credentials(token))
+    auth.verify_token(_credentials(token))
+    monkeypatch.setattr(auth, "token_cache", auth.TokenCache(0))
+    expiring = auth.create_access_token({"sub": "single-user"})
+    auth.verify_token(_credentials(expiring))
+    auth.verify_token(_credentials(expiring))
+    assert len(decodes) == 4
+
+
+def test_verify_auth_uses_the_cache(client, bearer, decodes):
+    for _ in range(3):
+        assert client.get("/api/auth/me", headers=bearer).status_code == 200
+    assert len(decodes) == 1
+
+
+def test_logging_out_revokes_only_the_token_used(client, bearer):
+    other = {"Authorization": f"Bearer {auth.create_access_token({'sub': 'single-user'})}"}
+    for headers in (bearer, other):
+        assert client.get("/api/auth/me", headers=headers).status_code == 200
+    assert client.post("/api/auth/logout", headers=bearer).status_code == 200
+
+    # The token was cached, and is refused all the same.
+    assert client.get("/api/auth/me", headers=bearer).status_code == 401
+    assert client.post("/api/auth/logout", headers=bearer).status_code == 401
+    assert client.get("/api/auth/me", headers=other).status_code == 200
+
+
+def test_revocations_are_stored_and_reloaded(client, bearer):
+    client.post("/api/auth/logout", headers=bearer)
+    token = bearer["Authorization"].split()[1]
+    [stored] = client.portal.call(storage.storage.find, "revoked_tokens", {})
+    assert stored["_id"] == auth.jwt.get_unverified_claims(token)["jti"]
+
+    auth.token_revocations._revoked.clear()
+    auth.token_cache.clear()
+    assert client.get("/api/auth/me", headers=bearer).status_code == 200
+    client.portal.call(auth.token_revocations.load)
+    assert client.get("/api/auth/me", headers=bearer).status_code == 401
+
+
+def test_tokens_without_an_id_are_revoked_by_digest(client):
+    token = auth.jwt.encode({"sub": "single-user", "exp": time.time() + 60}, auth.SECRET_KEY, algorithm=auth.ALGORITHM)
+    headers = {"Authorization": f"Bearer {token}"}
+    assert client.post("/api/auth/logout", headers=headers).status_code == 200
+    assert client.get("/api/auth/me", headers=headers).status_code == 401
+    client.portal.call(auth.revoke_token, token)
+    assert len(auth.token_revocations) == 1
+
+
+def test_revocations_of_expired_tokens_are_pruned(client):
+    client.portal.call(auth.token_revocations.revoke, "old", datetime.utcnow() - timedelta(seconds=1))
+    client.portal.call(auth.token_revocations.revoke, "current", datetime.utcnow() + timedelta(hours=1))
+    client.portal.call(auth.token_revocations.prune)
+    assert not auth.token_revocations.is_revoked("old") and auth.token_revocations.is_revoked("current")
+    assert [doc["_id"] for doc in client.portal.call(storage.storage.find, "revoked_tokens", {})] == ["current"]
+
+
+def test_a_new_secret_is_not_served_from_the_cache(decodes, monkeypatch):
+    token = auth.create_access_token({"sub": "single-user"})
+    assert auth.verify_token(_credentials(token)) == "single-user"
+    monkeypatch.setattr(auth, "SECRET_KEY", "rotated")
+    assert auth.token_cache.get(token) is None
+    with pytest.raises(HTTPException):
+        auth.verify_token(_credentials(token))
+    assert decodes == [token, token]